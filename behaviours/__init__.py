@@ -1,8 +1,15 @@
-from typing import TypeVar, Sequence, Callable, Coroutine
+from typing import Any, TypeVar, Sequence, Callable, Coroutine, Iterable
+import os
 import logging
 import asyncio
+import time
 import hikari
 import lightbulb
+import commons.db as db
+from commons import message_context, metrics
+from commons.event_queue import EventQueue, QueueStats
+from commons.recorder import Recorder
+from commons.routing import Background, Dispatcher, Pipeline
 
 from behaviours import notalurker, jimmy_nerfer, messageparty
 from behaviours import userinfo
@@ -10,7 +17,8 @@ from behaviours import meme_repost_blocker, meme_rater, rant_patrol, paidnotpaye
 from behaviours import snark, deletes, duplicate_message_policing, fight_club
 
 _Evt = TypeVar("_Evt", bound=hikari.Event)
-_Chain = Sequence[Sequence[Callable[[_Evt], Coroutine[None, None, None]]]]
+_Handler = Callable[[_Evt], Coroutine[None, None, None]]
+_Chain = Sequence[Sequence[_Handler[_Evt]] | Background[_Evt]]
 
 _message_create_chain: _Chain[hikari.GuildMessageCreateEvent] = [
     # Message filtering & deletion
@@ -19,12 +27,18 @@ _message_create_chain: _Chain[hikari.GuildMessageCreateEvent] = [
         jimmy_nerfer.delete_duplicate,
         duplicate_message_policing.delete_duplicate,
     ],
+    # Downloading, hashing and rating memes takes seconds, so it runs beside
+    # the rest of the chain. Only rate meme if not a repost.
+    Background(
+        "memes",
+        [
+            [meme_repost_blocker.main],
+            [meme_rater.msg_create],
+        ],
+    ),
     # Stats collection & triggers
     [userinfo.analyse_message],
     [messageparty.main],
-    # Only rate meme if not a repost
-    [meme_repost_blocker.main],
-    [meme_rater.msg_create],
     # Generic responses
     [rant_patrol.main],
     [fight_club.main],
@@ -40,6 +54,7 @@ _message_delete_chain: _Chain[hikari.GuildMessageDeleteEvent] = [
     [
         deletes.delete_increment,
         duplicate_message_policing.delete_hash,
+        meme_repost_blocker.delete_hash,
     ]
 ]
 
@@ -57,23 +72,200 @@ _reaction_remove_chain: _Chain[hikari.GuildReactionDeleteEvent] = [
     [userinfo.remove_reaction]
 ]
 
+# Every chain, by the event it handles.
+CHAINS: dict[type[hikari.Event], _Chain[Any]] = {
+    hikari.GuildMessageCreateEvent: _message_create_chain,
+    hikari.GuildMessageUpdateEvent: _message_update_chain,
+    hikari.GuildMessageDeleteEvent: _message_delete_chain,
+    hikari.GuildReactionAddEvent: _reaction_add_chain,
+    hikari.GuildReactionDeleteEvent: _reaction_remove_chain,
+}
+
+
+# Events that take back what an earlier one counted. Losing one would leave
+# the counts too high for good, so they are never dropped or shed and always
+# wait for room in the queue.
+CRITICAL: frozenset[type[hikari.Event]] = frozenset(
+    {hikari.GuildMessageDeleteEvent, hikari.GuildReactionDeleteEvent}
+)
+
 
 class EndProcessing(Exception):
     pass
 
 
-def register(bot: lightbulb.BotApp):
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+# One queue for every event type, so a message's create, edit and delete are
+# handled in the order they happened. Its capacity bounds the events in
+# flight; listeners past it wait, or drop what only sheddable handlers want.
+_events = EventQueue(
+    "events",
+    workers=_int_env("KITTY_EVENT_WORKERS", 16),
+    capacity=_int_env("KITTY_EVENT_QUEUE", 1000),
+    shed_at=_int_env("KITTY_EVENT_SHED_AT", 200),
+)
+
+# Background stages queue separately, still in order per channel, so they
+# neither hold up the next event in their channel nor run unbounded. Nothing
+# in them is sheddable, so shedding is left off.
+_BACKGROUND_QUEUE = _int_env("KITTY_BACKGROUND_QUEUE", 200)
+_background = EventQueue(
+    "background",
+    workers=_int_env("KITTY_BACKGROUND_WORKERS", 4),
+    capacity=_BACKGROUND_QUEUE,
+    shed_at=_BACKGROUND_QUEUE,
+)
+
+# How long queued events may take to finish when the bot stops.
+_DRAIN_SECONDS = _int_env("KITTY_DRAIN_SECONDS", 10)
+
+_recorder: Recorder | None = None
+
+
+def event_stats() -> QueueStats:
+    return _events.stats()
+
+
+def background_stats() -> QueueStats:
+    return _background.stats()
+
+
+def stage_stats() -> dict[str, metrics.Histogram]:
+    """Latency of each event type's chain and of its background stages."""
+    return metrics.histograms("stage.")
+
+
+async def stop():
+    """
+    Finish the queued events, then the background stages they started,
+    before the counters are flushed. Deletes and reaction removals still
+    arriving meanwhile are taken, so their counts are taken back too.
+    """
+    await _events.close(_DRAIN_SECONDS)
+    await _background.close(_DRAIN_SECONDS)
+    if _recorder is not None:
+        await asyncio.to_thread(_recorder.close)
+
+
+def load():
+    """Load the state handlers keep in memory."""
     duplicate_message_policing.load()
     meme_repost_blocker.load()
-    bot.listen(hikari.GuildMessageCreateEvent)(_on_message_create)
-    bot.listen(hikari.GuildMessageUpdateEvent)(_on_message_update)
-    bot.listen(hikari.GuildMessageDeleteEvent)(_on_message_delete)
-    bot.listen(hikari.GuildReactionAddEvent)(_on_reaction_add)
-    bot.listen(hikari.GuildReactionDeleteEvent)(_on_reaction_remove)
 
 
-async def _run_chain(event: _Evt, chain: _Chain[_Evt]):
-    for group in chain:
+def register(bot: lightbulb.BotApp):
+    global _recorder
+    load()
+    # Routes read their channels from the environment, so chains are
+    # compiled here rather than at import.
+    for event_type, chain in CHAINS.items():
+        _listen(bot, event_type, chain)
+    path = os.getenv("KITTY_RECORD_EVENTS")
+    if path:
+        recorder = _recorder = Recorder(path)
+
+        async def on_payload(event: hikari.ShardPayloadEvent):
+            recorder.record(event.name, event.payload)
+
+        bot.listen(hikari.ShardPayloadEvent)(on_payload)
+        logging.info(f"Recording gateway events to {path}")
+
+
+def _listen(bot: lightbulb.BotApp, event_type: type[_Evt], chain: _Chain[_Evt]):
+    pipeline = Pipeline(chain)
+
+    async def on_event(event: _Evt):
+        await dispatch(event, pipeline)
+
+    bot.listen(event_type)(on_event)
+
+
+async def dispatch(event: _Evt, pipeline: Pipeline[_Evt]):
+    """
+    Queue `event` to be run through its chain, waiting if the queue is full,
+    or dropping it if only sheddable handlers act on it. Critical events are
+    always queued and run in full.
+    """
+    if not pipeline.acts_on(event):
+        # Nothing acts on it, so it need not wait its turn.
+        return
+    critical = type(event) in CRITICAL
+    # An event left with nothing to do when shedding is dropped rather
+    # than waited for while the queue is full.
+    droppable = not critical and not pipeline.acts_on(event, shed=True)
+    await _events.submit(
+        getattr(event, "channel_id", 0),
+        lambda shed: run_chain(event, pipeline, shed),
+        droppable,
+        critical,
+    )
+
+
+async def run_chain(event: _Evt, pipeline: Pipeline[_Evt], shed: bool = False):
+    """
+    Run every handler `pipeline` routes `event` to, leaving out sheddable ones
+    if `shed`, and queue its background stages as they are reached.
+    """
+    kind = type(event).__name__
+    started_at = time.perf_counter()
+    # Handlers defer their writes to the end of the chain, so each event
+    # commits once however many of them write. They also share what they
+    # parse out of the message.
+    with message_context.scope() as contexts:
+        async with db.unit_of_work(f"event.{kind}"):
+            for segment in pipeline.segments:
+                groups = segment.dispatcher.groups(event, shed)
+                if not await _run_groups(event, groups):
+                    break
+                for name, stage in segment.background:
+                    if stage.acts_on(event):
+                        await _start_background(
+                            event, f"{kind}.{name}", stage, contexts
+                        )
+    metrics.histogram(f"stage.{kind}.chain").record(time.perf_counter() - started_at)
+
+
+async def _start_background(
+    event: _Evt,
+    name: str,
+    stage: Dispatcher[_Evt],
+    contexts: dict[str, message_context.MessageContext],
+):
+    async def run(shed: bool):
+        started_at = time.perf_counter()
+        with message_context.scope(contexts):
+            async with db.unit_of_work(f"stage.{name}"):
+                await _run_groups(event, stage.groups(event, shed))
+        metrics.histogram(f"stage.{name}").record(time.perf_counter() - started_at)
+
+    await _background.submit(
+        getattr(event, "channel_id", 0), run, not stage.acts_on(event, shed=True)
+    )
+
+
+async def _run_groups(event: _Evt, groups: Iterable[Sequence[_Handler[_Evt]]]) -> bool:
+    """Run `groups` in turn, returning False if one ended processing."""
+    for group in groups:
+        if len(group) == 1:
+            # Most groups that are left after routing hold one handler, which
+            # needs no task of its own.
+            try:
+                await group[0](event)
+                continue
+            except EndProcessing:
+                return False
+            except Exception as e:
+                logging.exception(f"An exception occurred", exc_info=e)
+                continue
         coros = map(lambda f: f(event), group)
         res = await asyncio.gather(*coros, return_exceptions=True)
         end_processing = False
@@ -85,24 +277,5 @@ async def _run_chain(event: _Evt, chain: _Chain[_Evt]):
             else:
                 logging.exception(f"An exception occurred", exc_info=r)
         if end_processing:
-            return
-
-
-async def _on_message_create(event: hikari.GuildMessageCreateEvent):
-    await _run_chain(event, _message_create_chain)
-
-
-async def _on_message_update(event: hikari.GuildMessageUpdateEvent):
-    await _run_chain(event, _message_update_chain)
-
-
-async def _on_message_delete(event: hikari.GuildMessageDeleteEvent):
-    await _run_chain(event, _message_delete_chain)
-
-
-async def _on_reaction_add(event: hikari.GuildReactionAddEvent):
-    await _run_chain(event, _reaction_add_chain)
-
-
-async def _on_reaction_remove(event: hikari.GuildReactionDeleteEvent):
-    await _run_chain(event, _reaction_remove_chain)
+            return False
+    return True
@@ -1,20 +1,6 @@
-import re
-from itertools import chain
-from typing import Sequence
-from emoji import emoji_list
 import hikari
-import commons.db as db
-
-
-def decrement_emoji_count(cursor: db.Cursor, usages: Sequence[tuple[str, str]]):
-    cursor.execute(
-        f"""
-        INSERT INTO emoji_counts (user, emoji, count)
-        VALUES {','.join(['(?, ?, 0)'] * len(usages))} 
-        ON CONFLICT (user, emoji) DO UPDATE
-        SET count = emoji_counts.count - 1""",
-        tuple(chain.from_iterable(usages)),
-    )
+import commons.counters as counters
+from commons import message_context
 
 
 async def delete_increment(event: hikari.GuildMessageDeleteEvent) -> None:
@@ -34,21 +20,15 @@ async def delete_increment(event: hikari.GuildMessageDeleteEvent) -> None:
     if message_object.author.is_bot:
         return
 
-    cursor = db.cursor()
     if content:
-        custom_emoji = re.findall(r"<.?:.+?:\d+>", content)
-        unicode_emoji = emoji_list(content)
-        emoji = custom_emoji + [x["emoji"] for x in unicode_emoji]
-
-        if len(emoji):
-            decrement_emoji_count(cursor, [(str(user_id), e) for e in emoji])
-
-    cursor.execute(
-        """
-        INSERT INTO message_deletes (user, count)
-        VALUES (?, 1)
-        ON CONFLICT (user) DO UPDATE
-        SET count = message_deletes.count + 1""",
-        (user_id,),
-    )
-    db.commit()
+        for e in message_context.of(content).emoji:
+            counters.add_emoji(
+                event.guild_id,
+                user_id,
+                e,
+                event.channel_id,
+                message_object.timestamp,
+                -1,
+            )
+
+    counters.add_delete(event.guild_id, user_id)
@@ -9,17 +9,66 @@ Inspired by: https://blog.xkcd.com/2008/01/14/robot9000-and-xkcd-signal-attackin
 
 import os, re
 import hashlib
+import logging
 import hikari
 import behaviours
+from commons.routing import route
 from commons.message_utils import get_member
 import commons.db as db
+from commons import message_context, snowflakes
+from commons.bloom import BloomFilter
 import sqlite3
 import humanize
 from datetime import datetime, timezone
-import unicodedata
 import commons.scheduler
 
+_INSERT_HASH = db.statement(
+    "duplicate_message_policing.insert_hash",
+    "insert into message_hashes values(?, ?, ?, ?)",
+)
+_PREVIOUS_MESSAGE = db.statement(
+    "duplicate_message_policing.previous_message",
+    "select user, message_id, time_sent from message_hashes where message_hash = ?",
+)
+_DELETE_HASH = db.statement(
+    "duplicate_message_policing.delete_hash",
+    "delete from message_hashes where message_id = ? returning message_hash",
+)
 
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+# Up to this many hashes are held in an exact set, beyond it in a Bloom filter.
+_EXACT_MAX = _int_env("KITTY_ORIGINALITY_EXACT_MAX", 1_000_000)
+
+# Every message in the originality channels is policed, or every message at
+# all when debugging.
+_CHANNELS = (
+    None
+    if os.environ.get("DEBUG", "false") in ("true", "1")
+    else "ORIGINALITY_CHANNEL_ID"
+)
+
+# Every hash that may be in message_hashes, loaded by `load`. A miss means the
+# message is original without asking the database.
+_seen: set[bytes] | BloomFilter = set()
+
+
+def digest(content: str) -> bytes:
+    """The md5 of a message's normalised content, as stored in message_hashes."""
+    normalised = message_context.of(content).normalised
+    return hashlib.md5(normalised.encode("utf-8")).digest()
+
+
+@route(channels=_CHANNELS, bots=False, webhooks=False, content=True)
 async def delete_duplicate(event: hikari.GuildMessageCreateEvent) -> None:
     """
     Deletes duplicate messages (excepting some). A duplicate message is simply a matching string
@@ -27,26 +76,10 @@ async def delete_duplicate(event: hikari.GuildMessageCreateEvent) -> None:
     """
 
     DELETION_NOTIFICATION_LONGEVITY = 15
-    match (
-        event.channel_id
-        in [int(id) for id in os.environ.get("ORIGINALITY_CHANNEL_ID", "0").split(",")],
-        os.environ.get("DEBUG", "false") in ("true", "1"),
-    ):
-        case (True, _):
-            # handle all messages in defined channels
-            pass
-        case (_, True):
-            # handle all messages when debug flag is set to True
-            pass
-        case (False, False):
-            # don't handle any messages that are not in the originality channel when debug flag is not set
-            return
 
     # allow these messages by default
     if (
         not event.content
-        or event.is_webhook
-        or event.is_bot
         or event.content.startswith("http")  # allow links
         or re.match(r"<@\d+>", event.content)  # allow mentions
         or re.fullmatch(
@@ -58,30 +91,40 @@ async def delete_duplicate(event: hikari.GuildMessageCreateEvent) -> None:
         # force the bot to not interact with this message at all
         return
 
-    cursor = db.cursor()
-    normalised_message_content = (
-        unicodedata.normalize("NFKD", event.content).casefold().replace(" ", "")
+    message_hash = digest(event.content)
+    row = (
+        event.author_id,
+        event.message_id,
+        message_hash,
+        snowflakes.epoch_ms(event.message.timestamp),
     )
+    # Neither insert is deferred: an identical message handled before this
+    # one commits must find the row, or both would be let through.
+    if message_hash not in _seen:
+        # Never seen, which is most messages, so it is original.
+        _seen.add(message_hash)
+        await db.execute(
+            _INSERT_HASH,
+            row,
+            label="duplicate_message_policing.insert_hash",
+            database="hashes",
+        )
+        return
 
+    # Probably seen before. The unique index has the final say, since the
+    # message may have been deleted since or the filter may be wrong.
     try:
-        cursor.execute(
-            "insert into message_hashes values(?, ?, md5(?), ?)",
-            (
-                event.author_id,
-                event.message_id,
-                normalised_message_content,
-                event.message.timestamp,
-            ),
+        await db.execute(
+            _INSERT_HASH,
+            row,
+            label="duplicate_message_policing.insert_hash",
+            database="hashes",
         )
-        db.commit()
     except sqlite3.IntegrityError:
         await event.message.delete()
-        previous = cursor.execute(
-            "select user, message_id, time_sent from message_hashes where message_hash = md5(?)",
-            (normalised_message_content,),
-        ).fetchone()
+        previous = db.cursor().execute(_PREVIOUS_MESSAGE, (message_hash,)).fetchone()
 
-        original_time_sent = datetime.fromisoformat(previous[2])
+        original_time_sent = snowflakes.from_epoch_ms(previous[2])
 
         response = await event.message.respond(
             f"Hey {event.author.mention}! Unfortunately,"
@@ -97,19 +140,30 @@ async def delete_duplicate(event: hikari.GuildMessageCreateEvent) -> None:
         raise behaviours.EndProcessing()
 
 
+@route(channels=_CHANNELS)
 async def delete_hash(event: hikari.GuildMessageDeleteEvent) -> None:
     """
     Deletes a message record such that another user (or the same user) can send this message again.
     """
-    cursor = db.cursor()
-    cursor.execute(
-        "delete from message_hashes where message_id = ?", (event.message_id,)
+    deleted: list[tuple[bytes]] = await db.submit(
+        lambda c: c.execute(_DELETE_HASH, (event.message_id,)).fetchall(),
+        "duplicate_message_policing.delete_hash",
+        "hashes",
     )
-    db.commit()
+    for (message_hash,) in deleted:
+        _seen.discard(message_hash)
 
 
 def load():
-    def md5(v: str) -> str:
-        return hashlib.md5(v.encode("utf-8")).hexdigest()
-
-    db.create_function("md5", 1, md5)
+    """Load every stored hash into `_seen`."""
+    global _seen
+    cursor = db.cursor()
+    (count,) = cursor.execute("select count(*) from message_hashes").fetchone()
+    if count > _EXACT_MAX:
+        # Room to grow until the next restart before it fills up.
+        _seen = BloomFilter(count * 2)
+    else:
+        _seen = set()
+    for (message_hash,) in cursor.execute("select message_hash from message_hashes"):
+        _seen.add(message_hash)
+    logging.info(f"Loaded {count:,} originality hashes into a {type(_seen).__name__}")
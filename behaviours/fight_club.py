@@ -1,16 +1,14 @@
-import re
 import hikari
 import behaviours
-
-CISSA_REGEX = re.compile(r"\bCISSA\b", re.IGNORECASE)
+from commons import message_context
+from commons.routing import route
 
 
+@route(bots=False, webhooks=False, content=True, sheddable=True)
 async def main(event: hikari.GuildMessageCreateEvent) -> None:
-    if not event.is_human or not event.content:
+    if not event.content:
         return
-    content = event.content
-    is_cissa_mentioned = re.search(CISSA_REGEX, content)
-    if is_cissa_mentioned:
+    if "cissa" in message_context.of(event.content).words:
         await event.message.respond(
             f"Hey {event.author.display_name}, we don't talk about C*SSA here!!! 📍 🐱",
             reply=True,
@@ -1,11 +1,13 @@
 import hikari
 import commons.scheduler
 import behaviours
+from commons.routing import route
 
 FIRESHIP_GUILD_ID = 1015095797689360444
 DELETION_NOTIFICATION_LONGEVITY = 10
 
 
+@route(reference=True)
 async def delete_duplicate(event: hikari.GuildMessageCreateEvent) -> None:
     ref = event.message.message_reference
     if ref and ref.guild_id == FIRESHIP_GUILD_ID:
@@ -3,15 +3,18 @@ import os
 import logging
 from commons.message_utils import get_member
 import commons.db as db
+import commons.counters as counters
+from commons import rollups
 import hikari
 import hikari.messages
 import requests
 import asyncio
 import humanize
 import behaviours
+from commons.routing import route
 import commons.scheduler
 from commons.meme_stat import MemeStat
-from commons import agents, message_utils
+from commons import agents, meme_stat, message_utils, snowflakes
 from typing import Final
 
 RATER_LOCK = asyncio.Lock()
@@ -36,7 +39,13 @@ MINIMUM_MEME_RATING_TO_NOT_DELETE: Final[int] = int(
 )
 IMG_FILE_EXTENSIONS: Final = {"jpg", "jpeg", "png", "webp"}
 
-explained = set[hikari.Snowflake]()
+# Memes whose explanation is still up, with when it is deleted.
+explained = dict[hikari.Snowflake, datetime]()
+
+_CURRENT_RATINGS = db.statement(
+    "meme_rater.current_ratings",
+    "select meme_rating, rating_count from meme_stats where message_id = ?",
+)
 
 
 async def get_meme_rating(image_url: str, user: str | None) -> agents.MemeAnswer | None:
@@ -115,47 +124,30 @@ async def process_message_content(
     return valid_results
 
 
+@route(channels="MEME_CHANNEL_ID")
 async def msg_create(event: hikari.GuildMessageCreateEvent) -> None:
-    if event.channel_id != MEME_CHANNEL_ID:
-        return
     results = await process_message_content(event.message)
-    await rate_meme(event.message, results)
+    await rate_meme(event.message, results, event.guild_id)
 
 
+@route(channels="MEME_CHANNEL_ID", embeds=True)
 async def msg_update(event: hikari.GuildMessageUpdateEvent) -> None:
-    if event.channel_id != MEME_CHANNEL_ID or not event.message.embeds:
-        return
     if event.message.edited_timestamp:
         return
     results = await process_message_content(event.message)
-    await rate_meme(event.message, results)
+    await rate_meme(event.message, results, event.guild_id)
 
 
 def get_meme_stats(
     message_id: hikari.Snowflake,
 ) -> MemeStat | None:
-    cursor = db.cursor()
-    stats = cursor.execute(
-        "SELECT * FROM meme_stats WHERE message_id = ?",
-        (message_id,),
-    ).fetchone()
-    if not stats:
-        return None
-    db_meme_stats = MemeStat(
-        author_id=stats[0],
-        message_id=stats[1],
-        meme_score=stats[2],
-        timestamp=stats[3],
-        meme_rating=stats[4],
-        rating_count=stats[5],
-        meme_reasoning=stats[6],
-    )
-    return db_meme_stats
+    return meme_stat.get(message_id)
 
 
 async def rate_meme(
     message: hikari.PartialMessage,
     rating_results: list[agents.MemeAnswer],
+    guild_id: hikari.Snowflake,
     is_command: bool = False,
 ) -> MemeStat | None:
     message = await message.app.rest.fetch_message(message.channel_id, message.id)
@@ -171,32 +163,71 @@ async def rate_meme(
         if len(rating_results) == 0:
             return
 
-        cursor = db.cursor()
-        curr_ratings = cursor.execute(
-            "select meme_rating, rating_count from meme_stats where message_id = ?",
-            (message.id,),
-        ).fetchone()
-        entry_exists = True
-        if not curr_ratings:
-            curr_ratings = (0, 0)
-            entry_exists = False
-
         ratings_sum = sum([result.rate for result in rating_results])
         ratings_count = len(rating_results)
 
-        new_rating_sum = ratings_sum + curr_ratings[0]
-        new_rating_count = ratings_count + curr_ratings[1]
-
-        avg_rating: int = min(
-            max(0, new_rating_sum // new_rating_count),
-            10,
-        )
-
         if ratings_count > 1:
             str_explanations = "\n".join(["* " + s.explanation for s in rating_results])
         else:
             str_explanations = rating_results[0].explanation
 
+        # add some basic meme stats to the db so we can track who is improving, rotting, or standing still
+        # avg rating row inserted is just for this set of memes. Another query elsewhere aggregates.
+        # The score rollup behind /memestats is kept in the same transaction.
+        author_id = message.author.id
+        channel_id = message.channel_id
+
+        def record_ratings(c: db.Cursor) -> tuple[bool, int]:
+            # Read and write in one job, committed before the lock is released,
+            # so a second rating of the same meme finds this one's row.
+            curr_ratings = c.execute(_CURRENT_RATINGS, (message.id,)).fetchone()
+            if curr_ratings:
+                new_rating_sum = ratings_sum + curr_ratings[0]
+                new_rating_count = ratings_count + curr_ratings[1]
+                avg_rating = min(max(0, new_rating_sum // new_rating_count), 10)
+                old_score = meme_stat.score(c, message.id)
+                c.execute(
+                    "update meme_stats set meme_rating = ?, rating_count = ?, meme_score = ?, meme_reasoning=? WHERE message_id = ?",
+                    (
+                        new_rating_sum,
+                        new_rating_count,
+                        avg_rating,
+                        str_explanations,
+                        message.id,
+                    ),
+                )
+                rollups.add_meme_score(
+                    c,
+                    guild_id,
+                    author_id,
+                    channel_id,
+                    message.timestamp,
+                    avg_rating - (old_score or 0),
+                    0,
+                )
+                return True, avg_rating
+            avg_rating = min(max(0, ratings_sum // ratings_count), 10)
+            c.execute(
+                "insert into meme_stats values(?, ?, ?, ?, ?, ?, ?)",
+                (
+                    author_id,
+                    message.id,
+                    avg_rating,
+                    snowflakes.epoch_ms(message.timestamp),
+                    ratings_sum,
+                    ratings_count,
+                    str_explanations,
+                ),
+            )
+            rollups.add_meme_score(
+                c, guild_id, author_id, channel_id, message.timestamp, avg_rating, 1
+            )
+            return False, avg_rating
+
+        entry_exists, avg_rating = await db.submit(
+            record_ratings, "meme_rater.record_ratings", "memes"
+        )
+
         if entry_exists:
             await message.remove_all_reactions()
 
@@ -213,36 +244,7 @@ async def rate_meme(
         for emoji in emoji_to_add:
             await message.add_reaction(emoji=emoji)
 
-        # add some basic meme stats to the db so we can track who is improving, rotting, or standing still
-        # avg rating row inserted is just for this set of memes. Another query elsewhere aggregates.
-        if entry_exists:
-            cursor.execute(
-                "update meme_stats set meme_rating = ?, rating_count = ?, meme_score = ?, meme_reasoning=? WHERE message_id = ?",
-                (
-                    new_rating_sum,
-                    new_rating_count,
-                    avg_rating,
-                    str_explanations,
-                    message.id,
-                ),
-            )
-        else:
-            cursor.execute(
-                "insert into meme_stats values(?, ?, ?, ?, ?, ?, ?)",
-                (
-                    message.author.id,
-                    message.id,
-                    avg_rating,
-                    message.timestamp,
-                    ratings_sum,
-                    ratings_count,
-                    str_explanations,
-                ),
-            )
-
-        db.commit()
-
-        meme_stat = MemeStat(
+        return MemeStat(
             author_id=message.author.id,
             meme_rating=avg_rating,
             meme_reasoning=str_explanations,
@@ -252,88 +254,51 @@ async def rate_meme(
             timestamp=message.timestamp,
         )
 
-        return meme_stat
-
 
-def shit_meme_delete_add_count(user_id: hikari.Snowflake):
-    db.cursor().execute(
-        """
-        INSERT INTO shit_meme_deletes (user, count)
-        VALUES (?, 1)
-        ON CONFLICT (user) DO UPDATE
-        SET count = shit_meme_deletes.count + 1""",
-        (user_id,),
+@route(channels="MEME_CHANNEL_ID", bots=False, emoji=["❓"])
+async def respond_to_question_mark(event: hikari.GuildReactionAddEvent) -> None:
+    channel_id, requester_name, _requester_id, response_to_msg_id = (
+        event.channel_id,
+        event.member.display_name,
+        event.user_id,
+        event.message_id,
     )
-    db.commit()
-
+    now = datetime.now(timezone.utc)
+    for message_id, expires in list(explained.items()):
+        if expires <= now:
+            del explained[message_id]
+    if response_to_msg_id in explained:
+        raise behaviours.EndProcessing()
 
-async def respond_to_question_mark(event: hikari.GuildReactionAddEvent) -> None:
-    # In memes only?
-    channel_id = event.channel_id
-    if (
-        channel_id == MEME_CHANNEL_ID
-        and event.emoji_name == "❓"
-        and not event.member.is_bot
-    ):
-        channel_id, requester_name, _requester_id, response_to_msg_id = (
-            event.channel_id,
-            event.member.display_name,
-            event.user_id,
-            event.message_id,
+    explanation = get_explanation(response_to_msg_id)
+    if explanation is not None:
+        response = await event.app.rest.create_message(
+            channel=channel_id,
+            reply=response_to_msg_id,
+            content=f"Requested by: {requester_name} - {explanation}",
+            flags=hikari.messages.MessageFlag.SUPPRESS_NOTIFICATIONS,
+        )
+        explained[response_to_msg_id] = now + timedelta(seconds=EXPLANATION_LONGEVITY)
+        await commons.scheduler.delay_delete(
+            response.channel_id, response.id, seconds=EXPLANATION_LONGEVITY
         )
-        if response_to_msg_id in explained:
-            raise behaviours.EndProcessing()
-
-        explanation = get_explanation(response_to_msg_id)
-        if explanation is not None:
-            response = await event.app.rest.create_message(
-                channel=channel_id,
-                reply=response_to_msg_id,
-                content=f"Requested by: {requester_name} - {explanation}",
-                flags=hikari.messages.MessageFlag.SUPPRESS_NOTIFICATIONS,
-            )
-            explained.add(response_to_msg_id)
-            await commons.scheduler.delay_delete(
-                response.channel_id, response.id, seconds=EXPLANATION_LONGEVITY
-            )
-            explained.remove(response_to_msg_id)
 
-        raise behaviours.EndProcessing()
+    raise behaviours.EndProcessing()
 
 
 def get_explanation(message_id: hikari.Snowflake):
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        SELECT meme_reasoning
-        FROM meme_stats
-        WHERE message_id = ?""",
-        (str(message_id),),
-    )
-    row = cursor.fetchone()
-    if row is None:
-        return None
-    return row[0]
+    return meme_stat.explanation(message_id)
 
 
 def is_message_rated_shit(message_id: hikari.Snowflake) -> bool:
-    cursor = db.cursor()
-    score = cursor.execute(
-        """
-        select meme_score from meme_stats
-        where message_id = ?""",
-        (message_id,),
-    ).fetchone()
-    return score[0] < MINIMUM_MEME_RATING_TO_NOT_DELETE
+    score = meme_stat.score(db.cursor(), message_id)
+    return score is not None and score < MINIMUM_MEME_RATING_TO_NOT_DELETE
 
 
 # Deletes a meme if (specified amount) or more entities (including Kitti) react to a meme with the shit emoji. Offset by 10's.
+@route(bots=False, emoji=["💩"])
 async def meme_reaction(event: hikari.GuildReactionAddEvent) -> None:
-    if (
-        event.emoji_name != "💩"
-        or event.member.is_bot
-        or not is_message_rated_shit(event.message_id)
-    ):
+    if not is_message_rated_shit(event.message_id):
         return
     message = await event.app.rest.fetch_message(
         channel=event.channel_id, message=event.message_id
@@ -416,7 +381,7 @@ async def delete_meme(
     await event.app.rest.delete_message(
         channel=event.channel_id, message=event.message_id
     )
-    shit_meme_delete_add_count(message.author.id)
+    counters.add_shit_meme_delete(event.guild_id, message.author.id)
 
 
 async def voter_names(
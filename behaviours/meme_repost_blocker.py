@@ -7,6 +7,7 @@ import hikari.errors
 from PIL import Image
 import imagehash
 import behaviours
+from commons.routing import route
 import commons.db as db
 import re
 import requests
@@ -18,15 +19,24 @@ HASH_SIZE = 16
 
 _Results = Sequence[tuple[int, hikari.Snowflake, hikari.Snowflake, hikari.Snowflake]]
 
-
+_SIMILAR_HASHES = db.statement(
+    "meme_repost_blocker.similar_hashes",
+    """
+    SELECT rowid, message_id, channel_id, guild_id
+    FROM image_hashes
+    WHERE hammingDistance(hash, ?) < ?
+        AND hammingDistanceColor(hash_color, ?) < ?
+    ORDER BY rowid ASC""",
+    scan_ok=True,
+)
+_DELETE_HASH = db.statement(
+    "meme_repost_blocker.delete_hash",
+    "DELETE FROM image_hashes WHERE message_id = ?",
+)
+
+
+@route(bots=False, attachments=True)
 async def main(event: hikari.GuildMessageCreateEvent) -> None:
-    # Don't handle messages from bots or without content
-    if event.is_bot:
-        return
-
-    # Connect to the sqlite3 database
-    c = db.cursor()
-
     # Iterate through the attachments in the message
     for attachment in event.message.attachments:
         # Check if the attachment is an image
@@ -59,14 +69,10 @@ async def main(event: hikari.GuildMessageCreateEvent) -> None:
                 str(image_hash),
                 str(hash_color),
             )
-            # Check if the approximate hash exists in the database
-            c.execute(
-                """
-                SELECT rowid, message_id, channel_id, guild_id
-                FROM image_hashes
-                WHERE hammingDistance(hash, ?) < ?
-                    AND hammingDistanceColor(hash_color, ?) < ?
-                ORDER BY rowid ASC""",
+            # Check if the approximate hash exists in the database. This is a
+            # full scan through a Python function, so keep it off the event loop.
+            results: _Results = await db.query(
+                _SIMILAR_HASHES,
                 (
                     str(image_hash),
                     int(os.getenv(phash_th, "50")),
@@ -74,13 +80,12 @@ async def main(event: hikari.GuildMessageCreateEvent) -> None:
                     int(os.getenv(chash_th, "50")),
                 ),
             )
-
-            results: _Results = c.fetchall()
             logging.info(
                 "meme_repost_blocker: hash check returned %d candidate(s)",
                 len(results),
             )
             valid_results: _Results = []
+            stale_rows: list[int] = []
             for result in results:
                 # We have a match in the database, but we need to verify that message has not been since deleted
                 row_id = result[0]
@@ -90,12 +95,7 @@ async def main(event: hikari.GuildMessageCreateEvent) -> None:
                     await event.app.rest.fetch_message(channel_id, message_id)
 
                 except hikari.errors.NotFoundError:
-                    c.execute(
-                        """
-                        DELETE FROM image_hashes
-                        WHERE rowid = ?""",
-                        (row_id,),
-                    )
+                    stale_rows.append(row_id)
                 else:
                     valid_results.append(result)
 
@@ -103,20 +103,28 @@ async def main(event: hikari.GuildMessageCreateEvent) -> None:
             # a) similarity is not necessarily transitive
             # b) the first could be deleted, so this message becomes the only record of it
             # Do this before sending the response so network errors do not prevent us getting to a db commit.
-            c.execute(
-                """
-                INSERT INTO image_hashes
-                (hash, hash_color, message_id, channel_id, guild_id)
-                VALUES (?, ?, ?, ?, ?)""",
-                (
-                    str(image_hash),
-                    str(hash_color),
-                    event.message_id,
-                    event.channel_id,
-                    event.guild_id,
-                ),
-            )
-            db.commit()
+            def store_hash(c: db.Cursor):
+                c.executemany(
+                    """
+                    DELETE FROM image_hashes
+                    WHERE rowid = ?""",
+                    [(row_id,) for row_id in stale_rows],
+                )
+                c.execute(
+                    """
+                    INSERT INTO image_hashes
+                    (hash, hash_color, message_id, channel_id, guild_id)
+                    VALUES (?, ?, ?, ?, ?)""",
+                    (
+                        str(image_hash),
+                        str(hash_color),
+                        event.message_id,
+                        event.channel_id,
+                        event.guild_id,
+                    ),
+                )
+
+            await db.defer(store_hash, "meme_repost_blocker.store_hash", "hashes")
             logging.info(
                 "meme_repost_blocker: stored hashes for message %s", event.message_id
             )
@@ -136,6 +144,18 @@ async def main(event: hikari.GuildMessageCreateEvent) -> None:
                 raise behaviours.EndProcessing()
 
 
+async def delete_hash(event: hikari.GuildMessageDeleteEvent) -> None:
+    """
+    Forget the images of a deleted message. The repost check would otherwise
+    find it, fetch it and discard it as stale anyway.
+    """
+    await db.defer(
+        lambda c: c.execute(_DELETE_HASH, (event.message_id,)),
+        "meme_repost_blocker.delete_hash",
+        "hashes",
+    )
+
+
 def load() -> None:
     def hammingDistance(a: str, b: str):
         return int(imagehash.hex_to_hash(a) - imagehash.hex_to_hash(b))
@@ -1,7 +1,8 @@
 import os
-import re
 
 import hikari
+from commons import message_context
+from commons.routing import route
 from commons.message_utils import get_member
 
 """
@@ -9,12 +10,11 @@ Bot adds #notalurker role for those who comment.
 """
 
 
+@route(bots=False, content=True)
 async def main(event: hikari.GuildMessageCreateEvent) -> None:
-    if event.is_bot or not event.content or "NOTALURKER_ROLE" not in os.environ:
+    if not event.content or "NOTALURKER_ROLE" not in os.environ:
         return
-    messageContent = event.content
-    messageContent = re.sub(r"<.+?>", "", messageContent)
-    if not any(c.isalpha() for c in messageContent):
+    if not message_context.of(event.content).has_letters:
         return
     currentRoles = (await get_member(event, event.author_id).fetch_roles())[1:]
     for role in currentRoles:
@@ -1,37 +1,29 @@
-import re
-
 import hikari
 
 import behaviours
+from commons import message_context
+from commons.routing import route
 
 """
 Bot makes a slight correction.
 """
 
 
-def find_whole_word(word: str, text: str):
-    return re.compile(r"\b({0})\b".format(word), flags=re.IGNORECASE).search(text)
-
-
-def contains_word(s: str, w: str):
-    return f" {w} " in f" {s} "
-
-
+@route(bots=False, content=True, sheddable=True)
 async def main(event: hikari.GuildMessageCreateEvent):
-    if event.is_bot or not event.content:
+    if not event.content:
         return
 
-    messageContent = event.content
-    messageContent = re.sub(r"<.+?>", "", messageContent)
+    context = message_context.of(event.content)
+    messageContent = context.stripped
 
-    if not any(c.isalpha() for c in messageContent):
+    if not context.has_letters:
         return
 
+    words = context.words
     if (
-        find_whole_word("payed", messageContent)
-        and not (contains_word(messageContent, "rope"))
-        and not (contains_word(messageContent, "nautical"))
-        and not (contains_word(messageContent, "deck"))
+        "payed" in words
+        and not words & {"rope", "nautical", "deck"}
         and len(messageContent.split()) != 1
     ):
         corrected_message = messageContent.replace("payed", "*paid*")
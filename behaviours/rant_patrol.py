@@ -3,6 +3,7 @@ import hikari
 import os
 
 import behaviours
+from commons.routing import route
 from commons import message_utils
 
 ALLOWED_STEMS = ["rant", "vent"]
@@ -23,8 +24,9 @@ FORMATTED_STEMS = message_utils.humanize_list(
 )
 
 
+@route(bots=False, webhooks=False, content=True)
 async def main(event: hikari.GuildMessageCreateEvent):
-    if not event.is_human or not event.content:
+    if not event.content:
         return
     rant_channel_id = os.environ["RANT_AND_VENT_CHANNEL_ID"]
     in_channel = event.channel_id == int(rant_channel_id)
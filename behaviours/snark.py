@@ -3,6 +3,8 @@ import concurrent.futures
 import asyncio
 import hikari
 import behaviours
+from commons import message_context
+from commons.routing import route
 import commons.db as db
 import commons.agents
 import logging as log
@@ -44,31 +46,24 @@ def choose_eightball_response(message: str):
     return eight_ball_responses[index]
 
 
-def find_whole_word(word: str, text: str):
-    return re.compile(r"\b({0})\b".format(word), flags=re.IGNORECASE).search(text)
+_QUESTION = re.compile(r"(\S|\s)\?(\s|$)")
 
 
 def classical_response(event: hikari.GuildMessageCreateEvent) -> str | None:
     message_content = event.content
     if not message_content:
         return None
-    regexp = re.compile(r"(\S|\s)\?(\s|$)")
+    words = message_context.of(message_content).words
     response = None
-    if regexp.search(message_content):
+    if _QUESTION.search(message_content):
         response = choose_eightball_response(message_content)
-    elif find_whole_word("broken", message_content):
+    elif "broken" in words:
         response = f"No {event.author.mention}, you're broken :disguised_face:"
-    elif find_whole_word("thanks", message_content) or find_whole_word(
-        "thank", message_content
-    ):
+    elif words & {"thanks", "thank"}:
         response = f"You're welcome {event.author.mention} :heart:"
-    elif find_whole_word("work", message_content):
+    elif "work" in words:
         response = f"{event.author.mention} I do work."
-    elif (
-        find_whole_word("hey", message_content)
-        or find_whole_word("hi", message_content)
-        or find_whole_word("hello", message_content)
-    ):
+    elif words & {"hey", "hi", "hello"}:
         response = f"Hey {event.author.mention}, I am a cat. With robot intestines. If you're bored, you should ask me a question, or check out my `+userinfo`, `+ping`, `+fortune` and `+fact` commands :cat:"
     elif (
         event.message.referenced_message
@@ -116,9 +111,8 @@ async def llm_response(event: hikari.GuildMessageCreateEvent) -> str | None:
         return response.replace("@everyone", "everyone").replace("@here", "here")
 
 
+@route(bots=False, content=True, sheddable=True)
 async def main(event: hikari.GuildMessageCreateEvent) -> None:
-    if event.is_bot or not event.content:
-        return
     mentioned_ids = event.message.user_mentions_ids
     if not mentioned_ids or event.shard.get_user_id() not in mentioned_ids:
         return
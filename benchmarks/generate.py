@@ -0,0 +1,230 @@
+"""
+Build a synthetic persist.sqlite at a chosen scale for benchmarking.
+
+User activity follows a Zipf distribution, so a few users send most of the
+messages as on the real server, and emoji popularity is Zipfian too. Each
+user's emoji rows are drawn from their share of the emoji uses, so heavy
+users have both more distinct emoji and higher counts.
+
+    python -m benchmarks.generate bench.sqlite --users 100000 --emoji-rows 10000000
+"""
+
+import argparse
+import bisect
+import dataclasses
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Any, Iterator
+from commons import migrations, snowflakes
+
+BATCH_SIZE = 50_000
+EMOJI_PER_MESSAGE = 0.3
+_HOUR_MS = 60 * 60 * 1000
+_NOW_MS = snowflakes.epoch_ms(datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+@dataclasses.dataclass(frozen=True)
+class Scale:
+    guilds: int = 1
+    users: int = 10_000
+    emoji: int = 2_000
+    emoji_rows: int = 1_000_000
+    messages_per_user: int = 200
+    memes: int = 50_000
+    days: int = 365
+    user_skew: float = 1.1
+    emoji_skew: float = 1.0
+    seed: int = 0
+
+
+def _zipf_weights(n: int, skew: float) -> list[float]:
+    weights = [1 / rank**skew for rank in range(1, n + 1)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+class _Sampler:
+    """Draws indexes 0..n-1 with the given weights."""
+
+    def __init__(self, weights: list[float], rng: random.Random):
+        self._cumulative = list(itertools.accumulate(weights))
+        self._rng = rng
+
+    def draw(self) -> int:
+        point = self._rng.random() * self._cumulative[-1]
+        return min(
+            bisect.bisect_right(self._cumulative, point), len(self._cumulative) - 1
+        )
+
+
+def _snowflakes(count: int, rng: random.Random) -> list[int]:
+    """`count` distinct snowflakes created in the year before now."""
+    year = 365 * 24 * _HOUR_MS
+    ids: set[int] = set()
+    while len(ids) < count:
+        created = _NOW_MS - rng.randrange(year) - snowflakes.DISCORD_EPOCH_MS
+        ids.add(created << 22 | rng.randrange(1 << 22))
+    return sorted(ids)
+
+
+def _emoji_names(count: int, rng: random.Random) -> list[str]:
+    """A mix of unicode emoji and custom `<:name:id>` emoji, most popular first."""
+    names: list[str] = []
+    for i in range(count):
+        if i % 3 == 2:
+            names.append(f"<:emoji{i}:{rng.randrange(10**17, 10**18)}>")
+        else:
+            names.append(chr(0x1F300 + i % 0x600) * (1 + i // 0x600))
+    return names
+
+
+def _batched(rows: Iterator[tuple[object, ...]]) -> Iterator[list[tuple[object, ...]]]:
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        yield batch
+
+
+def generate(path: str, scale: Scale = Scale()) -> dict[str, int]:
+    """Create the database at `path`, returning the rows written per table."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(scale.seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    migrations.migrate(conn, migrations.MIGRATIONS)
+
+    guilds = _snowflakes(scale.guilds, rng)
+    users = _snowflakes(scale.users, rng)
+    rng.shuffle(users)
+    # Users are ranked by activity, most active first, and each is placed in
+    # one guild.
+    activity = _zipf_weights(scale.users, scale.user_skew)
+    user_guild = [guilds[rng.randrange(scale.guilds)] for _ in users]
+    emoji = _emoji_names(scale.emoji, rng)
+    emoji_sampler = _Sampler(_zipf_weights(scale.emoji, scale.emoji_skew), rng)
+    written: dict[str, int] = {}
+
+    def insert(table: str, rows: Iterator[tuple[object, ...]]):
+        started_at = time.perf_counter()
+        count = 0
+        for batch in _batched(rows):
+            placeholders = ", ".join("?" * len(batch[0]))
+            conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", batch)
+            conn.commit()
+            count += len(batch)
+        written[table] = count
+        logging.info(
+            f"{table}: {count:,} rows in {time.perf_counter() - started_at:.1f}s"
+        )
+
+    total_messages = scale.messages_per_user * scale.users
+    message_counts = [max(1, round(total_messages * w)) for w in activity]
+    insert(
+        "message_counts",
+        ((user_guild[i], users[i], message_counts[i]) for i in range(scale.users)),
+    )
+    insert(
+        "message_deletes",
+        (
+            (user_guild[i], users[i], max(1, message_counts[i] // 50))
+            for i in range(scale.users)
+            if rng.random() < 0.3
+        ),
+    )
+
+    # Heavier users use more distinct emoji, but less than in proportion to
+    # their messages. Which emoji, and how often relative to each other, comes
+    # from drawing until enough distinct ones have turned up.
+    breadth = [w**0.5 for w in activity]
+    breadth_total = sum(breadth)
+
+    def emoji_rows() -> Iterator[tuple[object, ...]]:
+        for i in range(scale.users):
+            wanted = round(scale.emoji_rows * breadth[i] / breadth_total)
+            wanted = min(scale.emoji // 2, max(1, wanted))
+            draws: dict[int, int] = {}
+            drawn = 0
+            while len(draws) < wanted and drawn < wanted * 20:
+                e = emoji_sampler.draw()
+                draws[e] = draws.get(e, 0) + 1
+                drawn += 1
+            uses = message_counts[i] * EMOJI_PER_MESSAGE
+            for e, count in draws.items():
+                yield (
+                    user_guild[i],
+                    users[i],
+                    emoji[e],
+                    max(1, round(count * uses / drawn)),
+                )
+
+    insert("emoji_counts", emoji_rows())
+
+    poster = _Sampler(activity, rng)
+    meme_ids = _snowflakes(scale.memes, rng)
+    span_ms = scale.days * 24 * _HOUR_MS
+
+    meme_rollup: dict[tuple[int, int, int], list[int]] = {}
+
+    def meme_rows() -> Iterator[tuple[object, ...]]:
+        for message_id in meme_ids:
+            score = min(10, max(0, round(rng.gauss(5.5, 2))))
+            sent = _NOW_MS - rng.randrange(span_ms)
+            i = poster.draw()
+            key = (user_guild[i], sent // _HOUR_MS * 3600, users[i])
+            totals = meme_rollup.setdefault(key, [0, 0])
+            totals[0] += score
+            totals[1] += 1
+            yield (users[i], message_id, score, sent, score, 1, None)
+
+    insert("meme_stats", meme_rows())
+    conn.executemany(
+        """
+        INSERT INTO meme_score_rollup_hourly (guild, bucket, user, channel, score_sum, count)
+        VALUES (?, ?, ?, 0, ?, ?)""",
+        ((*key, score_sum, count) for key, (score_sum, count) in meme_rollup.items()),
+    )
+    written["meme_score_rollup_hourly"] = conn.execute(
+        "SELECT count(*) FROM meme_score_rollup_hourly"
+    ).fetchone()[0]
+    insert(
+        "shit_meme_deletes",
+        (
+            (user_guild[i], users[i], rng.randrange(1, 20))
+            for i in range(min(scale.users, 200))
+        ),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return written
+
+
+def main():
+    defaults = Scale()
+    parser = argparse.ArgumentParser(
+        description="Build a synthetic database for benchmarking."
+    )
+    parser.add_argument("path", help="Where to create the database")
+    for field in dataclasses.fields(Scale):
+        default: int | float = getattr(defaults, field.name)
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}", type=type(default), default=default
+        )
+    args: dict[str, Any] = vars(parser.parse_args())
+    path = args.pop("path")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    started_at = time.perf_counter()
+    written = generate(path, Scale(**args))
+    logging.info(
+        f"Wrote {sum(written.values()):,} rows to {path} in {time.perf_counter() - started_at:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Replay gateway events recorded with KITTY_RECORD_EVENTS through the behaviour
+chains, against an in-process stand-in for the Discord REST API, and write a
+JSON report of throughput and each handler's latency.
+
+    python -m benchmarks.replay events.jsonl.gz --speed max --output report.json
+
+Events are queued exactly as the bot queues live ones, at the pace they were
+recorded (`--speed 1`, or a multiple of it) or as fast as the queue takes
+them (`--speed max`). The stand-in answers the REST calls behaviours make
+from the messages, reactions and members the replay has seen, after
+`--rest-latency-ms`. Handlers write to `--database`, a new empty database by
+default, so point it at a copy rather than the live file. Handlers that call
+out to language models or image hosts still do. Passing a previous report as
+`--baseline` prints how each handler changed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Coroutine, cast
+import hikari
+from hikari import traits
+from hikari.impl import entity_factory, event_factory
+from benchmarks.run import compare, summarise, version
+from commons import metrics, recorder
+from commons.event_queue import QueueStats
+
+_Handler = Callable[[Any], Coroutine[None, None, None]]
+
+BOT_ID = 1
+_JOINED_AT = "2015-05-13T00:00:00+00:00"
+
+
+def _user(id: int, bot: bool = False) -> dict[str, Any]:
+    return {
+        "id": str(id),
+        "username": str(id),
+        "global_name": None,
+        "discriminator": "0",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def _emoji_key(emoji: str | hikari.Emoji, emoji_id: object = None) -> str:
+    if isinstance(emoji, hikari.CustomEmoji):
+        return f"{emoji.name}:{emoji.id}"
+    if emoji_id is not None and emoji_id is not hikari.UNDEFINED:
+        return f"{emoji}:{int(cast(int, emoji_id))}"
+    return str(emoji)
+
+
+@dataclass
+class _Reaction:
+    emoji: dict[str, Any]
+    users: dict[int, dict[str, Any]] = field(default_factory=dict[int, dict[str, Any]])
+
+
+class _Reactors(hikari.LazyIterator[hikari.User]):
+    def __init__(self, rest: "FakeRest", users: list[hikari.User]):
+        self._rest = rest
+        self._users = iter(users)
+        self._fetched = False
+
+    async def __anext__(self) -> hikari.User:
+        if not self._fetched:
+            self._fetched = True
+            await self._rest.wait()
+        try:
+            return next(self._users)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+
+class FakeRest:
+    """
+    The REST methods behaviours call, served from what the replay has seen so
+    far. Each call is counted and answered after `latency` seconds.
+    """
+
+    def __init__(self, app: "FakeApp", latency: float):
+        self._app = app
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.messages: dict[int, dict[str, Any]] = {}
+        self.reactions: dict[int, dict[str, _Reaction]] = defaultdict(dict)
+        self.members: dict[tuple[int, int], dict[str, Any]] = {}
+        self.roles: dict[int, set[int]] = defaultdict(set)
+        self._guilds: dict[int, int] = {}
+        self._next_id = 1 << 62
+
+    def observe(self, name: str, payload: dict[str, Any]):
+        """Update what the API would answer with for a replayed event."""
+        guild = int(payload["guild_id"])
+        if name == "MESSAGE_CREATE":
+            message = int(payload["id"])
+            self.messages[message] = payload
+            self._guilds[int(payload["channel_id"])] = guild
+            if "member" in payload:
+                self._remember(guild, {**payload["member"], "user": payload["author"]})
+        elif name == "MESSAGE_UPDATE":
+            message = int(payload["id"])
+            if message in self.messages:
+                self.messages[message] = {**self.messages[message], **payload}
+        elif name == "MESSAGE_DELETE":
+            self.messages.pop(int(payload["id"]), None)
+            self.reactions.pop(int(payload["id"]), None)
+        elif name == "MESSAGE_REACTION_ADD":
+            user = int(payload["user_id"])
+            if "member" in payload:
+                self._remember(guild, payload["member"])
+            member = self.members.get((guild, user))
+            key = _emoji_key(payload["emoji"]["name"], payload["emoji"].get("id"))
+            reaction = self.reactions[int(payload["message_id"])].setdefault(
+                key, _Reaction(payload["emoji"])
+            )
+            reaction.users[user] = member["user"] if member else _user(user)
+        elif name == "MESSAGE_REACTION_REMOVE":
+            key = _emoji_key(payload["emoji"]["name"], payload["emoji"].get("id"))
+            reaction = self.reactions[int(payload["message_id"])].get(key)
+            if reaction is not None:
+                reaction.users.pop(int(payload["user_id"]), None)
+
+    def _remember(self, guild: int, member: dict[str, Any]):
+        self.members[(guild, int(member["user"]["id"]))] = member
+        self.roles[guild].update(int(role) for role in member.get("roles", ()))
+
+    def member(self, guild: int, user: int) -> hikari.Member:
+        payload: dict[str, Any] | None = self.members.get((guild, user))
+        if payload is None:
+            # The live cache holds every member, not just those seen.
+            payload = {"user": _user(user), "roles": [], "joined_at": _JOINED_AT}
+        return self._app.entity_factory.deserialize_member(
+            payload, guild_id=hikari.Snowflake(guild)
+        )
+
+    async def wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _call(self, method: str):
+        self.calls[method] += 1
+        await self.wait()
+
+    def _message(self, message: int) -> hikari.Message:
+        payload = self.messages[message]
+        reactions = [
+            {"count": len(r.users), "me": BOT_ID in r.users, "emoji": r.emoji}
+            for r in self.reactions.get(message, {}).values()
+            if r.users
+        ]
+        return self._app.entity_factory.deserialize_message(
+            {**payload, "reactions": reactions}
+        )
+
+    async def fetch_message(
+        self, channel: hikari.SnowflakeishOr[Any], message: hikari.SnowflakeishOr[Any]
+    ) -> hikari.Message:
+        await self._call("fetch_message")
+        if int(message) not in self.messages:
+            raise hikari.NotFoundError(
+                url=f"/channels/{int(channel)}/messages/{int(message)}",
+                headers={},
+                raw_body=b"",
+            )
+        return self._message(int(message))
+
+    async def create_message(
+        self,
+        channel: hikari.SnowflakeishOr[Any],
+        content: Any = hikari.UNDEFINED,
+        **kwargs: Any,
+    ) -> hikari.Message:
+        await self._call("create_message")
+        self._next_id += 1
+        channel_id = int(channel)
+        self.messages[self._next_id] = {
+            "id": str(self._next_id),
+            "channel_id": str(channel_id),
+            "guild_id": str(self._guilds.get(channel_id, 0)),
+            "author": _user(BOT_ID, bot=True),
+            "content": "" if content is hikari.UNDEFINED else str(content),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+        return self._message(self._next_id)
+
+    async def delete_message(
+        self, channel: hikari.SnowflakeishOr[Any], message: hikari.SnowflakeishOr[Any]
+    ):
+        await self._call("delete_message")
+        self.messages.pop(int(message), None)
+        self.reactions.pop(int(message), None)
+
+    async def add_reaction(
+        self,
+        channel: hikari.SnowflakeishOr[Any],
+        message: hikari.SnowflakeishOr[Any],
+        emoji: str | hikari.Emoji,
+        emoji_id: Any = hikari.UNDEFINED,
+    ):
+        await self._call("add_reaction")
+        if isinstance(emoji, hikari.CustomEmoji):
+            payload = {"id": str(emoji.id), "name": emoji.name}
+        else:
+            payload = {"id": None, "name": str(emoji)}
+        reaction = self.reactions[int(message)].setdefault(
+            _emoji_key(emoji, emoji_id), _Reaction(payload)
+        )
+        reaction.users[BOT_ID] = _user(BOT_ID, bot=True)
+
+    def fetch_reactions_for_emoji(
+        self,
+        channel: hikari.SnowflakeishOr[Any],
+        message: hikari.SnowflakeishOr[Any],
+        emoji: str | hikari.Emoji,
+        emoji_id: Any = hikari.UNDEFINED,
+    ) -> hikari.LazyIterator[hikari.User]:
+        self.calls["fetch_reactions_for_emoji"] += 1
+        reaction = self.reactions.get(int(message), {}).get(_emoji_key(emoji, emoji_id))
+        users = [
+            self._app.entity_factory.deserialize_user(user)
+            for user in (reaction.users.values() if reaction else ())
+        ]
+        return _Reactors(self, users)
+
+    async def fetch_roles(self, guild: hikari.SnowflakeishOr[Any]) -> list[hikari.Role]:
+        await self._call("fetch_roles")
+        # @everyone shares the guild's id and comes first.
+        ids = [int(guild), *sorted(self.roles[int(guild)] - {int(guild)})]
+        return [
+            self._app.entity_factory.deserialize_role(
+                {
+                    "id": str(id),
+                    "name": str(id),
+                    "color": 0,
+                    "hoist": False,
+                    "position": position,
+                    "permissions": "0",
+                    "managed": False,
+                    "mentionable": False,
+                },
+                guild_id=hikari.Snowflake(int(guild)),
+            )
+            for position, id in enumerate(ids)
+        ]
+
+    async def add_role_to_member(
+        self,
+        guild: hikari.SnowflakeishOr[Any],
+        user: hikari.SnowflakeishOr[Any],
+        role: hikari.SnowflakeishOr[Any],
+        *,
+        reason: Any = hikari.UNDEFINED,
+    ):
+        await self._call("add_role_to_member")
+        key = (int(guild), int(user))
+        member = self.members.get(key)
+        if member is not None:
+            self.members[key] = {**member, "roles": [*member["roles"], str(int(role))]}
+        self.roles[int(guild)].add(int(role))
+
+
+class _Guild:
+    def __init__(self, rest: FakeRest, id: int):
+        self._rest = rest
+        self.id = id
+
+    def get_member(self, user: hikari.Snowflakeish) -> hikari.Member:
+        return self._rest.member(self.id, int(user))
+
+
+class _Cache:
+    def __init__(self, rest: FakeRest):
+        self._rest = rest
+
+    def get_guild(self, guild: hikari.Snowflakeish) -> _Guild:
+        return _Guild(self._rest, int(guild))
+
+
+class FakeApp:
+    """Enough of a bot for replayed events: entity factories, REST and a cache."""
+
+    def __init__(self, latency: float = 0.0):
+        app = cast(traits.RESTAware, self)
+        self.entity_factory = entity_factory.EntityFactoryImpl(app)
+        self.event_factory = event_factory.EventFactoryImpl(app)
+        self.rest = FakeRest(self, latency)
+        self.cache = _Cache(self.rest)
+
+
+def _timer(timings: dict[str, list[float]]) -> Callable[[_Handler], _Handler]:
+    def wrap(handler: _Handler) -> _Handler:
+        name = f"{handler.__module__.removeprefix('behaviours.')}.{handler.__name__}"
+
+        async def timed(event: Any):
+            started_at = time.perf_counter()
+            try:
+                await handler(event)
+            finally:
+                timings[name].append(time.perf_counter() - started_at)
+
+        return timed
+
+    return wrap
+
+
+async def replay(
+    path: str, speed: float | None = None, latency: float = 0.0
+) -> dict[str, Any]:
+    """
+    Replay the recording at `path`, `speed` times as fast as it was recorded
+    or as fast as possible if None, and return the report.
+    """
+    import behaviours
+    import commons.db as db
+    from commons import counters, scheduler
+    from commons.routing import Pipeline
+
+    app = FakeApp(latency)
+    timings: dict[str, list[float]] = defaultdict(list)
+    pipelines = {
+        event_type: Pipeline(chain, _timer(timings))
+        for event_type, chain in behaviours.CHAINS.items()
+    }
+    factory = app.event_factory
+    deserializers: dict[str, Callable[[Any, dict[str, Any]], hikari.Event]] = {
+        "MESSAGE_CREATE": factory.deserialize_message_create_event,
+        "MESSAGE_UPDATE": factory.deserialize_message_update_event,
+        "MESSAGE_DELETE": factory.deserialize_message_delete_event,
+        "MESSAGE_REACTION_ADD": factory.deserialize_message_reaction_add_event,
+        "MESSAGE_REACTION_REMOVE": factory.deserialize_message_reaction_remove_event,
+    }
+    shard = object()
+    behaviours.load()
+    actions = asyncio.create_task(scheduler.start(cast(hikari.RESTAware, app)))
+
+    replayed: Counter[str] = Counter()
+    first_at: float | None = None
+    started_at = time.perf_counter()
+    for received_at, name, payload in recorder.read(path):
+        if speed is not None:
+            first_at = received_at if first_at is None else first_at
+            ahead = (received_at - first_at) / speed - (
+                time.perf_counter() - started_at
+            )
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+        app.rest.observe(name, payload)
+        event = deserializers[name](shard, payload)
+        pipeline = pipelines.get(type(event))
+        if pipeline is not None:
+            await behaviours.dispatch(event, pipeline)
+        replayed[name] += 1
+    # Chains queue background stages as they run, so both queues are empty
+    # at once only when everything is done.
+    while any(
+        stats.queue_depth or stats.running
+        for stats in (behaviours.event_stats(), behaviours.background_stats())
+    ):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started_at
+
+    actions.cancel()
+    await counters.flush()
+    await behaviours.stop()
+    await db.close()
+    events = sum(replayed.values())
+    return {
+        "version": version(),
+        "ran_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "recording": path,
+        "speed": speed or "max",
+        "rest_latency_ms": latency * 1000,
+        "events": dict(replayed),
+        "seconds": elapsed,
+        "events_per_second": events / elapsed if elapsed else 0.0,
+        "queues": {
+            "events": _queue_report(behaviours.event_stats()),
+            "background": _queue_report(behaviours.background_stats()),
+        },
+        "stages": {
+            name: _histogram_report(h)
+            for name, h in sorted(behaviours.stage_stats().items())
+        },
+        "rest_calls": dict(app.rest.calls),
+        "results": {name: summarise(t) for name, t in sorted(timings.items())},
+    }
+
+
+def _histogram_report(h: metrics.Histogram) -> dict[str, float]:
+    # Histograms are bucketed, so these are upper bounds within a factor of 2.
+    return {
+        "runs": h.count,
+        "mean_ms": h.mean_seconds * 1000,
+        "p50_ms": h.percentile(50) * 1000,
+        "p99_ms": h.percentile(99) * 1000,
+        "max_ms": h.max_seconds * 1000,
+    }
+
+
+def _queue_report(stats: QueueStats) -> dict[str, Any]:
+    return {
+        "processed": stats.processed,
+        "shed": stats.shed,
+        "dropped": stats.dropped,
+        "queue_wait": _histogram_report(stats.queue_wait),
+    }
+
+
+def _speed(value: str) -> float | None:
+    return None if value == "max" else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded gateway events through the behaviours."
+    )
+    parser.add_argument("recording", help="A file written with KITTY_RECORD_EVENTS")
+    parser.add_argument(
+        "--database", help="Database the handlers use. Defaults to a new one."
+    )
+    parser.add_argument(
+        "--speed",
+        type=_speed,
+        default=None,
+        help="A multiple of the recorded pace, or max (the default)",
+    )
+    parser.add_argument("--rest-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="A previous report to compare against")
+    args = parser.parse_args()
+    # commons.db opens KITTY_DB on import, so it is pointed at the replay
+    # database before anything imports it.
+    os.environ["KITTY_DB"] = args.database or os.path.join(
+        tempfile.mkdtemp(), "replay.sqlite"
+    )
+    report = asyncio.run(
+        replay(args.recording, args.speed, args.rest_latency_ms / 1000)
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    baseline: dict[str, Any] = {"results": {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(
+        f"{sum(report['events'].values())} events in {report['seconds']:.2f}s,"
+        f" {report['events_per_second']:.1f}/s"
+    )
+    print("\n".join(compare(report, baseline)))
+    for name, stage in report["stages"].items():
+        print(f"stage {name}: p50 {stage['p50_ms']:.1f}ms, p99 {stage['p99_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
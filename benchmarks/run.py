@@ -0,0 +1,339 @@
+"""
+Time every query path behind the stats commands and behaviours against a
+database, such as one built by `benchmarks.generate`, and write a JSON report.
+
+    python -m benchmarks.run bench.sqlite --output report.json --baseline old.json
+
+SQL paths are timed on a read-only connection with the statements as
+registered by the modules that run them, so the report follows the code. The
+message board and per-message rank tracking are timed on the in-memory
+leaderboard the bot builds from message_counts. Passing a previous report as
+`--baseline` prints how each path changed.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+MODULES = ("commons", "behaviours", "commands")
+
+
+@dataclass
+class Sample:
+    """Random but realistic arguments, drawn from the database itself."""
+
+    guilds: list[int]
+    users: list[tuple[int, int]]
+    emoji_uses: list[tuple[int, int, str, int]]
+    since_ms: int
+    rng: random.Random
+
+    def user(self) -> tuple[int, int]:
+        return self.rng.choice(self.users)
+
+    def emoji_use(self) -> tuple[int, int, str, int]:
+        return self.rng.choice(self.emoji_uses)
+
+
+@dataclass(frozen=True)
+class Case:
+    """A query path, timed by running `statement` with `parameters(sample)`."""
+
+    name: str
+    statement: str
+    parameters: Callable[[Sample], tuple[Any, ...]]
+
+
+_MONTH = 31 * 24 * 60 * 60
+
+
+def _emoji_users_parameters(s: Sample) -> tuple[Any, ...]:
+    guild, _, emoji, _ = s.emoji_use()
+    return (guild, emoji)
+
+
+def _emoji_rank_parameters(s: Sample) -> tuple[Any, ...]:
+    guild, _, emoji, count = s.emoji_use()
+    return (guild, emoji, count)
+
+
+def _emoji_trend_parameters(s: Sample) -> tuple[Any, ...]:
+    guild, _, emoji, _ = s.emoji_use()
+    return (guild, emoji, s.since_ms // 1000 - _MONTH)
+
+
+CASES = [
+    Case(
+        "/emojilovers",
+        "emoji_users.top_users",
+        _emoji_users_parameters,
+    ),
+    Case(
+        "/emojiusage count",
+        "emoji_stats.user_count",
+        lambda s: s.emoji_use()[:3],
+    ),
+    Case(
+        "/emojiusage rank",
+        "emoji_stats.rank",
+        _emoji_rank_parameters,
+    ),
+    Case(
+        "/emojicloud server",
+        "emojicloud.server_top",
+        lambda s: (s.rng.choice(s.guilds), 20),
+    ),
+    Case(
+        "/userinfo top emoji",
+        "userinfo.top_emoji",
+        lambda s: s.user(),
+    ),
+    Case(
+        "/memestats server",
+        "rollups.server_meme_scores",
+        lambda s: (0, s.rng.choice(s.guilds), s.since_ms // 1000 - _MONTH),
+    ),
+    Case(
+        "/memestats user",
+        "rollups.user_meme_scores",
+        lambda s: (0, *s.user(), s.since_ms // 1000 - 12 * _MONTH),
+    ),
+    Case(
+        "/activeboard month",
+        "rollups.message_leaderboard",
+        lambda s: (s.rng.choice(s.guilds), s.since_ms // 1000 - _MONTH, 10),
+    ),
+    Case(
+        "/emojitrend month",
+        "rollups.emoji_trend",
+        _emoji_trend_parameters,
+    ),
+    Case(
+        "/deletesinquiry",
+        "deletes.top_deleters",
+        lambda s: (s.rng.choice(s.guilds),),
+    ),
+    Case(
+        "/shitmemeboard",
+        "shitmemeboard.page",
+        lambda s: (s.rng.choice(s.guilds), 0, 10),
+    ),
+    Case(
+        "meme rating lookup",
+        "meme_stat.get",
+        lambda s: (s.rng.randrange(1 << 62),),
+    ),
+]
+
+
+def _import_registering_modules() -> list[str]:
+    """Import every module that may register statements, returning those that could not be."""
+    skipped: list[str] = []
+    for package in MODULES:
+        for info in pkgutil.iter_modules([package]):
+            try:
+                importlib.import_module(f"{package}.{info.name}")
+            except ImportError as e:
+                skipped.append(f"{package}.{info.name} (missing {e.name})")
+    return skipped
+
+
+def _sample(conn: sqlite3.Connection, seed: int) -> Sample:
+    rng = random.Random(seed)
+    # Commands are run by active users more often than by lurkers.
+    users = conn.execute(
+        "SELECT guild, user FROM message_counts ORDER BY count DESC LIMIT 1000"
+    ).fetchall()
+    users += conn.execute(
+        "SELECT guild, user FROM message_counts ORDER BY random() LIMIT 1000"
+    ).fetchall()
+    emoji_uses = conn.execute(
+        "SELECT guild, user, emoji, count FROM emoji_counts ORDER BY random() LIMIT 1000"
+    ).fetchall()
+    guilds = [
+        row[0] for row in conn.execute("SELECT DISTINCT guild FROM message_counts")
+    ]
+    latest = conn.execute("SELECT max(time_sent) FROM meme_stats").fetchone()[0]
+    return Sample(
+        guilds or [0],
+        users or [(0, 0)],
+        emoji_uses or [(0, 0, "", 0)],
+        latest or int(time.time() * 1000),
+        rng,
+    )
+
+
+def summarise(seconds: list[float]) -> dict[str, float]:
+    ms = sorted(s * 1000 for s in seconds)
+    cuts = (
+        statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    )
+    return {
+        "runs": len(ms),
+        "mean_ms": statistics.fmean(ms),
+        "p50_ms": cuts[49],
+        "p90_ms": cuts[89],
+        "p99_ms": cuts[98],
+        "max_ms": ms[-1],
+    }
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> list[float]:
+    timings: list[float] = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def _time_statement(
+    conn: sqlite3.Connection, sql: str, case: Case, sample: Sample, repeat: int
+) -> list[float]:
+    # Warm the page cache so the first runs are not all disk reads.
+    conn.execute(sql, case.parameters(sample)).fetchall()
+    return _time(lambda: conn.execute(sql, case.parameters(sample)).fetchall(), repeat)
+
+
+def _leaderboard_results(
+    conn: sqlite3.Connection, sample: Sample, repeat: int
+) -> dict[str, dict[str, float]]:
+    from commons.leaderboard import Leaderboard
+
+    guild = sample.user()[0]
+    rows = conn.execute(
+        "SELECT user, count FROM message_counts WHERE guild = ?", (guild,)
+    ).fetchall()
+    timings = _time(lambda: Leaderboard(rows), max(1, repeat // 100))
+    results = {"leaderboard load": summarise(timings)}
+    board = Leaderboard(rows)
+    users = [user for g, user in sample.users if g == guild]
+    pages = max(1, len(board) // 10)
+    results["/messageboard"] = summarise(
+        _time(lambda: board.page(min(sample.rng.randrange(4), pages - 1)), repeat)
+    )
+
+    def count_message():
+        # behaviours/userinfo.analyse_message on every message.
+        user = sample.rng.choice(users)
+        board.add(user)
+        board.rank(user)
+        board.count(user)
+
+    results["message rank update"] = summarise(_time(count_message, repeat))
+    return results
+
+
+def run(path: str, repeat: int = 200, seed: int = 0) -> dict[str, Any]:
+    """Time every case against the database at `path` and return the report."""
+    skipped = _import_registering_modules()
+    import commons.db as db
+
+    statements = {s.label: s.sql for s in db.statements()}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.execute("PRAGMA mmap_size = 268435456")
+    try:
+        sample = _sample(conn, seed)
+        tables = {
+            table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            for table in (
+                "message_counts",
+                "emoji_counts",
+                "meme_stats",
+                "message_deletes",
+                "shit_meme_deletes",
+            )
+        }
+        results: dict[str, dict[str, float]] = {}
+        not_run: dict[str, str] = {}
+        for case in CASES:
+            sql = statements.get(case.statement)
+            if sql is None:
+                not_run[case.name] = f"{case.statement} is not registered"
+                continue
+            results[case.name] = summarise(
+                _time_statement(conn, sql, case, sample, repeat)
+            )
+        results.update(_leaderboard_results(conn, sample, repeat))
+    finally:
+        conn.close()
+    return {
+        "version": version(),
+        "ran_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "database": {"path": path, "bytes": os.path.getsize(path), "rows": tables},
+        "repeat": repeat,
+        "results": results,
+        "not_run": not_run,
+        "skipped_modules": skipped,
+    }
+
+
+def version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """Lines comparing each path's p50 and p99 against `baseline`."""
+    lines = [f"{'path':<24} {'p50 ms':>18} {'p99 ms':>18}"]
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        cells: list[str] = []
+        for key in ("p50_ms", "p99_ms"):
+            if before is None:
+                cells.append(f"{result[key]:>18.3f}")
+            else:
+                change = result[key] / before[key] if before[key] else float("inf")
+                cells.append(f"{result[key]:>9.3f} ({change:>5.2f}x)")
+        lines.append(f"{name:<24} {' '.join(cells)}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the stats query paths against a database."
+    )
+    parser.add_argument("database", help="Database to benchmark")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="A previous report to compare against")
+    args = parser.parse_args()
+    # Registering statements imports commons.db, which opens KITTY_DB. Point it
+    # at the benchmark database so the live one is never touched.
+    os.environ["KITTY_DB"] = args.database
+    report = run(args.database, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    baseline: dict[str, Any] = {"results": {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print("\n".join(compare(report, baseline)))
+    for name, reason in report["not_run"].items():
+        print(f"{name}: not run, {reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,11 @@ dotenv.load_dotenv()
 
 import behaviours
 import commons.agents
+import commons.backfill
+import commons.backup
+import commons.counters
+import commons.db
+import commons.maintenance
 import commons.scheduler
 
 bot = lightbulb.BotApp(
@@ -42,6 +47,9 @@ bot = lightbulb.BotApp(
 
 @bot.listen(hikari.StartedEvent)
 async def botStartup(event: hikari.StartedEvent):
+    commons.maintenance.schedule()
+    commons.backup.schedule()
+    await commons.backfill.resume(event.app.rest, behaviours.userinfo.record_message)
     await commons.scheduler.start(event.app)
 
 
@@ -70,6 +78,10 @@ async def on_starting(event: hikari.StartingEvent) -> None:
 @bot.listen()
 async def on_stopping(event: hikari.StoppingEvent) -> None:
     await bot.d.aio_session.close()
+    commons.scheduler.stop()
+    await behaviours.stop()
+    await commons.counters.flush()
+    await commons.db.close()
 
 
 commons.agents.load()
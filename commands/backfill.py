@@ -0,0 +1,63 @@
+import os
+from datetime import datetime, timezone
+import lightbulb
+import behaviours.userinfo
+from commons import backfill
+
+plugin = lightbulb.Plugin("Backfill")
+
+
+def format_progress(progress: backfill.Progress) -> str:
+    return f"{progress.done}/{progress.channels} channels done, {progress.messages:,} messages counted."
+
+
+@plugin.command
+@lightbulb.option(
+    "until",
+    "When live counting began (YYYY-MM-DD), required the first time",
+    type=str,
+    required=False,
+)
+@lightbulb.command("backfill", "Count messages and emoji from channel history")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def main(ctx: lightbulb.Context) -> None:
+    if not ctx.member or ctx.guild_id is None:
+        return
+    current_roles = (await ctx.member.fetch_roles())[1:]
+    if not any(r.id == int(os.environ["BOT_ADMIN_ROLE"]) for r in current_roles):
+        await ctx.respond("Not an admin")
+        return
+    if backfill.running(ctx.guild_id):
+        progress = await backfill.progress(ctx.guild_id)
+        await ctx.respond(f"Backfill running: {format_progress(progress)}")
+        return
+    until = None
+    if ctx.options.until:
+        try:
+            until = datetime.strptime(ctx.options.until, "%Y-%m-%d").replace(
+                tzinfo=timezone.utc
+            )
+        except ValueError:
+            await ctx.respond("Give the date as YYYY-MM-DD")
+            return
+    # Messages are only counted once if every backfill stops where live
+    # counting began, so the first one's date is kept for the guild.
+    recorded = await backfill.boundary(ctx.guild_id)
+    if recorded is None and until is None:
+        await ctx.respond(
+            "Give the date live counting began, as YYYY-MM-DD, e.g. `+backfill 2024-05-01`"
+        )
+        return
+    if recorded is not None and until is not None and until != recorded:
+        await ctx.respond(
+            f"This server is already backfilled up to {recorded:%Y-%m-%d}, send `+backfill` to carry on"
+        )
+        return
+    backfill.start(
+        ctx.app.rest, ctx.guild_id, behaviours.userinfo.record_message, until
+    )
+    await ctx.respond("Backfill started, send `+backfill` again to see how it's going.")
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
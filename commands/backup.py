@@ -0,0 +1,33 @@
+import os
+import lightbulb
+from commons import backup, metrics
+
+plugin = lightbulb.Plugin("Backup")
+
+
+def format_snapshot(snapshot: backup.Snapshot) -> str:
+    steps = metrics.histogram("backup.step").snapshot()
+    return (
+        f"Backed up {snapshot.bytes / 2**20:.1f}MiB ({snapshot.pages} pages) to `{snapshot.path}` "
+        f"in {snapshot.seconds:.1f}s, {snapshot.bytes_per_second / 2**20:.1f}MiB/s. "
+        f"Steps p50 {steps.percentile(50) * 1000:.1f}ms, p99 {steps.percentile(99) * 1000:.1f}ms."
+    )
+
+
+@plugin.command
+@lightbulb.command("backup", "Take a snapshot of the database")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def main(ctx: lightbulb.Context) -> None:
+    if not ctx.member:
+        return
+    current_roles = (await ctx.member.fetch_roles())[1:]
+    for role in current_roles:
+        if role.id == int(os.environ["BOT_ADMIN_ROLE"]):
+            await ctx.respond("Taking a snapshot...")
+            await ctx.respond(format_snapshot(await backup.snapshot()))
+            return
+    await ctx.respond("Not an admin")
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
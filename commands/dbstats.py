@@ -0,0 +1,48 @@
+import os
+import lightbulb
+import commons.db as db
+from commons import metrics
+
+plugin = lightbulb.Plugin("DbStats")
+
+
+def format_histogram(label: str, h: metrics.Histogram) -> str:
+    return f"{label}: {h.count}x, p50 {h.percentile(50) * 1000:.2f}ms, p99 {h.percentile(99) * 1000:.2f}ms, max {h.max_seconds * 1000:.2f}ms"
+
+
+def format_section(title: str, histograms: dict[str, metrics.Histogram]) -> list[str]:
+    lines = [title]
+    for label, h in sorted(histograms.items(), key=lambda item: -item[1].total_seconds):
+        lines.append(format_histogram(label, h))
+    return lines
+
+
+def format_stats() -> str:
+    stats = db.writer_stats()
+    lines = [
+        f"Writer queue depth: {stats.queue_depth}",
+        format_histogram("Writer queue wait", stats.queue_wait),
+        "",
+    ]
+    lines += format_section("Writer jobs:", stats.jobs)
+    lines.append("")
+    lines += format_section("Statements:", db.statement_stats())
+    return "```" + "\n".join(lines)[:1990] + "```"
+
+
+@plugin.command
+@lightbulb.command("dbstats", "Database queue depth and latency histograms")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def main(ctx: lightbulb.Context) -> None:
+    if not ctx.member:
+        return
+    current_roles = (await ctx.member.fetch_roles())[1:]
+    for role in current_roles:
+        if role.id == int(os.environ["BOT_ADMIN_ROLE"]):
+            await ctx.respond(format_stats())
+            return
+    await ctx.respond("Not an admin")
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
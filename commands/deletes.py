@@ -5,16 +5,20 @@ import commons.db as db
 
 plugin = lightbulb.Plugin("deletesinquiry")
 
+_TOP_DELETERS = db.statement(
+    "deletes.top_deleters",
+    """
+    SELECT user, count FROM message_deletes
+    WHERE guild = ?
+    ORDER BY count DESC
+    LIMIT 5""",
+)
+
 
 async def show_deletes(ctx: lightbulb.Context) -> None:
     if ctx.member is None:
         return
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT user, count FROM message_deletes
-        ORDER BY count DESC
-        LIMIT 5""")
-    deletes = cursor.fetchall()
+    deletes = await db.query(_TOP_DELETERS, (ctx.member.guild_id,))
     top_deleter = get_member(ctx, deletes[0][0])
     delete_list = list[str]()
     for rank in range(len(deletes)):
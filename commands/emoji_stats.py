@@ -4,38 +4,49 @@ import commons.db as db
 
 plugin = lightbulb.Plugin("Emoji stats.")
 
+_USER_COUNT = db.statement(
+    "emoji_stats.user_count",
+    """
+    SELECT count FROM emoji_counts
+    WHERE guild = ? AND user = ? AND emoji = ?""",
+)
+_RANK = db.statement(
+    "emoji_stats.rank",
+    """
+    SELECT coalesce(sum(users), 0) + 1 FROM emoji_count_histogram
+    WHERE guild = ? AND emoji = ? AND count > ?""",
+)
+_TOTAL = db.statement(
+    "emoji_stats.total",
+    """
+    SELECT count FROM emoji_totals
+    WHERE guild = ? AND emoji = ?""",
+)
+
 
 async def show_emoji_stats(
     ctx: lightbulb.Context, user: hikari.User, emoji: str
 ) -> None:
     if ctx.member is None:
         return
+    guild_id = ctx.member.guild_id
     user_id = user.id
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        SELECT count FROM emoji_counts
-        WHERE user = ? AND emoji = ?
-        """,
-        (user_id, emoji),
-    )
 
-    count = 0
-    row = cursor.fetchone()
-    if (row is None) or (row[0] == 0):  # If the emoji isn't in the db for this user.
+    def fetch_count_and_rank(cursor: db.Cursor) -> tuple[int, int, int] | None:
+        cursor.execute(_USER_COUNT, (guild_id, user_id, emoji))
+        row = cursor.fetchone()
+        if (row is None) or (row[0] == 0):
+            return None
+        cursor.execute(_RANK, (guild_id, emoji, row[0]))
+        rank = cursor.fetchone()[0]
+        cursor.execute(_TOTAL, (guild_id, emoji))
+        return (row[0], rank, cursor.fetchone()[0])
+
+    row = await db.read(fetch_count_and_rank)
+    if row is None:  # If the emoji isn't in the db for this user.
         await ctx.respond(f"{user.display_name} hasn't used {emoji} yet.")
         return
-    else:
-        count = row[0]  # Count of the emoji?
-
-    cursor.execute(
-        """
-        SELECT COUNT(*) + 1 FROM emoji_counts
-        WHERE count > ? AND emoji = ?
-    """,
-        (count, emoji),
-    )
-    rank = cursor.fetchone()[0]
+    count, rank, total = row
     embed = (
         hikari.Embed(
             title=f"{user.display_name}'s usage of {emoji}:",
@@ -50,7 +61,7 @@ async def show_emoji_stats(
         .add_field(
             f"Stats:",
             f"""{emoji} has been used `{count}` time(s)!
-            Across the server, {user.display_name} ranks `#{rank}` in using {emoji}.""",
+            Across the server, {user.display_name} ranks `#{rank}` in using {emoji}, which has been used `{total}` time(s) in all.""",
             inline=False,
         )
     )
@@ -5,6 +5,15 @@ import commons.db as db
 
 plugin = lightbulb.Plugin("Emoji lovers.")
 
+_TOP_USERS = db.statement(
+    "emoji_users.top_users",
+    """
+    SELECT user, count FROM emoji_counts
+    WHERE guild = ? AND emoji = ? AND count > 0
+    ORDER BY count DESC
+    LIMIT 5""",
+)
+
 
 def plural_or_not(number: int):
     if number == 1:
@@ -16,16 +25,7 @@ def plural_or_not(number: int):
 async def show_emoji_lovers(ctx: lightbulb.Context, emoji: str) -> None:
     if ctx.member is None:
         return
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        SELECT user, count FROM emoji_counts
-        WHERE emoji = ? AND count > 0
-        ORDER BY count DESC
-        LIMIT 5""",
-        (emoji,),
-    )
-    users = cursor.fetchall()
+    users = await db.query(_TOP_USERS, (ctx.member.guild_id, emoji))
     user_list = list[str]()
     for rank in range(len(users)):
         user = get_member(ctx, users[rank][0])  # Check user is still in server.
@@ -14,6 +14,23 @@ import commons.emoji_cache as emoji_cache
 
 plugin = lightbulb.Plugin("EmojiCloud")
 
+_USER_TOP = db.statement(
+    "emojicloud.user_top",
+    """
+    SELECT emoji, count FROM emoji_counts
+    WHERE guild = ? AND user = ?
+    ORDER BY count DESC
+    LIMIT ?""",
+)
+_SERVER_TOP = db.statement(
+    "emojicloud.server_top",
+    """
+    SELECT emoji, count FROM emoji_totals
+    WHERE guild = ? AND count > 0
+    ORDER BY count DESC
+    LIMIT ?""",
+)
+
 
 @plugin.command
 @lightbulb.add_cooldown(10, 1, lightbulb.UserBucket)
@@ -42,26 +59,20 @@ async def main(ctx: lightbulb.Context) -> None:
     await ctx.respond(
         f"*Generating EmojiCloud for **{ctx.options.target.display_name if ctx.options.target else 'server'}**, give me a couple of seconds:*"
     )
-    cursor = db.cursor()
     max_emojis = ctx.options.max_emojis
 
     if ctx.options.target:
         user_id = ctx.options.target.id
-        counts = cursor.execute(
-            "select emoji, count from emoji_counts where user = ? order by count desc limit ?",
-            (user_id, max_emojis),
-        ).fetchall()
+        counts = await db.query(_USER_TOP, (ctx.guild_id, user_id, max_emojis))
     else:
-        counts = cursor.execute(
-            "select emoji, sum(count) from emoji_counts group by emoji order by count desc limit ?",
-            (max_emojis,),
-        ).fetchall()
+        counts = await db.query(_SERVER_TOP, (ctx.guild_id, max_emojis))
 
     # Cache all used emojis to use later. Remove Deleted Emojis from the data
     counts = [
         i
         for i in counts
-        if not i[0].startswith("<") or await emoji_cache.get_file_name(i[0], ctx.bot)
+        if not i[0].startswith("<")
+        or await emoji_cache.get_file_name(i[0], ctx.bot, ctx.guild_id)
     ]
 
     if len(counts) == 0:
@@ -83,7 +94,7 @@ async def main(ctx: lightbulb.Context) -> None:
     for p in listofimages:
         # p[3] is emoji identifier
         if p[3][0] == "<":  # Custom Emoji have "<" in the beginning
-            file_name = await emoji_cache.get_file_name(p[3], ctx.bot)
+            file_name = await emoji_cache.get_file_name(p[3], ctx.bot, ctx.guild_id)
             if file_name:
                 thumbnail = Image.open(os.path.join(script_dir, "..", file_name))
                 max_num_frames = max(max_num_frames, thumbnail.n_frames)
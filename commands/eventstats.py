@@ -0,0 +1,44 @@
+import os
+import lightbulb
+import behaviours
+import commands.dbstats
+from commons.event_queue import QueueStats
+
+plugin = lightbulb.Plugin("EventStats")
+
+
+def format_queue(title: str, stats: QueueStats) -> list[str]:
+    return [
+        title,
+        f"Queued: {stats.queue_depth} in {stats.channels} channels, {stats.running} running",
+        f"Processed: {stats.processed}, shed: {stats.shed}, dropped: {stats.dropped}",
+        commands.dbstats.format_histogram("Queue wait", stats.queue_wait),
+        commands.dbstats.format_histogram("Run", stats.run),
+    ]
+
+
+def format_stats() -> str:
+    lines = format_queue("Events:", behaviours.event_stats())
+    lines.append("")
+    lines += format_queue("Background stages:", behaviours.background_stats())
+    lines.append("")
+    lines += commands.dbstats.format_section("Stages:", behaviours.stage_stats())
+    return "```" + "\n".join(lines)[:1990] + "```"
+
+
+@plugin.command
+@lightbulb.command("eventstats", "Event queue depth, shedding and stage latency")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def main(ctx: lightbulb.Context) -> None:
+    if not ctx.member:
+        return
+    current_roles = (await ctx.member.fetch_roles())[1:]
+    for role in current_roles:
+        if role.id == int(os.environ["BOT_ADMIN_ROLE"]):
+            await ctx.respond(format_stats())
+            return
+    await ctx.respond("Not an admin")
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
@@ -0,0 +1,45 @@
+import os
+import lightbulb
+import commons.db as db
+from commons import export
+
+plugin = lightbulb.Plugin("Export")
+
+
+def format_export(result: export.Export) -> str:
+    tables = ", ".join(f"{table} {rows:,}" for table, rows in result.rows.items())
+    return (
+        f"Exported {tables} rows to `{result.directory}` in {len(result.files)} files, "
+        f"{result.bytes / 2**20:.1f}MiB compressed, in {result.seconds:.1f}s "
+        f"({result.rows_per_second:,.0f} rows/s)."
+    )
+
+
+@plugin.command
+@lightbulb.option(
+    "format",
+    "File format",
+    type=str,
+    choices=export.FORMATS,
+    default="ndjson",
+    required=False,
+)
+@lightbulb.command("export", "Export the statistics tables for offline analysis")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def main(ctx: lightbulb.Context) -> None:
+    if not ctx.member:
+        return
+    current_roles = (await ctx.member.fetch_roles())[1:]
+    for role in current_roles:
+        if role.id == int(os.environ["BOT_ADMIN_ROLE"]):
+            await ctx.respond("Exporting...")
+            result = await export.export(
+                db.path(), ctx.options.format, attached=db.attached()
+            )
+            await ctx.respond(format_export(result))
+            return
+    await ctx.respond("Not an admin")
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
@@ -2,7 +2,7 @@
 Displays a graph of meme ratings for a user, grouped by day.
 """
 
-import commons.db as db
+from commons import rollups
 import hikari
 import lightbulb
 import matplotlib.pyplot as plt
@@ -32,7 +32,8 @@ plugin = lightbulb.Plugin("MemeStats")
 )
 async def main(ctx: lightbulb.Context | lightbulb.UserContext):
     guild = ctx.get_guild()
-    cursor = db.cursor()
+    if ctx.guild_id is None:
+        return
     calculate_for_server = True
 
     target_user = ctx.options.target
@@ -49,36 +50,17 @@ async def main(ctx: lightbulb.Context | lightbulb.UserContext):
         datetime.datetime.now().astimezone().tzinfo.utcoffset(None).total_seconds()
     )
 
-    if not calculate_for_server:
-        data = cursor.execute(
-            f"""
-            select 
-                strftime('%Y-%m-%d', datetime(time_sent, '{utcoffset_seconds} seconds')) as time_period,
-                avg(meme_score) as avg_meme_score
-            from
-                meme_stats
-            where 
-                user = ? and time_sent >= date('now', '{-1 * utcoffset_seconds} seconds', '-1 {time_period_param}')
-            group by
-                time_period
-        """,
-            (target_user.id,),
-        ).fetchall()
-    else:
-        data = cursor.execute(
-            f"""
-            select 
-                strftime('%Y-%m-%d', datetime(time_sent, '{utcoffset_seconds} seconds')) as time_period,
-                avg(meme_score) as avg_meme_score
-            from
-                meme_stats
-            where 
-                time_sent >= date('now', '{-1 * utcoffset_seconds} seconds', '-1 {time_period_param}')
-            group by
-                time_period
-        """,
-            (),
-        ).fetchall()
+    # Start at local midnight so the first day is complete.
+    since = (
+        pd.Timestamp(datetime.datetime.now().astimezone())
+        - pd.DateOffset(**{f"{time_period_param}s": 1})
+    ).normalize()
+    data = await rollups.meme_scores_by_day(
+        ctx.guild_id,
+        since,
+        utcoffset_seconds,
+        None if calculate_for_server else target_user.id,
+    )
 
     if not data:
         await ctx.respond(
@@ -28,6 +28,8 @@ loading_messages = [
 async def rate_meme_command(ctx: lightbulb.MessageContext) -> None:
     """Rate a meme using the meme rater."""
     message = ctx.options.target
+    if ctx.guild_id is None:
+        return
 
     # Check if message has any media content
     if not message.attachments and not message.embeds:
@@ -50,7 +52,7 @@ async def rate_meme_command(ctx: lightbulb.MessageContext) -> None:
 
     ratings = await meme_rater.process_message_content(message)
 
-    results = await meme_rater.rate_meme(message, ratings)
+    results = await meme_rater.rate_meme(message, ratings, ctx.guild_id)
     if not results:
         await ctx.edit_last_response("Failed to rate the meme...")
         return
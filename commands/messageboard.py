@@ -3,7 +3,7 @@ from datetime import datetime
 from itertools import chain
 from emoji import replace_emoji
 import hikari, lightbulb
-import commons.db as db
+import commons.leaderboard as leaderboard
 import numpy as np
 import matplotlib.font_manager as fm
 import matplotlib.image as image
@@ -15,14 +15,8 @@ import toolbox
 plugin = lightbulb.Plugin("MessageBoard.")
 
 
-def get_message_data(set_num):
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT user, count FROM message_counts
-        ORDER BY count DESC
-        LIMIT {},{}""".format(set_num * 10, 10))
-    data = cursor.fetchall()
-    return data
+async def get_message_data(guild_id, set_num):
+    return leaderboard.page(guild_id, set_num, 10)
 
 
 async def graph_shit(ctx: lightbulb.Context, plot_type, set_num, data):
@@ -213,7 +207,9 @@ async def graph_shit(ctx: lightbulb.Context, plot_type, set_num, data):
 
 
 async def show_message_stats(ctx: lightbulb.Context, plot_type, set_num) -> None:
-    data = get_message_data(set_num)
+    if ctx.guild_id is None:
+        return
+    data = await get_message_data(ctx.guild_id, set_num)
     await graph_shit(ctx, plot_type, set_num, data)
 
 
@@ -11,19 +11,24 @@ from .messageboard import graph_shit
 
 plugin = lightbulb.Plugin("Shitmemeboard.")
 
+_PAGE = db.statement(
+    "shitmemeboard.page",
+    """
+    SELECT user, count FROM shit_meme_deletes
+    WHERE guild = ?
+    ORDER BY count DESC
+    LIMIT ?, ?""",
+)
+
 
-def get_shitmeme_data(set_num):
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT user, count FROM shit_meme_deletes
-        ORDER BY count DESC
-        LIMIT {},{}""".format(set_num * 10, 10))
-    data = cursor.fetchall()
-    return data
+async def get_shitmeme_data(guild_id, set_num):
+    return await db.query(_PAGE, (guild_id, set_num * 10, 10))
 
 
 async def show_message_stats(ctx: lightbulb.Context, plot_type, set_num) -> None:
-    data = get_shitmeme_data(set_num)
+    if ctx.guild_id is None:
+        return
+    data = await get_shitmeme_data(ctx.guild_id, set_num)
     await graph_shit(ctx, plot_type, set_num, data)
 
 
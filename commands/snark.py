@@ -21,7 +21,7 @@ async def setprompt(ctx: lightbulb.Context) -> None:
     for role in current_roles:
         if role.id == int(os.environ["BOT_ADMIN_ROLE"]):
             prompt = ctx.options.prompt
-            db.set_option("LLM_PROMPT", prompt)
+            await db.set_option("LLM_PROMPT", prompt)
             print("Prompt is now: " + prompt)
             await ctx.respond("OK")
             return
@@ -1,4 +1,5 @@
-import commons.db as db
+import commons.leaderboard as leaderboard
+import commons.totals as totals
 import lightbulb
 
 plugin = lightbulb.Plugin("messagecount")
@@ -13,18 +14,9 @@ plugin = lightbulb.Plugin("messagecount")
 async def main(ctx: lightbulb.Context) -> None:
     if not ctx.member:
         return
-    cursor = db.cursor()
-    cursor.execute(
-        """SELECT user, count FROM message_counts 
-                      WHERE user = ?""",
-        (ctx.member.id,),
-    )
-    data = cursor.fetchall()
-    user_message_count = data[0][1]
+    user_message_count = leaderboard.count(ctx.member.guild_id, ctx.member.id)
 
-    cursor.execute("""select sum(count) from message_counts""")
-    data = cursor.fetchall()
-    total_message_count = data[0][0]
+    total_message_count = totals.messages(ctx.member.guild_id)
     percentage = round(user_message_count * 100 / total_message_count, 2)
 
     response = f"""Total Server Messages: **{total_message_count:,}**\nMessages From {ctx.member.mention}: **{user_message_count:,}** ({percentage}%)"""
@@ -0,0 +1,112 @@
+"""
+Recent activity, answered from the daily rollups: who sent the most messages
+this week or month, and how often an emoji was used each day.
+"""
+
+from datetime import datetime, timedelta, timezone
+import hikari, lightbulb
+from commons.message_utils import get_member
+from commons import rollups
+
+plugin = lightbulb.Plugin("Trends")
+
+PERIODS = {"week": 7, "month": 30}
+MAX_BAR_LENGTH = 20
+
+
+def period_start(period: str) -> datetime:
+    """A time in the first UTC day of `period`, counting today as its last."""
+    return datetime.now(timezone.utc) - timedelta(days=PERIODS[period] - 1)
+
+
+def daily_counts(
+    rows: list[tuple[int, int]], since: datetime, days: int
+) -> list[tuple[datetime, int]]:
+    """Each of `days` UTC days from `since`, with its count or 0."""
+    counts = dict(rows)
+    first = rollups.bucket(since, rollups.DAY)
+    return [
+        (
+            datetime.fromtimestamp(first + i * rollups.DAY, timezone.utc),
+            counts.get(first + i * rollups.DAY, 0),
+        )
+        for i in range(days)
+    ]
+
+
+def bar(count: int, most: int) -> str:
+    return "█" * round(MAX_BAR_LENGTH * count / most) if most else ""
+
+
+@plugin.command
+@lightbulb.add_cooldown(10, 1, lightbulb.UserBucket)
+@lightbulb.option(
+    "period", "Time period.", choices=list(PERIODS), default="week", required=False
+)
+@lightbulb.command(
+    "activeboard", "Displays the top 10 'messagers' of the week or month."
+)
+@lightbulb.implements(lightbulb.SlashCommand)
+async def activeboard(ctx: lightbulb.Context) -> None:
+    if ctx.member is None:
+        return
+    period = ctx.options.period or "week"
+    leaders = await rollups.message_leaderboard(
+        ctx.member.guild_id, period_start(period), 10
+    )
+    if not leaders:
+        await ctx.respond(f"Nobody has sent a message this {period}.")
+        return
+    lines = [
+        f"`#{rank}` {get_member(ctx, user).display_name} sent `{count}` {'message' if count == 1 else 'messages'}"
+        for rank, (user, count) in enumerate(leaders, 1)
+    ]
+    embed = (
+        hikari.Embed(
+            title=f"Most active this {period}",
+            colour=0x3B9DFF,
+            timestamp=datetime.now().astimezone(),
+        )
+        .set_footer(
+            text=f"Requested by {ctx.member.display_name}",
+            icon=ctx.member.avatar_url or ctx.member.default_avatar_url,
+        )
+        .add_field("Top 10 messagers:", "\n".join(lines), inline=False)
+    )
+    await ctx.respond(embed)
+
+
+@plugin.command
+@lightbulb.add_cooldown(10, 1, lightbulb.UserBucket)
+@lightbulb.option(
+    "period", "Time period.", choices=list(PERIODS), default="week", required=False
+)
+@lightbulb.option("emoji", "The emoji to show the trend of", type=str, required=True)
+@lightbulb.command("emojitrend", "Displays how often an emoji was used each day.")
+@lightbulb.implements(lightbulb.SlashCommand)
+async def emojitrend(ctx: lightbulb.Context) -> None:
+    if ctx.member is None:
+        return
+    period = ctx.options.period or "week"
+    emoji = ctx.options.emoji.strip()
+    since = period_start(period)
+    rows = await rollups.emoji_trend(ctx.member.guild_id, emoji, since)
+    days = daily_counts(rows, since, PERIODS[period])
+    most = max(count for _, count in days)
+    if not most:
+        await ctx.respond(f"{emoji} hasn't been used this {period}.")
+        return
+    width = len(str(most))
+    lines = [
+        f"{day:%a %d %b} {str(count).rjust(width)} {bar(count, most)}"
+        for day, count in days
+    ]
+    await ctx.respond(
+        f"**{emoji} this {period}**, {sum(count for _, count in days)} uses```"
+        + "\n".join(lines)
+        + "```"
+    )
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
@@ -2,9 +2,19 @@ from datetime import datetime
 import hikari, lightbulb
 from commons.message_utils import NoEntityError, get_member
 import commons.db as db
+import commons.leaderboard as leaderboard
 
 plugin = lightbulb.Plugin("userstats")
 
+_TOP_EMOJI = db.statement(
+    "userinfo.top_emoji",
+    """
+    SELECT emoji, count FROM emoji_counts
+    WHERE guild = ? AND user = ? AND count > 0
+    ORDER BY count DESC
+    LIMIT 5""",
+)
+
 
 def plural_or_not(number: int):
     if number == 1:
@@ -13,47 +23,19 @@ def plural_or_not(number: int):
         return "times"
 
 
-def get_count_and_rank(cursor: db.Cursor, user_id: hikari.Snowflake):
-    cursor.execute(
-        """
-        WITH ranks AS (
-            SELECT user,
-                   count,
-                   rank() OVER (ORDER BY count DESC) AS rank
-            FROM message_counts
-        )
-        SELECT count, rank
-        FROM ranks
-        WHERE user = ?""",
-        (user_id,),
-    )
-    row = cursor.fetchone()
-    if row:
-        return (row[0], row[1])
-    return (None, None)
-
-
 async def emoji_stats(ctx: lightbulb.Context, user: hikari.Member) -> None:
     if not ctx.member:
         return
     user_id = user.id
-    cursor = db.cursor()
-    cursor.execute(
-        """
-        SELECT emoji, count FROM emoji_counts
-        WHERE user = ? AND count > 0
-        ORDER BY count DESC
-        LIMIT 5""",
-        (user_id,),
-    )
-    emoji = cursor.fetchall()
+    emoji = await db.query(_TOP_EMOJI, (user.guild_id, user_id))
     emoji_list = list[str]()
     for rank in range(len(emoji)):
         emoji_list.append(
             f"`#{rank + 1}` {emoji[rank][0]} used `{emoji[rank][1]}` {plural_or_not(emoji[rank][1])}!"
         )
 
-    message_count, rank = get_count_and_rank(cursor, user_id)
+    message_count = leaderboard.count(user.guild_id, user_id)
+    rank = leaderboard.rank(user.guild_id, user_id)
     embed = (
         hikari.Embed(
             title=f"{user.display_name}'s Message Stats",
@@ -37,13 +37,11 @@ def emoji_size(font: ImageFont.FreeTypeFont, emoji: str) -> tuple[float, float]:
 @lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
 async def main(ctx: lightbulb.Context) -> None:
 
-    cursor = db.cursor()
-
     user_id = ctx.options.target.id
-    counts = cursor.execute(
-        "select emoji, count from emoji_counts where user = ? and emoji not like '<%' order by count desc",
-        (user_id,),
-    ).fetchall()
+    counts = await db.query(
+        "select emoji, count from emoji_counts where guild = ? and user = ? and emoji not like '<%' order by count desc",
+        (ctx.guild_id, user_id),
+    )
 
     if len(counts) == 0:
         await ctx.respond(
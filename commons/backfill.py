@@ -0,0 +1,259 @@
+"""
+Backfill message and emoji stats from channel history.
+
+Counts only start when the bot first sees a message, so this pages back
+through each text channel's history over the REST API and counts what it
+finds, using the same extraction as live messages (passed in as `count`).
+Channels are walked concurrently, KITTY_BACKFILL_CHANNELS at a time;
+history is rate limited per channel, so this is what makes it faster, and
+hikari queues each request until its rate limit bucket allows it.
+
+Counts are merged into `counters.Deltas` and written every
+KITTY_BACKFILL_BATCH messages, in the same transaction that moves the
+channel's checkpoint in `backfill_channels` past them. A restarted backfill
+picks up from each channel's checkpoint without counting anything twice.
+
+Only messages sent before `until` are counted, which must be when live
+counting began, so messages the bot already saw are not counted again. It
+is given by the first backfill of a guild and kept with its channels, so
+channels added later, or by a resumed run, share the same boundary.
+Reactions are not backfilled, since history does not say who reacted.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable
+import hikari
+import commons.db as db
+import commons.leaderboard as leaderboard
+import commons.totals as totals
+from commons import counters, metrics, snowflakes
+
+MessageCounter = Callable[[counters.Deltas, int, hikari.Message], bool]
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_BACKFILL_CHANNELS = max(1, _int_env("KITTY_BACKFILL_CHANNELS", 4))
+_BACKFILL_BATCH = max(1, _int_env("KITTY_BACKFILL_BATCH", 1000))
+
+_running: dict[int, asyncio.Task[None]] = {}
+
+
+@dataclass(frozen=True)
+class Progress:
+    channels: int
+    done: int
+    messages: int
+
+    @property
+    def finished(self) -> bool:
+        return self.channels == self.done
+
+
+async def progress(guild: int) -> Progress:
+    channels, done, messages = (
+        await db.query(
+            "SELECT count(*), coalesce(sum(done), 0), coalesce(sum(messages), 0) FROM backfill_channels WHERE guild = ?",
+            (guild,),
+        )
+    )[0]
+    return Progress(channels, done, messages)
+
+
+def running(guild: int) -> bool:
+    return guild in _running
+
+
+def _checkpoint(
+    cursor: db.Cursor,
+    deltas: counters.Deltas,
+    channel: int,
+    oldest: int | None,
+    counted: int,
+    done: bool,
+):
+    deltas.write(cursor)
+    cursor.execute(
+        """
+        UPDATE backfill_channels
+        SET oldest = coalesce(?, oldest), messages = messages + ?, done = ?
+        WHERE channel = ?""",
+        (oldest, counted, done, channel),
+    )
+
+
+async def _commit(
+    deltas: counters.Deltas,
+    channel: int,
+    oldest: int | None,
+    counted: int,
+    done: bool,
+):
+    await db.submit(
+        lambda c: _checkpoint(c, deltas, channel, oldest, counted, done),
+        "backfill.checkpoint",
+        "counters",
+    )
+    # The in-memory boards were loaded before these messages were counted.
+    for (table, guild, user), delta in deltas.user_counts.items():
+        if table == "message_counts":
+            leaderboard.add_message(guild, user, delta)
+            totals.add_message(guild, delta)
+
+
+async def _backfill_channel(
+    rest: hikari.api.RESTClient,
+    guild: int,
+    channel: int,
+    before: int,
+    count: MessageCounter,
+):
+    deltas = counters.Deltas()
+    oldest: int | None = None
+    seen = counted = 0
+    started_at = time.perf_counter()
+    try:
+        async for message in rest.fetch_messages(channel, before=before):
+            oldest = message.id
+            seen += 1
+            if count(deltas, guild, message):
+                counted += 1
+            if seen == _BACKFILL_BATCH:
+                await _commit(deltas, channel, oldest, counted, False)
+                metrics.histogram("backfill.batch").record(
+                    time.perf_counter() - started_at
+                )
+                deltas = counters.Deltas()
+                seen = counted = 0
+                started_at = time.perf_counter()
+    except (hikari.ForbiddenError, hikari.NotFoundError) as e:
+        # Nothing more can be read from here, so don't try again next time.
+        logging.warning(f"Backfill skipping the rest of channel {channel}: {e}")
+    await _commit(deltas, channel, oldest, counted, True)
+
+
+_BOUNDARY = "SELECT until FROM backfill_channels WHERE guild = ? LIMIT 1"
+
+
+async def boundary(guild: int) -> datetime | None:
+    """When live counting began in `guild`, if it has been backfilled before."""
+    rows = await db.query(_BOUNDARY, (guild,))
+    return snowflakes.created_at(rows[0][0]) if rows else None
+
+
+def _add_channels(
+    cursor: db.Cursor, guild: int, channels: Iterable[int], until: datetime | None
+):
+    row = cursor.execute(_BOUNDARY, (guild,)).fetchone()
+    if row is not None:
+        recorded = row[0]
+        if until is not None and snowflakes.first_at(until) != recorded:
+            raise ValueError(
+                f"Guild {guild} is backfilled until {snowflakes.created_at(recorded)}"
+            )
+    elif until is None:
+        raise ValueError(f"The first backfill of guild {guild} needs an until")
+    else:
+        recorded = snowflakes.first_at(until)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO backfill_channels (channel, guild, until) VALUES (?, ?, ?)",
+        [(channel, guild, recorded) for channel in channels],
+    )
+
+
+async def backfill(
+    rest: hikari.api.RESTClient,
+    guild: int,
+    count: MessageCounter,
+    until: datetime | None = None,
+    channels: Iterable[int] | None = None,
+) -> Progress:
+    """
+    Count every message in `guild` sent before `until` that has not been
+    backfilled yet, in all its text channels or just `channels`. `until` is
+    required the first time and may be left out after, when the guild's
+    recorded boundary is used; a different one raises ValueError.
+    """
+    if channels is None:
+        channels = [
+            channel.id
+            for channel in await rest.fetch_guild_channels(guild)
+            if isinstance(channel, hikari.TextableGuildChannel)
+        ]
+    channel_ids = list(channels)
+    await db.submit(
+        lambda c: _add_channels(c, guild, channel_ids, until),
+        "backfill.add",
+        "counters",
+    )
+    pending = await db.query(
+        "SELECT channel, coalesce(oldest, until) FROM backfill_channels WHERE guild = ? AND done = 0",
+        (guild,),
+    )
+    semaphore = asyncio.Semaphore(_BACKFILL_CHANNELS)
+
+    async def run(channel: int, before: int):
+        async with semaphore:
+            await _backfill_channel(rest, guild, channel, before, count)
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(
+        *(run(channel, before) for channel, before in pending),
+        return_exceptions=True,
+    )
+    for (channel, _), e in zip(pending, results):
+        if isinstance(e, BaseException):
+            # It stays pending and is picked up again by the next run.
+            logging.error(f"Backfill of channel {channel} failed", exc_info=e)
+    result = await progress(guild)
+    logging.info(
+        f"Backfilled {len(pending)} channels in guild {guild} in {time.perf_counter() - started_at:.1f}s, {result.messages:,} messages counted in total"
+    )
+    return result
+
+
+def start(
+    rest: hikari.api.RESTClient,
+    guild: int,
+    count: MessageCounter,
+    until: datetime | None = None,
+    channels: Iterable[int] | None = None,
+) -> bool:
+    """Run `backfill` in the background, unless one is already running for `guild`."""
+    if guild in _running:
+        return False
+
+    async def run():
+        try:
+            await backfill(rest, guild, count, until, channels)
+        except Exception as e:
+            logging.exception(f"Backfill of guild {guild} failed", exc_info=e)
+        finally:
+            del _running[guild]
+
+    _running[guild] = asyncio.get_running_loop().create_task(run())
+    return True
+
+
+async def resume(rest: hikari.api.RESTClient, count: MessageCounter):
+    """Carry on every backfill left unfinished when the bot last stopped."""
+    for (guild,) in await db.query(
+        "SELECT DISTINCT guild FROM backfill_channels WHERE done = 0"
+    ):
+        logging.info(f"Resuming the backfill of guild {guild}")
+        # Only the channels already being backfilled. Any created since have
+        # had every message counted live.
+        start(rest, guild, count, channels=())
@@ -0,0 +1,174 @@
+"""
+Online point-in-time snapshots of the database file.
+
+Copying persist.sqlite while the bot is running can tear pages mid-write, so
+snapshots go through SQLite's online backup API instead. The copy is taken
+from a dedicated read-only connection holding one read transaction, which in
+WAL mode pins a single consistent snapshot without blocking the writer, and
+runs KITTY_BACKUP_PAGES pages at a time on a worker thread, sleeping between
+steps so the disk is shared with ingestion. Snapshots land in
+KITTY_BACKUP_DIR every KITTY_BACKUP_HOURS, keeping the newest
+KITTY_BACKUP_KEEP, or on demand through `+backup`.
+
+Subsystems kept in files of their own (see `commons.db.SUBSYSTEMS`) have
+their tables copied into the same snapshot, so a snapshot is always one
+self-contained database that works with none of KITTY_DB_<NAME> set. Each
+file is read from its own snapshot: WAL only keeps a transaction atomic
+within one file, so nothing more consistent than that exists.
+"""
+
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import commons.db as db
+from commons import metrics, scheduler
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_BACKUP_HOURS = _int_env("KITTY_BACKUP_HOURS", 24)
+_BACKUP_KEEP = max(1, _int_env("KITTY_BACKUP_KEEP", 7))
+_BACKUP_PAGES = max(1, _int_env("KITTY_BACKUP_PAGES", 1024))
+_BACKUP_SLEEP_MS = _int_env("KITTY_BACKUP_SLEEP_MS", 10)
+_BACKUP_DIR = os.getenv(
+    "KITTY_BACKUP_DIR", os.path.join(os.path.dirname(db.path()), "backups")
+)
+_STEM = os.path.splitext(os.path.basename(db.path()))[0]
+
+_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    path: str
+    pages: int
+    bytes: int
+    seconds: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+_last: Snapshot | None = None
+
+
+def _merge(target: sqlite3.Connection, attached: dict[str, str]):
+    """Copy every table of the `attached` files into `target`."""
+    for path in attached.values():
+        target.execute("ATTACH DATABASE ? AS source", (f"file:{path}?mode=ro",))
+        try:
+            with target:
+                target.execute("BEGIN")
+                tables = target.execute(
+                    "SELECT name FROM source.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                ).fetchall()
+                for (table,) in tables:
+                    db.copy_table(target.cursor(), table, "source", "main")
+        finally:
+            target.execute("DETACH DATABASE source")
+
+
+def _copy(
+    source_path: str, target_path: str, attached: dict[str, str]
+) -> tuple[int, int]:
+    """Copy the database in steps, returning (pages, page size)."""
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path, uri=True)
+    try:
+        # Backup steps run inside this transaction rather than each taking
+        # their own, so writes committed meanwhile neither show up in the copy
+        # nor force it to start over.
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        step = metrics.histogram("backup.step")
+        stepped_at = time.perf_counter()
+
+        def progress(status: int, remaining: int, total: int):
+            nonlocal stepped_at
+            now = time.perf_counter()
+            step.record(now - stepped_at)
+            stepped_at = now
+
+        source.backup(
+            target,
+            pages=_BACKUP_PAGES,
+            progress=progress,
+            sleep=_BACKUP_SLEEP_MS / 1000,
+        )
+        _merge(target, attached)
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+        page_size = target.execute("PRAGMA page_size").fetchone()[0]
+        # The copy inherits WAL mode; a snapshot is a single self-contained file.
+        target.execute("PRAGMA journal_mode = DELETE")
+        return pages, page_size
+    finally:
+        source.rollback()
+        source.close()
+        target.close()
+
+
+def _prune(directory: str, keep: int):
+    snapshots = sorted(glob.glob(os.path.join(directory, f"{_STEM}-*.sqlite")))
+    for path in snapshots[:-keep]:
+        os.remove(path)
+
+
+async def snapshot(directory: str | None = None, keep: int | None = None) -> Snapshot:
+    """
+    Take a snapshot into `directory` (KITTY_BACKUP_DIR by default) and delete
+    all but the newest `keep` there. Only one snapshot runs at a time.
+    """
+    global _last
+    directory = directory or _BACKUP_DIR
+    async with _lock:
+        os.makedirs(directory, exist_ok=True)
+        name = f"{_STEM}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.sqlite"
+        path = os.path.join(directory, name)
+        partial = path + ".partial"
+        started_at = time.perf_counter()
+        try:
+            pages, page_size = await asyncio.to_thread(
+                _copy, db.path(), partial, db.attached()
+            )
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        elapsed = time.perf_counter() - started_at
+        metrics.histogram("backup.snapshot").record(elapsed)
+        _last = Snapshot(path, pages, pages * page_size, elapsed)
+        await asyncio.to_thread(_prune, directory, keep or _BACKUP_KEEP)
+    logging.info(
+        f"Backed up {_last.bytes / 2**20:.1f}MiB to {path} in {elapsed:.1f}s ({_last.bytes_per_second / 2**20:.1f}MiB/s)"
+    )
+    return _last
+
+
+def last() -> Snapshot | None:
+    """The most recent snapshot taken since startup, if any."""
+    return _last
+
+
+def schedule():
+    """Start taking snapshots every KITTY_BACKUP_HOURS."""
+    if _BACKUP_HOURS > 0:
+
+        async def scheduled_snapshot():
+            await snapshot()
+
+        scheduler.every(_BACKUP_HOURS * 60 * 60, scheduled_snapshot, "backup")
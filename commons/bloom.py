@@ -0,0 +1,47 @@
+"""
+Bloom filter over digests.
+
+Answers "might this digest have been added?" in a fixed number of bits per
+item, where a set of the digests themselves costs around a hundred bytes
+each. A miss is certain; a hit may be a false positive, at roughly the
+`error_rate` the filter was sized for until it holds more than `capacity`
+items, so callers confirm hits against the real data.
+
+Items must already be uniformly distributed, like an md5 digest: the bit
+positions are taken straight from the first 16 bytes rather than hashed
+again.
+"""
+
+import math
+from typing import Iterator
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        bits = -max(capacity, 1) * math.log(error_rate) / math.log(2) ** 2
+        self._bits = bytearray(max(1, math.ceil(bits / 8)))
+        self._size = len(self._bits) * 8
+        self._hashes = max(1, round(self._size / max(capacity, 1) * math.log(2)))
+
+    def _positions(self, digest: bytes) -> Iterator[int]:
+        # Double hashing: the k positions are h1 + i * h2 for i < k.
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def discard(self, digest: bytes):
+        """
+        Does nothing: its bits may be shared with other digests. A discarded
+        digest stays a (false) positive.
+        """
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(digest)
+        )
@@ -0,0 +1,319 @@
+"""
+Write-behind aggregation for the per-user counter tables.
+
+Handlers record deltas here instead of upserting one row per event. Deltas for
+the same (guild, user) or (guild, user, emoji) key are merged in memory and written in a
+single transaction every KITTY_COUNTER_FLUSH_MS milliseconds, or sooner once
+KITTY_COUNTER_FLUSH_EVENTS events have been recorded, so write I/O scales with
+the flush rate rather than the event rate. The hourly and daily rollups in
+`commons.rollups` are written in the same transaction.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Literal
+
+import commons.db as db
+from commons import rollups
+from datetime import datetime
+
+UserCountTable = Literal["message_counts", "message_deletes", "shit_meme_deletes"]
+_RollupCounts = dict[tuple[rollups.Rollup, int, tuple[int | str, ...]], int]
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_FLUSH_MS = _int_env("KITTY_COUNTER_FLUSH_MS", 1000)
+_FLUSH_EVENTS = _int_env("KITTY_COUNTER_FLUSH_EVENTS", 200)
+
+
+class Deltas:
+    """
+    Counter and rollup deltas merged by key, so any number of events is
+    written as one upsert per distinct row.
+    """
+
+    def __init__(self):
+        self.user_counts: dict[tuple[UserCountTable, int, int], int] = {}
+        self.emoji_counts: dict[tuple[int, int, str], int] = {}
+        self.rollups: _RollupCounts = {}
+        self.events = 0
+
+    def add_user_count(
+        self, table: UserCountTable, guild: int, user: int, delta: int = 1
+    ):
+        key = (table, guild, user)
+        self.user_counts[key] = self.user_counts.get(key, 0) + delta
+        self.events += 1
+
+    def add_emoji_count(self, guild: int, user: int, emoji: str, delta: int = 1):
+        key = (guild, user, emoji)
+        self.emoji_counts[key] = self.emoji_counts.get(key, 0) + delta
+        self.events += 1
+
+    def add_rollup(
+        self,
+        rollup: rollups.Rollup,
+        at: datetime,
+        key: tuple[int | str, ...],
+        delta: int = 1,
+    ):
+        bucket_key = (rollup, rollup.bucket(at), key)
+        self.rollups[bucket_key] = self.rollups.get(bucket_key, 0) + delta
+        self.events += 1
+
+    def add_message(self, guild: int, user: int, channel: int, at: datetime):
+        self.add_user_count("message_counts", guild, user)
+        for rollup in (rollups.MESSAGES_HOURLY, rollups.MESSAGES_DAILY):
+            self.add_rollup(rollup, at, (guild, user, channel))
+
+    def add_emoji(
+        self,
+        guild: int,
+        user: int,
+        emoji: str,
+        channel: int,
+        at: datetime,
+        delta: int = 1,
+    ):
+        self.add_emoji_count(guild, user, emoji, delta)
+        for rollup in (rollups.EMOJI_HOURLY, rollups.EMOJI_DAILY):
+            self.add_rollup(rollup, at, (guild, user, channel, emoji), delta)
+
+    def merge(self, other: "Deltas"):
+        for key, delta in other.user_counts.items():
+            self.user_counts[key] = self.user_counts.get(key, 0) + delta
+        for key, delta in other.emoji_counts.items():
+            self.emoji_counts[key] = self.emoji_counts.get(key, 0) + delta
+        for key, delta in other.rollups.items():
+            self.rollups[key] = self.rollups.get(key, 0) + delta
+        self.events += other.events
+
+    def write(self, cursor: db.Cursor):
+        """
+        Add every delta to its row, within the caller's transaction. Only
+        positive deltas create rows; taking back a count that was never
+        recorded, such as a reaction added before tracking began, leaves
+        nothing behind.
+        """
+        by_table: dict[UserCountTable, list[tuple[int, int, int]]] = {}
+        for (table, guild, user), delta in self.user_counts.items():
+            if delta:
+                by_table.setdefault(table, []).append((guild, user, delta))
+        for table, rows in by_table.items():
+            cursor.executemany(
+                f"""
+                INSERT INTO {table} (guild, user, count)
+                VALUES (?, ?, ?)
+                ON CONFLICT (guild, user) DO UPDATE
+                SET count = {table}.count + excluded.count""",
+                [row for row in rows if row[2] > 0],
+            )
+            cursor.executemany(
+                f"""
+                UPDATE {table} SET count = max(count + ?, 0)
+                WHERE guild = ? AND user = ?""",
+                [(delta, guild, user) for guild, user, delta in rows if delta < 0],
+            )
+        emoji_rows = [
+            (guild, user, emoji, delta)
+            for (guild, user, emoji), delta in self.emoji_counts.items()
+            if delta
+        ]
+        cursor.executemany(
+            """
+            INSERT INTO emoji_counts (guild, user, emoji, count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (guild, user, emoji) DO UPDATE
+            SET count = emoji_counts.count + excluded.count""",
+            [row for row in emoji_rows if row[3] > 0],
+        )
+        cursor.executemany(
+            """
+            UPDATE emoji_counts SET count = max(count + ?, 0)
+            WHERE guild = ? AND user = ? AND emoji = ?""",
+            [
+                (delta, guild, user, emoji)
+                for guild, user, emoji, delta in emoji_rows
+                if delta < 0
+            ],
+        )
+        by_rollup: dict[
+            rollups.Rollup, list[tuple[int, tuple[int | str, ...], int]]
+        ] = {}
+        for (rollup, bucket, key), delta in self.rollups.items():
+            if delta:
+                by_rollup.setdefault(rollup, []).append((bucket, key, delta))
+        for rollup, rows in by_rollup.items():
+            cursor.executemany(
+                rollup.upsert,
+                [(bucket, *key, delta) for bucket, key, delta in rows if delta > 0],
+            )
+            cursor.executemany(
+                rollup.subtract,
+                [(delta, bucket, *key) for bucket, key, delta in rows if delta < 0],
+            )
+
+
+class CounterAggregator:
+    def __init__(self, flush_seconds: float, flush_events: int):
+        self._flush_seconds = flush_seconds
+        self._flush_events = flush_events
+        self._deltas = Deltas()
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_queued = False
+        self._batch_done: asyncio.Future[None] | None = None
+        self._inflight: asyncio.Future[None] | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._lock = asyncio.Lock()
+
+    def add_user_count(
+        self, table: UserCountTable, guild: int, user: int, delta: int = 1
+    ):
+        self._deltas.add_user_count(table, guild, user, delta)
+        self._recorded()
+
+    def add_emoji_count(self, guild: int, user: int, emoji: str, delta: int = 1):
+        self._deltas.add_emoji_count(guild, user, emoji, delta)
+        self._recorded()
+
+    def add_rollup(
+        self,
+        rollup: rollups.Rollup,
+        at: datetime,
+        key: tuple[int | str, ...],
+        delta: int = 1,
+    ):
+        self._deltas.add_rollup(rollup, at, key, delta)
+        self._recorded()
+
+    def add_message(self, guild: int, user: int, channel: int, at: datetime):
+        self._deltas.add_message(guild, user, channel, at)
+        self._recorded()
+
+    def add_emoji(
+        self,
+        guild: int,
+        user: int,
+        emoji: str,
+        channel: int,
+        at: datetime,
+        delta: int = 1,
+    ):
+        self._deltas.add_emoji(guild, user, emoji, channel, at, delta)
+        self._recorded()
+
+    def pending(self) -> int:
+        """Number of events recorded since the last flush started."""
+        return self._deltas.events
+
+    async def flushed(self):
+        """Wait until everything recorded so far has been committed."""
+        if self._deltas.events:
+            if self._batch_done is None:
+                self._batch_done = asyncio.get_running_loop().create_future()
+            done = self._batch_done
+        elif self._inflight is not None:
+            done = self._inflight
+        else:
+            return
+        await asyncio.shield(done)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            self._flush_queued = False
+            deltas, self._deltas = self._deltas, Deltas()
+            batch_done, self._batch_done = self._batch_done, None
+            if not deltas.events:
+                return
+            if batch_done is None:
+                batch_done = asyncio.get_running_loop().create_future()
+            self._inflight = batch_done
+            try:
+                await db.submit(deltas.write, "counters.flush", "counters")
+            except Exception as e:
+                logging.exception("Failed to flush counters, will retry", exc_info=e)
+                self._merge_back(deltas, batch_done)
+                return
+            finally:
+                self._inflight = None
+            batch_done.set_result(None)
+
+    def _merge_back(self, deltas: Deltas, batch_done: asyncio.Future[None]):
+        self._deltas.merge(deltas)
+        if self._batch_done is None:
+            self._batch_done = batch_done
+        else:
+            # Anyone waiting on the failed batch is now waiting on the next one.
+            self._batch_done.add_done_callback(lambda _: batch_done.set_result(None))
+        self._schedule()
+
+    def _recorded(self):
+        if self._deltas.events >= self._flush_events:
+            if not self._flush_queued:
+                self._flush_queued = True
+                self._spawn(self.flush())
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self._flush_seconds, lambda: self._spawn(self.flush())
+            )
+
+    def _spawn(self, coro: Awaitable[None]):
+        async def run():
+            try:
+                await coro
+            except Exception as e:
+                logging.exception("An exception occurred", exc_info=e)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+_aggregator = CounterAggregator(_FLUSH_MS / 1000, _FLUSH_EVENTS)
+
+
+def add_message(guild: int, user: int, channel: int, at: datetime):
+    _aggregator.add_message(guild, user, channel, at)
+
+
+def add_delete(guild: int, user: int):
+    _aggregator.add_user_count("message_deletes", guild, user)
+
+
+def add_shit_meme_delete(guild: int, user: int):
+    _aggregator.add_user_count("shit_meme_deletes", guild, user)
+
+
+def add_emoji(
+    guild: int, user: int, emoji: str, channel: int, at: datetime, delta: int = 1
+):
+    """
+    Count `delta` uses of `emoji` by `user` in `guild`. `at` is when the
+    message it was used in or reacted to was sent.
+    """
+    _aggregator.add_emoji(guild, user, emoji, channel, at, delta)
+
+
+async def flushed():
+    await _aggregator.flushed()
+
+
+async def flush():
+    await _aggregator.flush()
@@ -1,75 +1,264 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import logging
+import queue
 import sqlite3
 import os
-from typing import Callable, overload, Any, Optional
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import (
+    AsyncGenerator,
+    Callable,
+    Generic,
+    Iterable,
+    Self,
+    TypeVar,
+    overload,
+    Any,
+    Optional,
+)
+from commons import metrics, migrations
 
 # Reexport type for convenience of module users
 Cursor = sqlite3.Cursor
 
+_T = TypeVar("_T")
+_Parameters = tuple[Any, ...] | dict[str, Any]
 
-def cursor():
-    return conn.cursor()
 
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
 
-def commit():
-    conn.commit()
 
+_SYNCHRONOUS = os.getenv("KITTY_DB_SYNCHRONOUS", "NORMAL")
+_MMAP_SIZE = _int_env("KITTY_DB_MMAP_SIZE", 256 * 1024 * 1024)
+_CACHE_KIB = _int_env("KITTY_DB_CACHE_KIB", 64 * 1024)
+_BUSY_TIMEOUT_MS = _int_env("KITTY_DB_BUSY_TIMEOUT_MS", 5000)
+_READERS = max(1, _int_env("KITTY_DB_READERS", 4))
+_SLOW_QUERY_MS = _int_env("KITTY_SLOW_QUERY_MS", 250)
 
-def start():
-    c = cursor()
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS emoji_counts (user TEXT, emoji TEXT, count INTEGER)"
-    )
-    c.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS emoji_counts_idx ON emoji_counts (user, emoji)"
-    )
-    c.execute("CREATE TABLE IF NOT EXISTS message_counts (user TEXT, count INTEGER)")
-    c.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS message_counts_idx ON message_counts (user)"
-    )
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS message_hashes (user TEXT, message_id TEXT, message_hash TEXT, time_sent TEXT)"
-    )
-    c.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS message_hashes_idx ON message_hashes (message_hash)"
-    )
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS image_hashes (hash TEXT, message_id TEXT, channel_id TEXT, guild_id TEXT)"
-    )
-    c.execute("CREATE TABLE IF NOT EXISTS message_deletes (user TEXT, count INTEGER)")
-    c.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS message_deletes_idx ON message_deletes (user)"
-    )
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS meme_stats (user TEXT, message_id TEXT, meme_score INTEGER, time_sent TEXT)"
+# Tables each subsystem moves into its own file when KITTY_DB_<NAME> is set,
+# so that its writes take a different lock, on their own writer thread, from
+# everything else. Tables written together stay together: a trigger only
+# reaches tables in its own file, and in WAL mode a transaction is only
+# atomic within one file.
+SUBSYSTEMS: dict[str, tuple[str, ...]] = {
+    "counters": (
+        "message_counts",
+        "emoji_counts",
+        "emoji_count_histogram",
+        "emoji_totals",
+        "message_deletes",
+        "shit_meme_deletes",
+        "message_rollup_hourly",
+        "message_rollup_daily",
+        "emoji_rollup_hourly",
+        "emoji_rollup_daily",
+        "backfill_channels",
+    ),
+    "hashes": ("message_hashes", "image_hashes"),
+    "memes": ("meme_stats", "meme_score_rollup_hourly"),
+}
+
+
+@dataclass(frozen=True)
+class Statement:
+    label: str
+    sql: str
+    scan_ok: bool
+
+
+def statement(label: str, sql: str, scan_ok: bool = False) -> str:
+    """
+    Register a hot-path statement under `label` and return its SQL unchanged.
+    Executions of registered statements are timed under their label, and
+    tests/test_query_plans.py checks that each one is answered from an index.
+    Set `scan_ok` for statements that are expected to read the whole table.
+    """
+    _statements[sql] = Statement(label, sql, scan_ok)
+    return sql
+
+
+def statements() -> list[Statement]:
+    return list(_statements.values())
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """
+    Times every statement under its registered label, or its first keyword
+    if it was never registered, and logs those slower than
+    KITTY_SLOW_QUERY_MS. For queries this covers the work up to the first
+    row, which is where aggregates and sorts spend their time.
+    """
+
+    def execute(self, sql: str, parameters: Any = (), /) -> Self:
+        started_at = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_statement(sql, time.perf_counter() - started_at)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /) -> Self:
+        started_at = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_statement(sql, time.perf_counter() - started_at)
+
+
+def _record_statement(sql: str, elapsed: float):
+    registered = _statements.get(sql)
+    label = registered.label if registered else sql.split(maxsplit=1)[0].lower()
+    metrics.histogram(f"db.statement.{label}").record(elapsed)
+    if _SLOW_QUERY_MS and elapsed * 1000 >= _SLOW_QUERY_MS:
+        logging.warning(
+            "Slow query %s took %.0fms: %s",
+            label,
+            elapsed * 1000,
+            " ".join(sql.split())[:500],
+        )
+
+
+def _attach(connection: sqlite3.Connection, read_only: bool = False):
+    for name, path in _attached.items():
+        target = f"file:{path}?mode=ro" if read_only else path
+        connection.execute(f"ATTACH DATABASE ? AS {name}", (target,))
+
+
+def _configure(connection: sqlite3.Connection):
+    """
+    Per-connection tuning, for the main file and each attached one.
+    journal_mode is persistent in the file itself and only needs setting
+    once, which happens on the main connection at startup.
+    """
+    connection.execute(f"PRAGMA busy_timeout = {_BUSY_TIMEOUT_MS}")
+    for schema in ("main", *_attached):
+        synchronous, cache_kib = _tuning(schema)
+        connection.execute(f"PRAGMA {schema}.synchronous = {synchronous}")
+        connection.execute(f"PRAGMA {schema}.mmap_size = {_MMAP_SIZE}")
+        connection.execute(f"PRAGMA {schema}.cache_size = -{cache_kib}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    for name, (nargs, fn) in list(_functions.items()):
+        connection.create_function(name, nargs, fn)
+
+
+def _tuning(schema: str) -> tuple[str, int]:
+    """synchronous and cache size for `schema`, overridable per subsystem."""
+    if schema == "main":
+        return _SYNCHRONOUS, _CACHE_KIB
+    prefix = f"KITTY_DB_{schema.upper()}"
+    return (
+        os.getenv(f"{prefix}_SYNCHRONOUS", _SYNCHRONOUS),
+        _int_env(f"{prefix}_CACHE_KIB", _CACHE_KIB),
     )
-    c.execute("CREATE TABLE IF NOT EXISTS shit_meme_deletes (user TEXT, count INTEGER)")
-    c.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS shit_meme_deletes_idx ON shit_meme_deletes (user)"
+
+
+def _has_table(connection: sqlite3.Connection, schema: str, table: str) -> bool:
+    return (
+        connection.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        ).fetchone()
+        is not None
     )
 
-    try:
-        c.execute("ALTER TABLE image_hashes ADD hash_color TEXT NOT NULL")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE meme_stats ADD meme_rating INTEGER")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE meme_stats ADD rating_count INTEGER")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE meme_stats ADD meme_reasoning TEXT")
-    except Exception:
-        pass
-
-    # EmojiCache Table Removed
-    c.execute("CREATE TABLE IF NOT EXISTS options (name TEXT, value TEXT)")
-    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS options_idx ON options (name)")
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS scheduled_actions (time INTEGER, action TEXT, arguments TEXT)"
+
+def copy_table(cursor: Cursor, table: str, source: str, target: str):
+    """
+    Create `table` in the `target` schema with the same definition, indexes
+    and triggers it has in `source`, and copy its rows across, keeping their
+    rowids. Triggers are created after the copy so that it does not fire them.
+    """
+    objects: list[tuple[str, str]] = cursor.execute(
+        f"SELECT type, sql FROM {source}.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+    definition = next(sql for kind, sql in objects if kind == "table")
+    cursor.execute(migrations.in_schema(definition, target))
+    columns = cursor.execute(f"PRAGMA {source}.table_info({table})").fetchall()
+    names = ", ".join(row[1] for row in columns)
+    keys = [row for row in columns if row[5]]
+    # An INTEGER PRIMARY KEY already is the rowid, and WITHOUT ROWID
+    # tables have none.
+    if "WITHOUT ROWID" in definition.upper() or (
+        len(keys) == 1 and keys[0][2].upper() == "INTEGER"
+    ):
+        rowid = ""
+    else:
+        rowid = "rowid, "
+    cursor.execute(
+        f"INSERT INTO {target}.{table} ({rowid}{names}) SELECT {rowid}{names} FROM {source}.{table}"
     )
+    for kind in ("index", "trigger"):
+        for sql in (sql for k, sql in objects if k == kind):
+            cursor.execute(migrations.in_schema(sql, target))
+
+
+def _relocate(connection: sqlite3.Connection, attached: dict[str, str]):
+    """
+    Move each `attached` subsystem's tables out of the main file and into its
+    own. Migrations create and rebuild a subsystem's tables in its file once
+    it is attached, so this runs before them on every startup, moving what an
+    earlier run left in main, including a rebuild's half-copied new table.
+    Rows are copied and committed before the originals are dropped, so a
+    crash in between leaves both; the main file's copy is then the one kept
+    and it is moved again.
+    """
+    for schema, file in attached.items():
+        tables = [t for name in SUBSYSTEMS[schema] for t in (name, f"{name}__new")]
+        for table in tables:
+            if not _has_table(connection, "main", table):
+                continue
+            started_at = time.perf_counter()
+            with connection:
+                connection.execute("BEGIN")
+                if _has_table(connection, schema, table):
+                    connection.execute(f"DROP TABLE {schema}.{table}")
+                copy_table(connection.cursor(), table, "main", schema)
+            with connection:
+                connection.execute(f"DROP TABLE main.{table}")
+            logging.info(
+                f"Moved {table} into {file} in {time.perf_counter() - started_at:.1f}s"
+            )
+
+
+def path() -> str:
+    return _path
+
+
+def attached() -> dict[str, str]:
+    """The file of each subsystem kept out of the main one, by schema name."""
+    return dict(_attached)
+
+
+def database(table: str) -> str:
+    """The schema `table` lives in: its subsystem's if that is attached, else main."""
+    for schema in _attached:
+        if table in SUBSYSTEMS[schema]:
+            return schema
+    return "main"
+
+
+def cursor() -> Cursor:
+    return conn.cursor(_TimedCursor)
+
+
+def commit():
+    conn.commit()
+
+
+def start():
+    _relocate(conn, _attached)
+    migrations.migrate(conn, migrations.MIGRATIONS, database)
 
 
 @overload
@@ -89,18 +278,311 @@ def get_option(name: str, default: Optional[str] = None) -> Optional[str]:
     return res[0]
 
 
-def set_option(name: str, value: str):
-    cursor().execute(
+async def set_option(name: str, value: str):
+    await execute(
         "insert into options values(?, ?) on conflict(name) do update set value=excluded.value",
         (name, value),
+        label="options.set",
     )
-    commit()
 
 
 def create_function(name: str, nargs: int, fn: Callable[..., Any]):
+    """
+    Register a Python function for use in SQL on every connection, including
+    the writer's and the read pool's.
+    """
+    _functions[name] = (nargs, fn)
     conn.create_function(name, nargs, fn)
+    # Pooled readers pick new functions up on their next checkout.
+    for writer in _writers.values():
+        writer.submit(
+            "create_function",
+            lambda c: c.connection.create_function(name, nargs, fn),
+        )
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int
+    queue_wait: metrics.Histogram
+    jobs: dict[str, metrics.Histogram]
+
+
+@dataclass
+class _Job(Generic[_T]):
+    label: str
+    fn: Callable[[Cursor], _T]
+    future: "concurrent.futures.Future[_T]" = field(
+        default_factory=lambda: concurrent.futures.Future()
+    )
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class _Writer:
+    """
+    Owns the only connection that writes to one database file. Jobs are run
+    one at a time on a dedicated thread, each in its own transaction, so that
+    commits (and the fsyncs behind them) never happen on the event loop.
+    """
+
+    def __init__(self, path: str, name: str = "main"):
+        self._path = path
+        self._queue: "queue.Queue[_Job[Any] | None]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"kitty-db-writer-{name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, label: str, fn: Callable[[Cursor], _T]
+    ) -> "concurrent.futures.Future[_T]":
+        job = _Job(label, fn)
+        self._queue.put(job)
+        return job.future
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        writer_conn = sqlite3.connect(self._path)
+        _attach(writer_conn)
+        _configure(writer_conn)
+        while (job := self._queue.get()) is not None:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            started_at = time.perf_counter()
+            try:
+                result = job.fn(writer_conn.cursor(_TimedCursor))
+                writer_conn.commit()
+            except BaseException as e:
+                writer_conn.rollback()
+                self._record(job, started_at)
+                job.future.set_exception(e)
+            else:
+                self._record(job, started_at)
+                job.future.set_result(result)
+        writer_conn.close()
+
+    def _record(self, job: _Job[Any], started_at: float):
+        finished_at = time.perf_counter()
+        elapsed = finished_at - started_at
+        metrics.histogram("db.writer_queue_wait").record(started_at - job.enqueued_at)
+        metrics.histogram(f"db.writer_job.{job.label}").record(elapsed)
+        logging.debug(
+            "db writer: %s took %.2fms after %.2fms in queue (depth %d)",
+            job.label,
+            elapsed * 1000,
+            (started_at - job.enqueued_at) * 1000,
+            self._queue.qsize(),
+        )
+
+
+class _ReadPool:
+    """
+    A fixed set of read-only connections, each used by one executor thread at
+    a time. In WAL mode readers see the last committed snapshot and neither
+    block nor are blocked by the writer, so long aggregations never hold up
+    message ingestion.
+    """
+
+    def __init__(self, path: str, size: int):
+        self._path = path
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="kitty-db-reader"
+        )
+
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle.empty() and self._created < self._size:
+                self._created += 1
+                return self._connect()
+        connection = self._idle.get()
+        for name, (nargs, fn) in list(_functions.items()):
+            connection.create_function(name, nargs, fn)
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            f"file:{self._path}?mode=ro", uri=True, check_same_thread=False
+        )
+        _attach(connection, read_only=True)
+        _configure(connection)
+        connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def _run(self, fn: Callable[[Cursor], _T]) -> _T:
+        connection = self._checkout()
+        try:
+            return fn(connection.cursor(_TimedCursor))
+        finally:
+            connection.rollback()
+            self._idle.put(connection)
+
+    def submit(self, fn: Callable[[Cursor], _T]) -> "concurrent.futures.Future[_T]":
+        return self._executor.submit(self._run, fn)
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+async def read(fn: Callable[[Cursor], _T]) -> _T:
+    """
+    Run `fn` with a cursor from the read-only pool, off the event loop. Use
+    this for anything heavier than a primary key lookup.
+    """
+    return await asyncio.wrap_future(_readers.submit(fn))
+
+
+async def query(sql: str, parameters: _Parameters = ()) -> list[Any]:
+    """Run a single read-only query on the pool and return all rows."""
+    return await read(lambda c: c.execute(sql, parameters).fetchall())
+
+
+def _writer(database: str) -> _Writer:
+    return _writers.get(database, _writers["main"])
+
+
+async def submit(fn: Callable[[Cursor], _T], label: str, database: str = "main") -> _T:
+    """
+    Run `fn` with a cursor on the writer thread inside a single transaction,
+    which is committed if `fn` returns and rolled back if it raises. The
+    exception, if any, is re-raised here. Jobs that write to a subsystem's
+    tables name it as their `database`, so that they run on its writer when
+    it has a file of its own.
+    """
+    return await asyncio.wrap_future(_writer(database).submit(label, fn))
+
+
+async def execute(
+    sql: str,
+    parameters: _Parameters = (),
+    label: Optional[str] = None,
+    database: str = "main",
+) -> list[Any]:
+    """
+    Execute a single statement on the writer thread and return any rows it
+    produced.
+    """
+    return await submit(
+        lambda c: c.execute(sql, parameters).fetchall(),
+        label or sql.split()[0],
+        database,
+    )
+
+
+class _UnitOfWork:
+    def __init__(self):
+        self.writes: dict[str, list[tuple[str, Callable[[Cursor], Any]]]] = {}
+        self.open = True
+
+
+_unit_of_work: contextvars.ContextVar[_UnitOfWork | None] = contextvars.ContextVar(
+    "unit_of_work", default=None
+)
+
+
+def _run_deferred(cursor: Cursor, writes: list[tuple[str, Callable[[Cursor], Any]]]):
+    if not cursor.connection.in_transaction:
+        # Otherwise the first RELEASE below would commit on its own.
+        cursor.execute("BEGIN")
+    for label, fn in writes:
+        started_at = time.perf_counter()
+        cursor.execute("SAVEPOINT deferred")
+        try:
+            fn(cursor)
+        except Exception as e:
+            # One failed write must not cost the others in the unit theirs.
+            cursor.execute("ROLLBACK TO deferred")
+            logging.exception(f"Deferred write {label} failed", exc_info=e)
+        cursor.execute("RELEASE deferred")
+        metrics.histogram(f"db.deferred.{label}").record(
+            time.perf_counter() - started_at
+        )
+
+
+@contextlib.asynccontextmanager
+async def unit_of_work(label: str) -> AsyncGenerator[None, None]:
+    """
+    Collect the writes `defer`red inside the block, by this task or any task
+    started within it, and commit them in one writer transaction as the block
+    exits, whether or not it raised. The block only exits once they are
+    committed, so durability is the same as awaiting each write in turn, for
+    one commit per database written rather than one per write.
+    """
+    unit = _UnitOfWork()
+    token = _unit_of_work.set(unit)
+    try:
+        yield
+    finally:
+        _unit_of_work.reset(token)
+        unit.open = False
+
+        def commit(writes: list[tuple[str, Callable[[Cursor], Any]]], database: str):
+            return submit(lambda c: _run_deferred(c, writes), label, database)
+
+        await asyncio.gather(
+            *(commit(writes, database) for database, writes in unit.writes.items())
+        )
+
+
+async def defer(fn: Callable[[Cursor], Any], label: str, database: str = "main"):
+    """
+    Run `fn` on the writer as part of the current unit of work, or straight
+    away as its own transaction when there is none. Deferred writes give no
+    result back; anything that needs one, or must fail loudly, uses `submit`.
+    """
+    unit = _unit_of_work.get()
+    if unit is None or not unit.open:
+        await submit(fn, label, database)
+    else:
+        key = database if database in _writers else "main"
+        unit.writes.setdefault(key, []).append((label, fn))
+
+
+def writer_stats() -> WriterStats:
+    return WriterStats(
+        queue_depth=sum(writer.queue_depth() for writer in _writers.values()),
+        queue_wait=metrics.histogram("db.writer_queue_wait").snapshot(),
+        jobs=metrics.histograms("db.writer_job."),
+    )
+
+
+def statement_stats() -> dict[str, metrics.Histogram]:
+    """Latency of individual statements on any connection, by label."""
+    return metrics.histograms("db.statement.")
+
+
+async def close():
+    """Wait for queued writes to finish and stop the writer and readers."""
+    for writer in _writers.values():
+        await asyncio.to_thread(writer.stop)
+    await asyncio.to_thread(_readers.close)
 
 
 sqlite3.enable_callback_tracebacks(True)
-conn = sqlite3.connect(os.environ.get("KITTY_DB", "persist.sqlite"))
+_path = os.environ.get("KITTY_DB", "persist.sqlite")
+_functions: dict[str, tuple[int, Callable[..., Any]]] = {}
+_statements: dict[str, Statement] = {}
+_attached = {
+    name: os.environ[f"KITTY_DB_{name.upper()}"]
+    for name in SUBSYSTEMS
+    if os.getenv(f"KITTY_DB_{name.upper()}")
+}
+conn = sqlite3.connect(_path)
+_attach(conn)
+for _schema in ("main", *_attached):
+    conn.execute(f"PRAGMA {_schema}.journal_mode = WAL")
+_configure(conn)
 start()
+_writers = {name: _Writer(_path, name) for name in ("main", *_attached)}
+_readers = _ReadPool(_path, _READERS)
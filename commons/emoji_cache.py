@@ -9,10 +9,13 @@ from hikari import CustomEmoji, NotFoundError
 import requests
 
 
-async def get_file_name(emoji: str, bot: lightbulb.BotApp) -> str | None:
+async def get_file_name(
+    emoji: str, bot: lightbulb.BotApp, guild_id: hikari.Snowflakeish | None = None
+) -> str | None:
     """
     Return a path to the image file for the specified custom emoji. Returns None
-    if emoji does not exist or is not a custom emoji.
+    if emoji does not exist or is not a custom emoji. `guild_id` is where the
+    emoji was used, which is where it is looked for if it is not cached.
     """
     try:
         emoji_id = CustomEmoji.parse(emoji).id
@@ -23,7 +26,7 @@ async def get_file_name(emoji: str, bot: lightbulb.BotApp) -> str | None:
     if cache_result:
         return cache_result
 
-    await _download_emoji(emoji_id, bot)
+    await _download_emoji(emoji_id, bot, guild_id)
     cache_result = _get_cached_file_name(emoji_id)
     if cache_result:
         return cache_result
@@ -40,13 +43,20 @@ def _get_cached_file_name(emoji_id: hikari.Snowflake) -> str | None:
             return tp
 
 
-async def _download_emoji(emoji_id: hikari.Snowflake, bot: lightbulb.BotApp):
-    try:
-        info = await bot.rest.fetch_emoji(
-            int(os.environ["DEFAULT_GUILDS"].split(",")[0]), emoji_id
-        )
-    except NotFoundError:  # Emoji no longer available. Ignore
-        return
+async def _download_emoji(
+    emoji_id: hikari.Snowflake,
+    bot: lightbulb.BotApp,
+    guild_id: hikari.Snowflakeish | None,
+):
+    # Any guild the bot is in knows its own emoji, so check the cache first.
+    info = bot.cache.get_emoji(emoji_id)
+    if info is None:
+        if guild_id is None:
+            guild_id = int(os.environ["DEFAULT_GUILDS"].split(",")[0])
+        try:
+            info = await bot.rest.fetch_emoji(guild_id, emoji_id)
+        except NotFoundError:  # Emoji no longer available. Ignore
+            return
 
     print("Downloading New Emoji", info, info.url)
     r = requests.get(info.url)
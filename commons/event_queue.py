@@ -0,0 +1,219 @@
+"""
+Bounded, per-channel ordered processing of gateway events.
+
+Every event is queued under its channel and run by a fixed pool of workers.
+Events in one channel run one at a time, in the order they arrived, while
+different channels run side by side; a channel goes to the back of the line
+after each event, so a busy channel cannot starve the quiet ones.
+
+At most `capacity` events are queued or running at once. Past that, `submit`
+waits for a slot, holding up the listener that is handling the event, unless
+the event is droppable, which is then dropped. hikari goes on reading the
+gateway meanwhile and calls each listener in a task of its own, so a long
+burst still grows the number of waiting listeners; the queue bounds the work
+in flight, not what Discord sends. Once `shed_at` events are waiting, events
+are run in shed mode, which the runner uses to skip work that can be lost,
+so the queue drains faster. Critical events, whose loss would leave state
+wrong for good, are never dropped nor run in shed mode, and always wait.
+
+`close` stops taking new events, other than critical ones, and lets those
+already queued finish for a while before stopping the workers.
+"""
+
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Coroutine
+from commons import metrics
+
+# Runs one event, shedding what it can when passed True.
+Runner = Callable[[bool], Coroutine[None, None, None]]
+
+
+@dataclass
+class _Item:
+    run: Runner
+    queued_at: float
+    critical: bool
+
+
+@dataclass
+class QueueStats:
+    queue_depth: int
+    running: int
+    channels: int
+    processed: int
+    shed: int
+    dropped: int
+    queue_wait: metrics.Histogram
+    run: metrics.Histogram
+
+
+class EventQueue:
+    def __init__(self, name: str, workers: int, capacity: int, shed_at: int):
+        self._name = name
+        self._workers = workers
+        self._capacity = capacity
+        self._shed_at = shed_at
+        self._pending: dict[int, deque[_Item]] = {}
+        self._ready: asyncio.Queue[int] | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._progress: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task[None]] = []
+        self._depth = 0
+        self._running = 0
+        self._waiting = 0
+        self._closing = False
+        self._closed = False
+        self.processed = 0
+        self.shed = 0
+        self.dropped = 0
+
+    def _start(self):
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self._capacity)
+        self._progress = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Workers start on the first submit, and would otherwise keep a copy
+        # of its context, such as its unit of work, for every event they run.
+        self._tasks = [
+            loop.create_task(
+                self._work(),
+                name=f"{self._name}.worker{i}",
+                context=contextvars.Context(),
+            )
+            for i in range(self._workers)
+        ]
+
+    async def submit(
+        self,
+        channel: int,
+        run: Runner,
+        droppable: bool = False,
+        critical: bool = False,
+    ) -> bool:
+        """
+        Queue `run` behind every event already queued for `channel`, waiting
+        for a slot if the queue is full. Returns False if the queue was full
+        and the event droppable, or the queue is closing, so it was not
+        queued. A critical event is never dropped and always runs in full,
+        without shedding, unless it comes after the queue has closed.
+        """
+        if self._closed or (self._closing and not critical):
+            self.dropped += 1
+            if critical:
+                logging.warning(f"{self._name} queue closed, dropped a critical event")
+            return False
+        if self._slots is None:
+            self._start()
+        assert self._ready is not None and self._slots is not None
+        if droppable and not critical and self._slots.locked():
+            self.dropped += 1
+            return False
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        if self._closed:
+            # Woken by close, which has stopped the workers.
+            self.dropped += 1
+            return False
+        item = _Item(run, asyncio.get_running_loop().time(), critical)
+        self._depth += 1
+        queue = self._pending.get(channel)
+        if queue is None:
+            self._pending[channel] = deque([item])
+            self._ready.put_nowait(channel)
+        else:
+            # The channel is already waiting or running, and its worker puts
+            # it back in line when done.
+            queue.append(item)
+        return True
+
+    async def _work(self):
+        assert self._ready is not None and self._slots is not None
+        assert self._progress is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            channel = await self._ready.get()
+            queue = self._pending[channel]
+            item = queue.popleft()
+            self._depth -= 1
+            self._running += 1
+            started_at = loop.time()
+            metrics.histogram(f"{self._name}.queue_wait").record(
+                started_at - item.queued_at
+            )
+            shed = not item.critical and self._depth >= self._shed_at
+            if shed:
+                self.shed += 1
+            try:
+                await item.run(shed)
+            except Exception as e:
+                logging.exception(f"An exception occurred", exc_info=e)
+            finally:
+                self._running -= 1
+                self.processed += 1
+                self._slots.release()
+                metrics.histogram(f"{self._name}.run").record(loop.time() - started_at)
+            if queue:
+                self._ready.put_nowait(channel)
+            else:
+                del self._pending[channel]
+            self._progress.set()
+
+    def stats(self) -> QueueStats:
+        return QueueStats(
+            queue_depth=self._depth,
+            running=self._running,
+            channels=len(self._pending),
+            processed=self.processed,
+            shed=self.shed,
+            dropped=self.dropped,
+            queue_wait=metrics.histogram(f"{self._name}.queue_wait").snapshot(),
+            run=metrics.histogram(f"{self._name}.run").snapshot(),
+        )
+
+    async def close(self, timeout: float = 0):
+        """
+        Stop taking events and give those already queued, or waiting for a
+        slot, up to `timeout` seconds to finish. Critical events are still
+        taken meanwhile. The workers are then stopped, abandoning whatever is
+        left, and the queue takes nothing more.
+        """
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._progress is not None and (
+            self._depth or self._running or self._waiting
+        ):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._progress.clear()
+            try:
+                await asyncio.wait_for(self._progress.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        abandoned = self._depth + self._running + self._waiting
+        if abandoned:
+            critical = sum(
+                item.critical for queue in self._pending.values() for item in queue
+            )
+            logging.warning(
+                f"{self._name} queue abandoned {abandoned} events on closing, {critical} of the queued ones critical"
+            )
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._slots is not None:
+            # Wake the listeners still waiting for a slot, which give up.
+            for _ in range(self._waiting):
+                self._slots.release()
+        self._tasks = []
+        self._pending.clear()
+        self._depth = 0
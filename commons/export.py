@@ -0,0 +1,281 @@
+"""
+Streaming exports of the statistics tables for offline analysis.
+
+Every table is read on a dedicated read-only connection inside one read
+transaction, so in WAL mode the export sees a single consistent snapshot of
+all of them and never takes a lock the writer waits on. Rows are pulled with
+`fetchmany` and streamed straight into gzip-compressed NDJSON or CSV files of
+KITTY_EXPORT_CHUNK_ROWS rows each, so memory use does not grow with the
+table. Each export is a directory holding the chunks and a manifest.json
+describing them; it only appears under its final name once complete.
+
+Admins can run one with `+export`, or from a shell without the bot:
+
+    python -m commons.export --format csv --db persist.sqlite --directory exports
+
+Subsystems kept in files of their own are attached with `--attach
+counters=counters.sqlite` and so on. Each file is read in its own snapshot.
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import IO, Any, Iterable, Mapping
+from commons import metrics
+
+TABLES = ("message_counts", "emoji_counts", "meme_stats", "message_deletes")
+FORMATS = ("ndjson", "csv")
+FETCH_ROWS = 5000
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_EXPORT_CHUNK_ROWS = max(1, _int_env("KITTY_EXPORT_CHUNK_ROWS", 1_000_000))
+_EXPORT_COMPRESSLEVEL = _int_env("KITTY_EXPORT_COMPRESSLEVEL", 6)
+
+_lock = asyncio.Lock()
+
+
+@dataclass
+class Export:
+    directory: str
+    rows: dict[str, int] = field(default_factory=dict[str, int])
+    files: list[str] = field(default_factory=list[str])
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return sum(self.rows.values()) / self.seconds if self.seconds else 0.0
+
+
+class _ChunkWriter:
+    """Writes rows into numbered gzip files of at most `chunk_rows` rows."""
+
+    def __init__(
+        self,
+        directory: str,
+        table: str,
+        columns: list[str],
+        format: str,
+        chunk_rows: int,
+    ):
+        self._directory = directory
+        self._table = table
+        self._columns = columns
+        self._format = format
+        self._chunk_rows = chunk_rows
+        self._file: IO[str] | None = None
+        self._csv: Any = None
+        self._in_chunk = 0
+        self.files: list[str] = []
+
+    def _open(self) -> IO[str]:
+        name = f"{self._table}-{len(self.files):04d}.{self._format}.gz"
+        self.files.append(name)
+        file = gzip.open(
+            os.path.join(self._directory, name),
+            "wt",
+            encoding="utf-8",
+            newline="",
+            compresslevel=_EXPORT_COMPRESSLEVEL,
+        )
+        self._file = file
+        self._in_chunk = 0
+        if self._format == "csv":
+            # Every chunk gets its own header so each one loads on its own.
+            self._csv = csv.writer(file)
+            self._csv.writerow(self._columns)
+        return file
+
+    def write(self, rows: Iterable[tuple[Any, ...]]):
+        for row in rows:
+            file = self._file
+            if file is None or self._in_chunk == self._chunk_rows:
+                self.close()
+                file = self._open()
+            if self._csv is not None:
+                self._csv.writerow(row)
+            else:
+                file.write(json.dumps(dict(zip(self._columns, row))))
+                file.write("\n")
+            self._in_chunk += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._csv = None
+
+
+def _export_table(
+    conn: sqlite3.Connection,
+    directory: str,
+    table: str,
+    format: str,
+    chunk_rows: int,
+) -> tuple[int, list[str], list[str]]:
+    """Stream `table` into chunks, returning (rows, columns, files)."""
+    cursor = conn.execute(f"SELECT * FROM {table}")
+    columns = [d[0] for d in cursor.description]
+    writer = _ChunkWriter(directory, table, columns, format, chunk_rows)
+    rows = 0
+    fetch = metrics.histogram("export.fetch")
+    try:
+        while True:
+            fetched_at = time.perf_counter()
+            batch = cursor.fetchmany(FETCH_ROWS)
+            fetch.record(time.perf_counter() - fetched_at)
+            if not batch:
+                break
+            writer.write(batch)
+            rows += len(batch)
+    finally:
+        writer.close()
+    return rows, columns, writer.files
+
+
+def export_tables(
+    source: str,
+    directory: str,
+    format: str = "ndjson",
+    tables: Iterable[str] = TABLES,
+    chunk_rows: int | None = None,
+    attached: Mapping[str, str] | None = None,
+) -> Export:
+    """
+    Export `tables` of the database at `source`, with the `attached` files
+    holding any it does not, into a new directory inside `directory`, all
+    from one consistent snapshot of each file.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {FORMATS}")
+    stem = os.path.splitext(os.path.basename(source))[0]
+    name = f"{stem}-export-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}"
+    target = os.path.join(directory, name)
+    partial = target + ".partial"
+    os.makedirs(partial)
+    started_at = time.perf_counter()
+    result = Export(target)
+    manifest: dict[str, Any] = {
+        "source": source,
+        "format": format,
+        "compression": "gzip",
+        "tables": {},
+    }
+    conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        for name, path in (attached or {}).items():
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (f"file:{path}?mode=ro",))
+        # The first read starts the read transaction, pinning the snapshot
+        # every table below is read from.
+        conn.execute("BEGIN")
+        manifest["schema_version"] = conn.execute(
+            "SELECT max(version) FROM schema_version"
+        ).fetchone()[0]
+        manifest["exported_at"] = datetime.now(timezone.utc).isoformat()
+        for table in tables:
+            rows, columns, files = _export_table(
+                conn, partial, table, format, chunk_rows or _EXPORT_CHUNK_ROWS
+            )
+            manifest["tables"][table] = {
+                "columns": columns,
+                "rows": rows,
+                "files": files,
+            }
+            result.rows[table] = rows
+            result.files += files
+        conn.rollback()
+        with open(os.path.join(partial, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        result.bytes = sum(
+            os.path.getsize(os.path.join(partial, file)) for file in result.files
+        )
+        os.replace(partial, target)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+    result.seconds = time.perf_counter() - started_at
+    metrics.histogram("export.run").record(result.seconds)
+    logging.info(
+        f"Exported {sum(result.rows.values()):,} rows ({result.bytes / 2**20:.1f}MiB) to {target} in {result.seconds:.1f}s"
+    )
+    return result
+
+
+def default_directory(source: str) -> str:
+    """KITTY_EXPORT_DIR, or an exports folder next to `source`."""
+    return os.getenv(
+        "KITTY_EXPORT_DIR", os.path.join(os.path.dirname(source), "exports")
+    )
+
+
+async def export(
+    source: str,
+    format: str = "ndjson",
+    directory: str | None = None,
+    attached: Mapping[str, str] | None = None,
+) -> Export:
+    """Run `export_tables` on a worker thread. Only one export runs at a time."""
+    async with _lock:
+        return await asyncio.to_thread(
+            export_tables,
+            source,
+            directory or default_directory(source),
+            format,
+            attached=attached,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the statistics tables to compressed NDJSON or CSV."
+    )
+    parser.add_argument(
+        "--db", default=os.getenv("KITTY_DB", "persist.sqlite"), help="Database"
+    )
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--directory", help="Where to write the export")
+    parser.add_argument("--table", action="append", choices=TABLES, dest="tables")
+    parser.add_argument("--chunk-rows", type=int)
+    parser.add_argument(
+        "--attach",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="A subsystem's database file",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    result = export_tables(
+        args.db,
+        args.directory or default_directory(args.db),
+        args.format,
+        args.tables or TABLES,
+        args.chunk_rows,
+        dict(attach.split("=", 1) for attach in args.attach),
+    )
+    print(result.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+In-memory message count leaderboard.
+
+Counts are kept in a Fenwick tree indexed by count, holding how many users
+have each count, alongside a count -> users bucket map. That answers a
+user's rank, who they just passed and any page of the board in O(log n)
+per question, where the window functions it replaces read every row of
+message_counts on every message.
+
+Each guild has its own board, so its questions cost O(log n) in the size of
+that guild alone. The boards are loaded from message_counts at startup and
+updated as each message is counted, alongside `commons.counters.add_message`,
+so they run ahead of the database by at most one counter flush.
+"""
+
+from typing import Iterable
+import commons.db as db
+
+
+class Leaderboard:
+    def __init__(self, rows: Iterable[tuple[int, int]] = ()):
+        self._counts: dict[int, int] = {}
+        self._buckets: dict[int, set[int]] = {}
+        self._tree: list[int] = [0] * 2
+        for user, count in rows:
+            self._counts[user] = count
+            self._buckets.setdefault(count, set()).add(user)
+        self._rebuild(max(self._buckets, default=0))
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def count(self, user: int) -> int:
+        return self._counts.get(user, 0)
+
+    def rank(self, user: int) -> int | None:
+        """1 + the number of users with a strictly higher count, like rank()."""
+        if user not in self._counts:
+            return None
+        return len(self) - self._prefix(self._counts[user]) + 1
+
+    def add(self, user: int, delta: int = 1) -> int | None:
+        """
+        Add `delta` to `user`'s count. Returns a user they passed, tied with
+        or ahead of them before and now behind them, or None. When several
+        were passed it is any one of those now directly below.
+        """
+        old = self._counts.get(user)
+        new = max((old or 0) + delta, 0)
+        if old is not None:
+            self._remove(user, old)
+        self._insert(user, new)
+        if delta <= 0:
+            return None
+        start = old or 0
+        passed = self._prefix(new - 1) - self._prefix(start - 1)
+        if passed <= 0:
+            return None
+        below = self._kth(self._prefix(new - 1))
+        return next(iter(self._buckets[below]))
+
+    def page(self, number: int, size: int = 10) -> list[tuple[int, int]]:
+        """Users on 0-based page `number` of the board, highest count first."""
+        position = number * size
+        rows: list[tuple[int, int]] = []
+        while len(rows) < size and position < len(self):
+            # The position'th highest is the (n - position)'th lowest.
+            count = self._kth(len(self) - position)
+            ahead = len(self) - self._prefix(count)
+            bucket = sorted(self._buckets[count])
+            for user in bucket[position - ahead :][: size - len(rows)]:
+                rows.append((user, count))
+            position = ahead + len(bucket)
+        return rows
+
+    def _insert(self, user: int, count: int):
+        if count + 1 >= len(self._tree):
+            self._rebuild(count)
+        self._counts[user] = count
+        self._buckets.setdefault(count, set()).add(user)
+        self._update(count, 1)
+
+    def _remove(self, user: int, count: int):
+        bucket = self._buckets[count]
+        bucket.discard(user)
+        if not bucket:
+            del self._buckets[count]
+        del self._counts[user]
+        self._update(count, -1)
+
+    def _rebuild(self, max_count: int):
+        size = len(self._tree) - 1
+        while size < max_count + 2:
+            size *= 2
+        tree = [0] * (size + 1)
+        for count, users in self._buckets.items():
+            tree[count + 1] += len(users)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, count: int, delta: int):
+        i = count + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, count: int) -> int:
+        """Number of users with a count of at most `count`."""
+        total = 0
+        i = min(count + 1, len(self._tree) - 1)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _kth(self, k: int) -> int:
+        """The smallest count with at least `k` users at or below it."""
+        i = 0
+        step = (len(self._tree) - 1).bit_length()
+        for bit in reversed(range(step)):
+            j = i + (1 << bit)
+            if j < len(self._tree) and self._tree[j] < k:
+                i = j
+                k -= self._tree[j]
+        return i
+
+
+def _load() -> dict[int, Leaderboard]:
+    rows: dict[int, list[tuple[int, int]]] = {}
+    for guild, user, count in db.cursor().execute(
+        "SELECT guild, user, count FROM message_counts"
+    ):
+        rows.setdefault(guild, []).append((user, count))
+    return {guild: Leaderboard(guild_rows) for guild, guild_rows in rows.items()}
+
+
+_boards = _load()
+
+
+def _board(guild: int) -> Leaderboard:
+    if guild not in _boards:
+        _boards[guild] = Leaderboard()
+    return _boards[guild]
+
+
+def add_message(guild: int, user: int, delta: int = 1) -> int | None:
+    """Count `delta` messages for `user`, returning someone they just passed if any."""
+    return _board(guild).add(user, delta)
+
+
+def count(guild: int, user: int) -> int:
+    return _board(guild).count(user)
+
+
+def rank(guild: int, user: int) -> int | None:
+    return _board(guild).rank(user)
+
+
+def page(guild: int, number: int, size: int = 10) -> list[tuple[int, int]]:
+    return _board(guild).page(number, size)
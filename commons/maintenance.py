@@ -0,0 +1,301 @@
+"""
+Retention, archival and housekeeping for the database file.
+
+Once a day (KITTY_MAINTENANCE_HOURS) old rows are pruned according to the
+policies below, copied first into a cold archive database (KITTY_ARCHIVE_DB,
+empty to just delete them). Freed pages are then handed back to the file
+system with an incremental vacuum, for files already in incremental
+auto_vacuum mode, and PRAGMA optimize refreshes the planner's
+statistics. Every KITTY_CHECKPOINT_MINUTES the WAL is checkpointed so it does
+not grow between SQLite's own automatic checkpoints.
+
+Everything runs as short jobs on the writer thread of the file concerned,
+so message ingestion is only ever held up for one batch at a time. Each
+subsystem kept in a file of its own is vacuumed and checkpointed with it.
+Switching a file to incremental auto_vacuum takes a full VACUUM, which
+rewrites it with every write waiting, so it is only done when an operator
+sets KITTY_VACUUM_CONVERT=1, best for one run in a quiet hour.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import commons.db as db
+from commons import metrics, scheduler, snowflakes
+
+DAY = 24 * 60 * 60
+BATCH_SIZE = 500
+VACUUM_PAGES = 2000
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_MAINTENANCE_HOURS = _int_env("KITTY_MAINTENANCE_HOURS", 24)
+_CHECKPOINT_MINUTES = _int_env("KITTY_CHECKPOINT_MINUTES", 10)
+_VACUUM_CONVERT = _int_env("KITTY_VACUUM_CONVERT", 0) > 0
+_ARCHIVE = os.getenv(
+    "KITTY_ARCHIVE_DB", os.path.splitext(db.path())[0] + "-archive.sqlite"
+)
+
+
+@dataclass(frozen=True)
+class Retention:
+    """
+    Rows of `table` whose message is older than `days` are archived and then
+    deleted, or, when `clear` names a column, only that column is archived
+    and set to NULL. Age comes from the snowflake in `message_column`.
+    """
+
+    table: str
+    days: int
+    clear: str | None = None
+    message_column: str = "message_id"
+
+    @property
+    def label(self) -> str:
+        return f"{self.table}.{self.clear}" if self.clear else self.table
+
+
+@dataclass(frozen=True)
+class RollupRetention:
+    """Rollup rows whose bucket started more than `days` ago are deleted."""
+
+    table: str
+    days: int
+
+
+POLICIES: list[Retention] = [
+    # Originality means never repeating a message, so hashes are kept forever
+    # unless asked otherwise.
+    Retention("message_hashes", _int_env("KITTY_RETAIN_MESSAGE_HASHES_DAYS", 0)),
+    Retention("image_hashes", _int_env("KITTY_RETAIN_IMAGE_HASHES_DAYS", 365)),
+    # The rating's explanation is only asked for while a meme is fresh.
+    Retention(
+        "meme_stats",
+        _int_env("KITTY_RETAIN_MEME_REASONING_DAYS", 90),
+        clear="meme_reasoning",
+    ),
+]
+ROLLUP_POLICIES: list[RollupRetention] = [
+    # Daily rollups are small and kept forever.
+    RollupRetention(table, _int_env("KITTY_RETAIN_HOURLY_ROLLUPS_DAYS", 90))
+    for table in (
+        "message_rollup_hourly",
+        "emoji_rollup_hourly",
+        "meme_score_rollup_hourly",
+    )
+]
+
+
+def cutoff_snowflake(days: int, now: float | None = None) -> int:
+    """The first snowflake that could have been created `days` ago."""
+    now = time.time() if now is None else now
+    return snowflakes.first_at(datetime.fromtimestamp(now - days * DAY, timezone.utc))
+
+
+def _columns(cursor: db.Cursor, table: str) -> list[str]:
+    schema = db.database(table)
+    return [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _archive_table(cursor: db.Cursor, policy: Retention) -> tuple[str, str]:
+    """The archive table for `policy` and the columns copied into it."""
+    if policy.clear:
+        return (
+            f"{policy.table}_{policy.clear}",
+            f"{policy.message_column}, {policy.clear}",
+        )
+    return (policy.table, ", ".join(_columns(cursor, policy.table)))
+
+
+def _prepare_archive(cursor: db.Cursor, policies: list[Retention]):
+    cursor.execute("ATTACH DATABASE ? AS archive", (_ARCHIVE,))
+    for policy in policies:
+        name, columns = _archive_table(cursor, policy)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS archive.{name} AS SELECT {columns} FROM {db.database(policy.table)}.{policy.table} WHERE 0"
+        )
+
+
+def _prune_batch(
+    cursor: db.Cursor, policy: Retention, cutoff: int, archive: bool
+) -> int:
+    """Archive and prune one batch of rows older than `cutoff`."""
+    # Cleared rows stay behind, so skip them.
+    pending = f" AND {policy.clear} IS NOT NULL" if policy.clear else ""
+    rowids = [
+        row[0]
+        for row in cursor.execute(
+            f"SELECT rowid FROM {policy.table} WHERE {policy.message_column} < ?{pending} LIMIT ?",
+            (cutoff, BATCH_SIZE),
+        )
+    ]
+    if not rowids:
+        return 0
+    selected = f"rowid IN ({', '.join('?' * len(rowids))})"
+    if archive:
+        # Copy with the original rowid so that a batch retried after a crash
+        # between the two databases' commits is not archived twice.
+        name, columns = _archive_table(cursor, policy)
+        cursor.execute(
+            f"INSERT OR IGNORE INTO archive.{name} (rowid, {columns}) SELECT rowid, {columns} FROM {db.database(policy.table)}.{policy.table} WHERE {selected}",
+            rowids,
+        )
+    if policy.clear:
+        cursor.execute(
+            f"UPDATE {policy.table} SET {policy.clear} = NULL WHERE {selected}",
+            rowids,
+        )
+    else:
+        cursor.execute(f"DELETE FROM {policy.table} WHERE {selected}", rowids)
+    return len(rowids)
+
+
+async def apply_retention(now: float | None = None) -> dict[str, int]:
+    """Apply every retention policy, returning the rows pruned per policy."""
+    policies = [p for p in POLICIES if p.days > 0]
+    archive = bool(_ARCHIVE) and bool(policies)
+    pruned: dict[str, int] = {}
+    # The archive is attached to the writer of each file pruned from.
+    by_database: dict[str, list[Retention]] = {}
+    for policy in policies:
+        by_database.setdefault(db.database(policy.table), []).append(policy)
+    attached: list[str] = []
+    try:
+        for database, batch in by_database.items():
+            if archive:
+                await db.submit(
+                    lambda c: _prepare_archive(c, batch),
+                    "maintenance.attach_archive",
+                    database,
+                )
+                attached.append(database)
+            for policy in batch:
+                cutoff = cutoff_snowflake(policy.days, now)
+                total = 0
+                while count := await db.submit(
+                    lambda c: _prune_batch(c, policy, cutoff, archive),
+                    f"maintenance.retention.{policy.label}",
+                    database,
+                ):
+                    total += count
+                pruned[policy.label] = total
+    finally:
+        for database in attached:
+            await db.submit(
+                lambda c: c.execute("DETACH DATABASE archive"),
+                "maintenance.detach_archive",
+                database,
+            )
+    for rollup in ROLLUP_POLICIES:
+        if rollup.days <= 0:
+            continue
+        cutoff = int(time.time() if now is None else now) - rollup.days * DAY
+        pruned[rollup.table] = await db.submit(
+            lambda c: c.execute(
+                f"DELETE FROM {rollup.table} WHERE bucket < ?", (cutoff,)
+            ).rowcount,
+            f"maintenance.retention.{rollup.table}",
+            db.database(rollup.table),
+        )
+    return pruned
+
+
+def _incremental_vacuum(cursor: db.Cursor, schema: str) -> bool:
+    """Whether the file is in incremental auto_vacuum mode, switching it if allowed."""
+    if cursor.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] == 2:
+        return True
+    if not _VACUUM_CONVERT:
+        logging.warning(
+            f"Not vacuuming {schema}, set KITTY_VACUUM_CONVERT=1 to switch it to incremental vacuum with one full VACUUM"
+        )
+        return False
+    # Changing auto_vacuum only takes effect after a full VACUUM, which
+    # rewrites the whole file once, holding up every write to it meanwhile.
+    # It has to run outside a transaction.
+    logging.info(f"Switching {schema} to incremental vacuum, this runs once")
+    cursor.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+    cursor.execute(f"VACUUM {schema}")
+    return False
+
+
+def _vacuum_step(cursor: db.Cursor, schema: str) -> int:
+    free = cursor.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+    if free:
+        cursor.execute(f"PRAGMA {schema}.incremental_vacuum({VACUUM_PAGES})").fetchall()
+    return min(free, VACUUM_PAGES)
+
+
+async def vacuum() -> int:
+    """Return free pages to the file system, a step at a time. Returns pages freed."""
+    freed = 0
+    for schema in ("main", *db.attached()):
+        if not await db.submit(
+            lambda c: _incremental_vacuum(c, schema),
+            "maintenance.enable_vacuum",
+            schema,
+        ):
+            continue
+        while step := await db.submit(
+            lambda c: _vacuum_step(c, schema), "maintenance.vacuum", schema
+        ):
+            freed += step
+    return freed
+
+
+async def optimize():
+    await db.submit(lambda c: c.execute("PRAGMA optimize"), "maintenance.optimize")
+
+
+async def checkpoint(mode: str = "PASSIVE") -> tuple[int, int, int]:
+    """
+    Checkpoint the WAL of every file. PASSIVE never waits for readers;
+    TRUNCATE waits for them (up to the busy timeout) and then shrinks the WAL
+    file to nothing. Returns (busy, WAL frames, frames checkpointed), summed
+    over the files.
+    """
+    total = (0, 0, 0)
+    for schema in ("main", *db.attached()):
+        row: tuple[int, int, int] = await db.submit(
+            lambda c: c.execute(f"PRAGMA {schema}.wal_checkpoint({mode})").fetchone(),
+            "maintenance.checkpoint",
+            schema,
+        )
+        total = (total[0] + row[0], total[1] + row[1], total[2] + row[2])
+    return total
+
+
+async def run():
+    """Run a full maintenance pass."""
+    started_at = time.perf_counter()
+    pruned = await apply_retention()
+    freed = await vacuum()
+    await optimize()
+    busy, frames, _ = await checkpoint("TRUNCATE")
+    elapsed = time.perf_counter() - started_at
+    metrics.histogram("maintenance.run").record(elapsed)
+    logging.info(
+        f"Maintenance took {elapsed:.1f}s: pruned {pruned}, freed {freed} pages, WAL {frames} frames{' (readers busy)' if busy else ''}"
+    )
+
+
+def schedule():
+    """Start the periodic maintenance and checkpoint jobs."""
+    if _MAINTENANCE_HOURS > 0:
+        scheduler.every(_MAINTENANCE_HOURS * 60 * 60, run, "maintenance")
+    if _CHECKPOINT_MINUTES > 0:
+
+        async def passive_checkpoint():
+            await checkpoint()
+
+        scheduler.every(_CHECKPOINT_MINUTES * 60, passive_checkpoint, "checkpoint")
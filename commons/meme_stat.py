@@ -1,9 +1,11 @@
 import hikari
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Optional
 from datetime import datetime
 import os
 from typing_extensions import Final
+import commons.db as db
+from commons import snowflakes
 
 MINIMUM_MEME_RATING_TO_NOT_DELETE: Final[int] = int(
     os.environ.get("MEME_QUALITY_THRESHOLD", "6")
@@ -20,7 +22,54 @@ class MemeStat:
     rating_count: Optional[int]
     timestamp: Optional[datetime]
 
+    @classmethod
+    def from_row(cls, row: tuple[Any, ...]) -> "MemeStat":
+        """Build a MemeStat from a `SELECT *` row of meme_stats."""
+        return cls(
+            author_id=hikari.Snowflake(row[0]),
+            message_id=hikari.Snowflake(row[1]),
+            meme_score=row[2],
+            timestamp=None if row[3] is None else snowflakes.from_epoch_ms(row[3]),
+            meme_rating=row[4],
+            rating_count=row[5],
+            meme_reasoning=row[6],
+        )
+
     def emoji(self) -> hikari.Emoji:
         if self.meme_score >= MINIMUM_MEME_RATING_TO_NOT_DELETE:
             return hikari.Emoji.parse("👍")
         return hikari.Emoji.parse("💩")
+
+
+_GET = db.statement(
+    "meme_stat.get",
+    "SELECT * FROM meme_stats WHERE message_id = ?",
+)
+_EXPLANATION = db.statement(
+    "meme_stat.explanation",
+    """
+    SELECT meme_reasoning
+    FROM meme_stats
+    WHERE message_id = ?""",
+)
+_SCORE = db.statement(
+    "meme_stat.score",
+    """
+    select meme_score from meme_stats
+    where message_id = ?""",
+)
+
+
+def get(message_id: int) -> MemeStat | None:
+    row = db.cursor().execute(_GET, (message_id,)).fetchone()
+    return None if row is None else MemeStat.from_row(row)
+
+
+def explanation(message_id: int) -> str | None:
+    row = db.cursor().execute(_EXPLANATION, (message_id,)).fetchone()
+    return None if row is None else row[0]
+
+
+def score(cursor: db.Cursor, message_id: int) -> int | None:
+    row = cursor.execute(_SCORE, (message_id,)).fetchone()
+    return None if row is None else row[0]
@@ -0,0 +1,89 @@
+"""
+Views of a message's content that several behaviours need, each computed at
+most once per event.
+
+`behaviours.run_chain` opens a `scope` for every event, and within it `of`
+returns the same `MessageContext` to every handler that asks about the same
+content, so the first handler to use a view computes it and the rest reuse
+it. Outside a scope, such as when backfilling, each call gets a context of
+its own.
+"""
+
+import contextlib
+import contextvars
+import re
+import unicodedata
+from functools import cached_property
+from typing import Generator
+from emoji import emoji_list
+
+_MARKUP = re.compile(r"<.+?>")
+_CUSTOM_EMOJI = re.compile(r"<.?:.+?:\d+>")
+_WORD = re.compile(r"\w+")
+
+
+class MessageContext:
+    def __init__(self, content: str):
+        self.content = content
+
+    @cached_property
+    def stripped(self) -> str:
+        """The content without mentions, custom emoji and other <...> markup."""
+        return _MARKUP.sub("", self.content)
+
+    @cached_property
+    def has_letters(self) -> bool:
+        """Whether anything but markup, digits and punctuation was written."""
+        return any(c.isalpha() for c in self.stripped)
+
+    @cached_property
+    def words(self) -> frozenset[str]:
+        """
+        The casefolded words of the stripped content. A word is in here
+        exactly when a case-insensitive `\\bword\\b` search would find it.
+        """
+        return frozenset(_WORD.findall(self.stripped.casefold()))
+
+    @cached_property
+    def emoji(self) -> list[str]:
+        """Every custom and unicode emoji used, repeats included."""
+        custom_emoji = _CUSTOM_EMOJI.findall(self.content)
+        return custom_emoji + [x["emoji"] for x in emoji_list(self.content)]
+
+    @cached_property
+    def normalised(self) -> str:
+        """The content as the originality check compares it."""
+        return unicodedata.normalize("NFKD", self.content).casefold().replace(" ", "")
+
+
+_Contexts = dict[str, MessageContext]
+
+_contexts: contextvars.ContextVar[_Contexts | None] = contextvars.ContextVar(
+    "message_contexts", default=None
+)
+
+
+@contextlib.contextmanager
+def scope(contexts: _Contexts | None = None) -> Generator[_Contexts, None, None]:
+    """
+    Share contexts between everything run inside, including tasks it
+    starts. Pass the contexts another scope yielded to carry on sharing them.
+    """
+    if contexts is None:
+        contexts = {}
+    token = _contexts.set(contexts)
+    try:
+        yield contexts
+    finally:
+        _contexts.reset(token)
+
+
+def of(content: str) -> MessageContext:
+    """The context of `content`, shared within the current scope."""
+    contexts = _contexts.get()
+    if contexts is None:
+        return MessageContext(content)
+    context = contexts.get(content)
+    if context is None:
+        context = contexts[content] = MessageContext(content)
+    return context
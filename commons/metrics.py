@@ -0,0 +1,79 @@
+"""
+In-process latency histograms.
+
+Histograms use fixed, exponentially sized buckets, so recording is constant
+time and memory no matter how many samples are taken. Percentiles are
+reported as the upper bound of the bucket they fall in, which is accurate to
+within a factor of two and plenty for spotting regressions.
+"""
+
+import threading
+from dataclasses import dataclass, field
+
+# Bucket upper bounds in seconds: 50µs doubling up to ~105s, plus overflow.
+_BOUNDS = [0.00005 * 2**i for i in range(22)]
+
+
+@dataclass
+class Histogram:
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(_BOUNDS) + 1))
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(self, seconds: float):
+        index = next(
+            (i for i, bound in enumerate(_BOUNDS) if seconds <= bound), len(_BOUNDS)
+        )
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the `q`th percentile (0-100), capped
+        at the largest value seen.
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(_BOUNDS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def snapshot(self) -> "Histogram":
+        with self._lock:
+            return Histogram(
+                list(self.buckets), self.count, self.total_seconds, self.max_seconds
+            )
+
+
+_histograms: dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def histogram(name: str) -> Histogram:
+    """The histogram called `name`, created on first use."""
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram()
+        return _histograms[name]
+
+
+def histograms(prefix: str = "") -> dict[str, Histogram]:
+    """Snapshots of every histogram whose name starts with `prefix`."""
+    with _lock:
+        matching = [(n, h) for n, h in _histograms.items() if n.startswith(prefix)]
+    return {name[len(prefix) :]: h.snapshot() for name, h in matching}
@@ -0,0 +1,698 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in version order, and is recorded in the
+schema_version table. A migration runs inside a transaction together with the
+row that records it, so a crash either applies all of it or none of it. The
+exception is batched work (`Migrator.batched`, `Migrator.rebuild_table`),
+which commits every batch and remembers its position in migration_progress so
+that a restarted migration carries on where it stopped. Anything a migration
+does before its batched steps must therefore be safe to run twice.
+
+A table may live in a subsystem's attached file rather than the main one.
+Migrations create and rebuild tables, and their indexes and triggers,
+through `Migrator.create` and `Migrator.rebuild_table`, which put them in the
+schema the table belongs to. Plain statements name tables without a schema,
+which SQLite finds wherever they are.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence
+
+BATCH_SIZE = 10_000
+
+_Rows = list[tuple[Any, ...]]
+
+# The schema a table belongs in, given its name.
+Resolver = Callable[[str], str]
+
+_CREATE = re.compile(
+    r"^\s*CREATE\s+(UNIQUE\s+)?(TABLE|INDEX|TRIGGER)\s+(IF\s+NOT\s+EXISTS\s+)?",
+    re.IGNORECASE,
+)
+
+
+def in_schema(sql: str, schema: str) -> str:
+    """`sql`, a CREATE TABLE, INDEX or TRIGGER statement, creating in `schema`."""
+    return _CREATE.sub(lambda m: f"{m[0]}{schema}.", sql, count=1)
+
+
+def _main(table: str) -> str:
+    return "main"
+
+
+class Migrator:
+    """Handed to each migration to make schema and data changes."""
+
+    def __init__(
+        self, conn: sqlite3.Connection, version: int, resolve: Resolver = _main
+    ):
+        self.conn = conn
+        self.version = version
+        self.resolve = resolve
+
+    def execute(self, sql: str, parameters: Sequence[Any] = ()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, parameters)
+
+    def qualify(self, table: str) -> str:
+        """`table` prefixed with the schema it lives in."""
+        return f"{self.resolve(table)}.{table}"
+
+    def create(self, table: str, sql: str):
+        """Run `sql`, which creates `table` or an index or trigger on it, in its schema."""
+        self.execute(in_schema(sql, self.resolve(table)))
+
+    def has_table(self, table: str) -> bool:
+        row = self.execute(
+            f"SELECT 1 FROM {self.resolve(table)}.sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        ).fetchone()
+        return row is not None
+
+    def has_column(self, table: str, column: str) -> bool:
+        return any(
+            row[1] == column
+            for row in self.execute(f"PRAGMA {self.resolve(table)}.table_info({table})")
+        )
+
+    def add_column(self, table: str, column: str, definition: str):
+        if not self.has_column(table, column):
+            self.execute(f"ALTER TABLE {self.qualify(table)} ADD {column} {definition}")
+
+    def batched(
+        self,
+        step: str,
+        table: str,
+        fn: Callable[[sqlite3.Cursor, _Rows], None],
+        columns: str = "*",
+        batch_size: int = BATCH_SIZE,
+    ):
+        """
+        Call `fn` with successive batches of `(rowid, columns...)` rows from
+        `table`, committing after each batch. Progress is stored under `step`,
+        so an interrupted run resumes after the last committed batch.
+        """
+        self._commit()
+        position = self._position(step)
+        table = self.qualify(table)
+        total = self.execute(
+            f"SELECT count(*) FROM {table} WHERE rowid > ?", (position,)
+        ).fetchone()[0]
+        done = 0
+        started_at = time.perf_counter()
+        while True:
+            rows: _Rows = self.execute(
+                f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (position, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            self._begin()
+            fn(self.conn.cursor(), rows)
+            position = rows[-1][0]
+            self._save_position(step, position)
+            self._commit()
+            done += len(rows)
+            elapsed = time.perf_counter() - started_at
+            logging.info(
+                f"Migration {self.version} {step}: {done:,}/{total:,} rows ({done * 100 // max(total, 1)}%, {done / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+        self._begin()
+
+    def rebuild_table(
+        self,
+        table: str,
+        definition: str,
+        columns: Sequence[str],
+        select: Sequence[str] | None = None,
+        indexes: Sequence[str] = (),
+        batch_size: int = BATCH_SIZE,
+    ):
+        """
+        Replace `table` with a new one with the column `definition`, e.g.
+        "(user INTEGER, count INTEGER)". Rows are copied across in batches,
+        keeping their rowid, with `select` giving the expression for each of
+        `columns` (the column names themselves by default). `indexes` are
+        created once the new table has taken the old one's name. A WITHOUT
+        ROWID table has no rowid to resume from, so it is copied in one go.
+        A table that was already rebuilt by this migration is left alone.
+        The new table, and its indexes, are created in the old one's schema.
+        """
+        step = f"rebuild {table}"
+        if self._position(f"{step} done"):
+            return
+        schema = self.resolve(table)
+        new_table = f"{schema}.{table}__new"
+        self.execute(f"CREATE TABLE IF NOT EXISTS {new_table} {definition}")
+        names = ", ".join(columns)
+        if definition.upper().rstrip().endswith("WITHOUT ROWID"):
+            self.execute(
+                f"INSERT INTO {new_table} ({names}) SELECT {', '.join(select or columns)} FROM {schema}.{table}"
+            )
+        else:
+            placeholders = ", ".join("?" * (len(columns) + 1))
+
+            def copy(cursor: sqlite3.Cursor, rows: _Rows):
+                cursor.executemany(
+                    f"INSERT INTO {new_table} (rowid, {names}) VALUES ({placeholders})",
+                    rows,
+                )
+
+            self.batched(step, table, copy, ", ".join(select or columns), batch_size)
+        self.execute(f"DROP TABLE {schema}.{table}")
+        self.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        for index in indexes:
+            self.execute(in_schema(index, schema))
+        self._save_position(f"{step} done", 1)
+
+    def _position(self, step: str) -> int:
+        row = self.execute(
+            "SELECT position FROM migration_progress WHERE version = ? AND step = ?",
+            (self.version, step),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _save_position(self, step: str, position: int):
+        self.execute(
+            "INSERT INTO migration_progress VALUES (?, ?, ?) ON CONFLICT (version, step) DO UPDATE SET position = excluded.position",
+            (self.version, step, position),
+        )
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.execute("BEGIN IMMEDIATE")
+
+    def _commit(self):
+        if self.conn.in_transaction:
+            self.execute("COMMIT")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Migrator], None]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT max(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(
+    conn: sqlite3.Connection, migrations: Sequence[Migration], resolve: Resolver = _main
+):
+    """
+    Apply every migration newer than the database's schema version, with
+    `resolve` naming the schema each table lives in.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS migration_progress (version INTEGER, step TEXT, position INTEGER, PRIMARY KEY (version, step))"
+        )
+        applied = current_version(conn)
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version <= applied:
+                continue
+            logging.info(f"Applying migration {migration.version} {migration.name}")
+            migrator = Migrator(conn, migration.version, resolve)
+            migrator.execute("BEGIN IMMEDIATE")
+            try:
+                migration.apply(migrator)
+                migrator.execute(
+                    "INSERT INTO schema_version VALUES (?, ?, ?)",
+                    (migration.version, migration.name, int(time.time())),
+                )
+                migrator.execute(
+                    "DELETE FROM migration_progress WHERE version = ?",
+                    (migration.version,),
+                )
+                migrator.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def _baseline(m: Migrator):
+    m.create(
+        "emoji_counts",
+        "CREATE TABLE IF NOT EXISTS emoji_counts (user TEXT, emoji TEXT, count INTEGER)",
+    )
+    m.create(
+        "emoji_counts",
+        "CREATE UNIQUE INDEX IF NOT EXISTS emoji_counts_idx ON emoji_counts (user, emoji)",
+    )
+    m.create(
+        "message_counts",
+        "CREATE TABLE IF NOT EXISTS message_counts (user TEXT, count INTEGER)",
+    )
+    m.create(
+        "message_counts",
+        "CREATE UNIQUE INDEX IF NOT EXISTS message_counts_idx ON message_counts (user)",
+    )
+    m.create(
+        "message_hashes",
+        "CREATE TABLE IF NOT EXISTS message_hashes (user TEXT, message_id TEXT, message_hash TEXT, time_sent TEXT)",
+    )
+    m.create(
+        "message_hashes",
+        "CREATE UNIQUE INDEX IF NOT EXISTS message_hashes_idx ON message_hashes (message_hash)",
+    )
+    m.create(
+        "image_hashes",
+        "CREATE TABLE IF NOT EXISTS image_hashes (hash TEXT, message_id TEXT, channel_id TEXT, guild_id TEXT)",
+    )
+    m.create(
+        "message_deletes",
+        "CREATE TABLE IF NOT EXISTS message_deletes (user TEXT, count INTEGER)",
+    )
+    m.create(
+        "message_deletes",
+        "CREATE UNIQUE INDEX IF NOT EXISTS message_deletes_idx ON message_deletes (user)",
+    )
+    m.create(
+        "meme_stats",
+        "CREATE TABLE IF NOT EXISTS meme_stats (user TEXT, message_id TEXT, meme_score INTEGER, time_sent TEXT)",
+    )
+    m.create(
+        "shit_meme_deletes",
+        "CREATE TABLE IF NOT EXISTS shit_meme_deletes (user TEXT, count INTEGER)",
+    )
+    m.create(
+        "shit_meme_deletes",
+        "CREATE UNIQUE INDEX IF NOT EXISTS shit_meme_deletes_idx ON shit_meme_deletes (user)",
+    )
+    m.add_column("image_hashes", "hash_color", "TEXT NOT NULL DEFAULT ''")
+    m.add_column("meme_stats", "meme_rating", "INTEGER")
+    m.add_column("meme_stats", "rating_count", "INTEGER")
+    m.add_column("meme_stats", "meme_reasoning", "TEXT")
+    # EmojiCache Table Removed
+    m.create("options", "CREATE TABLE IF NOT EXISTS options (name TEXT, value TEXT)")
+    m.create(
+        "options", "CREATE UNIQUE INDEX IF NOT EXISTS options_idx ON options (name)"
+    )
+    m.create(
+        "scheduled_actions",
+        "CREATE TABLE IF NOT EXISTS scheduled_actions (time INTEGER, action TEXT, arguments TEXT)",
+    )
+
+
+def _hot_lookup_indexes(m: Migrator):
+    # Rating, explaining and shit-meme checks look memes up by message.
+    m.create(
+        "meme_stats",
+        "CREATE INDEX IF NOT EXISTS meme_stats_message_idx ON meme_stats (message_id)",
+    )
+    # /memestats averages scores per day, for one user or the whole server.
+    m.create(
+        "meme_stats",
+        "CREATE INDEX IF NOT EXISTS meme_stats_user_time_idx ON meme_stats (user, time_sent, meme_score)",
+    )
+    m.create(
+        "meme_stats",
+        "CREATE INDEX IF NOT EXISTS meme_stats_time_idx ON meme_stats (time_sent, meme_score)",
+    )
+    # Every message delete drops its hash.
+    m.create(
+        "message_hashes",
+        "CREATE INDEX IF NOT EXISTS message_hashes_message_idx ON message_hashes (message_id)",
+    )
+    m.create(
+        "image_hashes",
+        "CREATE INDEX IF NOT EXISTS image_hashes_message_idx ON image_hashes (message_id)",
+    )
+    # Per-emoji ranks and top users.
+    m.create(
+        "emoji_counts",
+        "CREATE INDEX IF NOT EXISTS emoji_counts_emoji_idx ON emoji_counts (emoji, count)",
+    )
+    m.execute("ANALYZE")
+
+
+def _rollups(m: Migrator):
+    for table in ("message_rollup_hourly", "message_rollup_daily"):
+        m.create(
+            table,
+            f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER, user TEXT, channel TEXT, count INTEGER, PRIMARY KEY (bucket, user, channel)) WITHOUT ROWID",
+        )
+    for table in ("emoji_rollup_hourly", "emoji_rollup_daily"):
+        m.create(
+            table,
+            f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER, user TEXT, channel TEXT, emoji TEXT, count INTEGER, PRIMARY KEY (bucket, user, channel, emoji)) WITHOUT ROWID",
+        )
+        m.create(
+            table,
+            f"CREATE INDEX IF NOT EXISTS {table}_emoji_idx ON {table} (emoji, bucket, count)",
+        )
+    m.create(
+        "meme_score_rollup_hourly",
+        "CREATE TABLE IF NOT EXISTS meme_score_rollup_hourly (bucket INTEGER, user TEXT, channel TEXT, score_sum INTEGER, count INTEGER, PRIMARY KEY (bucket, user, channel)) WITHOUT ROWID",
+    )
+    m.create(
+        "meme_score_rollup_hourly",
+        "CREATE INDEX IF NOT EXISTS meme_score_rollup_hourly_user_idx ON meme_score_rollup_hourly (user, bucket, score_sum, count)",
+    )
+
+    # Messages and emoji were only ever counted all-time, but every rated meme
+    # has its time. Which channel it was in was not kept.
+    def backfill(cursor: sqlite3.Cursor, rows: _Rows):
+        cursor.executemany(
+            """
+            INSERT INTO meme_score_rollup_hourly
+            SELECT bucket, user, '', meme_score, 1
+            FROM (
+                SELECT CAST(strftime('%s', ?) AS INTEGER) / 3600 * 3600 AS bucket,
+                       ? AS user,
+                       ? AS meme_score
+            )
+            WHERE bucket IS NOT NULL AND meme_score IS NOT NULL
+            ON CONFLICT (bucket, user, channel) DO UPDATE
+            SET score_sum = score_sum + excluded.score_sum,
+                count = count + excluded.count""",
+            [(time_sent, user, score) for _, user, score, time_sent in rows],
+        )
+
+    m.batched(
+        "backfill meme scores", "meme_stats", backfill, "user, meme_score, time_sent"
+    )
+
+
+_EPOCH_MS = "CAST(round((julianday({0}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def _integer_snowflakes(m: Migrator):
+    # Ids were stored as TEXT and times as ISO 8601 TEXT, which made every key
+    # twice the size and meant time queries parsed strings. Ids become INTEGER
+    # snowflakes and times INTEGER milliseconds since the Unix epoch.
+    def snowflake(column: str) -> str:
+        return f"CAST({column} AS INTEGER)"
+
+    for table in ("message_counts", "message_deletes", "shit_meme_deletes"):
+        m.rebuild_table(
+            table,
+            "(user INTEGER, count INTEGER)",
+            ["user", "count"],
+            [snowflake("user"), "count"],
+            [f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_idx ON {table} (user)"],
+        )
+    m.rebuild_table(
+        "emoji_counts",
+        "(user INTEGER, emoji TEXT, count INTEGER)",
+        ["user", "emoji", "count"],
+        [snowflake("user"), "emoji", "count"],
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS emoji_counts_idx ON emoji_counts (user, emoji)",
+            "CREATE INDEX IF NOT EXISTS emoji_counts_emoji_idx ON emoji_counts (emoji, count)",
+        ],
+    )
+    m.rebuild_table(
+        "message_hashes",
+        "(user INTEGER, message_id INTEGER, message_hash TEXT, time_sent INTEGER)",
+        ["user", "message_id", "message_hash", "time_sent"],
+        [
+            snowflake("user"),
+            snowflake("message_id"),
+            "message_hash",
+            _EPOCH_MS.format("time_sent"),
+        ],
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS message_hashes_idx ON message_hashes (message_hash)",
+            "CREATE INDEX IF NOT EXISTS message_hashes_message_idx ON message_hashes (message_id)",
+        ],
+    )
+    m.rebuild_table(
+        "image_hashes",
+        "(hash TEXT, message_id INTEGER, channel_id INTEGER, guild_id INTEGER, hash_color TEXT NOT NULL DEFAULT '')",
+        ["hash", "message_id", "channel_id", "guild_id", "hash_color"],
+        [
+            "hash",
+            snowflake("message_id"),
+            snowflake("channel_id"),
+            snowflake("guild_id"),
+            "hash_color",
+        ],
+        [
+            "CREATE INDEX IF NOT EXISTS image_hashes_message_idx ON image_hashes (message_id)"
+        ],
+    )
+    m.rebuild_table(
+        "meme_stats",
+        "(user INTEGER, message_id INTEGER, meme_score INTEGER, time_sent INTEGER, meme_rating INTEGER, rating_count INTEGER, meme_reasoning TEXT)",
+        [
+            "user",
+            "message_id",
+            "meme_score",
+            "time_sent",
+            "meme_rating",
+            "rating_count",
+            "meme_reasoning",
+        ],
+        [
+            snowflake("user"),
+            snowflake("message_id"),
+            "meme_score",
+            _EPOCH_MS.format("time_sent"),
+            "meme_rating",
+            "rating_count",
+            "meme_reasoning",
+        ],
+        [
+            "CREATE INDEX IF NOT EXISTS meme_stats_message_idx ON meme_stats (message_id)",
+            "CREATE INDEX IF NOT EXISTS meme_stats_user_time_idx ON meme_stats (user, time_sent, meme_score)",
+            "CREATE INDEX IF NOT EXISTS meme_stats_time_idx ON meme_stats (time_sent, meme_score)",
+        ],
+    )
+    # Meme scores backfilled without a channel move from '' to channel 0.
+    for table in ("message_rollup_hourly", "message_rollup_daily"):
+        m.rebuild_table(
+            table,
+            "(bucket INTEGER, user INTEGER, channel INTEGER, count INTEGER, PRIMARY KEY (bucket, user, channel)) WITHOUT ROWID",
+            ["bucket", "user", "channel", "count"],
+            ["bucket", snowflake("user"), snowflake("channel"), "count"],
+        )
+    for table in ("emoji_rollup_hourly", "emoji_rollup_daily"):
+        m.rebuild_table(
+            table,
+            "(bucket INTEGER, user INTEGER, channel INTEGER, emoji TEXT, count INTEGER, PRIMARY KEY (bucket, user, channel, emoji)) WITHOUT ROWID",
+            ["bucket", "user", "channel", "emoji", "count"],
+            ["bucket", snowflake("user"), snowflake("channel"), "emoji", "count"],
+            [
+                f"CREATE INDEX IF NOT EXISTS {table}_emoji_idx ON {table} (emoji, bucket, count)"
+            ],
+        )
+    m.rebuild_table(
+        "meme_score_rollup_hourly",
+        "(bucket INTEGER, user INTEGER, channel INTEGER, score_sum INTEGER, count INTEGER, PRIMARY KEY (bucket, user, channel)) WITHOUT ROWID",
+        ["bucket", "user", "channel", "score_sum", "count"],
+        ["bucket", snowflake("user"), snowflake("channel"), "score_sum", "count"],
+        [
+            "CREATE INDEX IF NOT EXISTS meme_score_rollup_hourly_user_idx ON meme_score_rollup_hourly (user, bucket, score_sum, count)"
+        ],
+    )
+    m.execute("ANALYZE")
+
+
+def _guild_partitions(m: Migrator):
+    # Everything counted so far came from the one server the bot was run for,
+    # the first of DEFAULT_GUILDS.
+    legacy_guild = int(os.getenv("DEFAULT_GUILDS", "").split(",")[0].strip() or 0)
+    for table in ("message_counts", "message_deletes", "shit_meme_deletes"):
+        indexes = [
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_idx ON {table} (guild, user)"
+        ]
+        # Delete boards are read top down. The message board is in memory, so
+        # message_counts is spared the extra index on every message.
+        if table != "message_counts":
+            indexes.append(
+                f"CREATE INDEX IF NOT EXISTS {table}_count_idx ON {table} (guild, count)"
+            )
+        m.rebuild_table(
+            table,
+            "(guild INTEGER NOT NULL, user INTEGER, count INTEGER)",
+            ["guild", "user", "count"],
+            [str(legacy_guild), "user", "count"],
+            indexes,
+        )
+    m.rebuild_table(
+        "emoji_counts",
+        "(guild INTEGER NOT NULL, user INTEGER, emoji TEXT, count INTEGER)",
+        ["guild", "user", "emoji", "count"],
+        [str(legacy_guild), "user", "emoji", "count"],
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS emoji_counts_idx ON emoji_counts (guild, user, emoji)",
+            "CREATE INDEX IF NOT EXISTS emoji_counts_emoji_idx ON emoji_counts (guild, emoji, count)",
+        ],
+    )
+    # Rollups are keyed by channel, and each channel's guild is the one its
+    # images were posted in, or otherwise the legacy guild, as are the meme
+    # scores backfilled under channel 0.
+    m.execute("DROP TABLE IF EXISTS temp.kitty_channel_guilds")
+    m.execute("""
+        CREATE TEMP TABLE kitty_channel_guilds AS
+        SELECT channel_id, max(guild_id) AS guild_id
+        FROM image_hashes
+        WHERE channel_id IS NOT NULL AND guild_id IS NOT NULL
+        GROUP BY channel_id""")
+    guild = f"coalesce((SELECT guild_id FROM kitty_channel_guilds WHERE channel_id = channel), {legacy_guild})"
+    for table in ("message_rollup_hourly", "message_rollup_daily"):
+        m.rebuild_table(
+            table,
+            "(guild INTEGER NOT NULL, bucket INTEGER, user INTEGER, channel INTEGER, count INTEGER, PRIMARY KEY (guild, bucket, user, channel)) WITHOUT ROWID",
+            ["guild", "bucket", "user", "channel", "count"],
+            [guild, "bucket", "user", "channel", "count"],
+        )
+    for table in ("emoji_rollup_hourly", "emoji_rollup_daily"):
+        m.rebuild_table(
+            table,
+            "(guild INTEGER NOT NULL, bucket INTEGER, user INTEGER, channel INTEGER, emoji TEXT, count INTEGER, PRIMARY KEY (guild, bucket, user, channel, emoji)) WITHOUT ROWID",
+            ["guild", "bucket", "user", "channel", "emoji", "count"],
+            [guild, "bucket", "user", "channel", "emoji", "count"],
+            [
+                f"CREATE INDEX IF NOT EXISTS {table}_emoji_idx ON {table} (guild, emoji, bucket, count)"
+            ],
+        )
+    m.rebuild_table(
+        "meme_score_rollup_hourly",
+        "(guild INTEGER NOT NULL, bucket INTEGER, user INTEGER, channel INTEGER, score_sum INTEGER, count INTEGER, PRIMARY KEY (guild, bucket, user, channel)) WITHOUT ROWID",
+        ["guild", "bucket", "user", "channel", "score_sum", "count"],
+        [guild, "bucket", "user", "channel", "score_sum", "count"],
+        [
+            "CREATE INDEX IF NOT EXISTS meme_score_rollup_hourly_user_idx ON meme_score_rollup_hourly (guild, user, bucket, score_sum, count)"
+        ],
+    )
+    m.execute("DROP TABLE temp.kitty_channel_guilds")
+    m.execute("ANALYZE")
+
+
+def _backfill_checkpoints(m: Migrator):
+    # One row per channel being backfilled from history. Messages sent before
+    # `until` are counted, newest first; `oldest` is the last one counted, so
+    # a restarted backfill carries on from just before it.
+    m.create(
+        "backfill_channels",
+        """
+        CREATE TABLE IF NOT EXISTS backfill_channels (
+            channel INTEGER PRIMARY KEY,
+            guild INTEGER NOT NULL,
+            until INTEGER NOT NULL,
+            oldest INTEGER,
+            messages INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0
+        )""",
+    )
+
+
+def _emoji_rankings(m: Migrator):
+    # How many users have used each emoji exactly `count` times, so a rank is
+    # a sum over the distinct counts above it rather than a count of every
+    # user above it, and each emoji's total across the guild. Triggers keep
+    # both in step with every write to emoji_counts, in the same transaction.
+    # Rebuilding emoji_counts drops the triggers, so a later rebuild has to
+    # create them again.
+    m.create(
+        "emoji_count_histogram",
+        """
+        CREATE TABLE IF NOT EXISTS emoji_count_histogram (
+            guild INTEGER NOT NULL,
+            emoji TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (guild, emoji, count)
+        ) WITHOUT ROWID""",
+    )
+    m.create(
+        "emoji_totals",
+        """
+        CREATE TABLE IF NOT EXISTS emoji_totals (
+            guild INTEGER NOT NULL,
+            emoji TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (guild, emoji)
+        ) WITHOUT ROWID""",
+    )
+    m.create(
+        "emoji_totals",
+        "CREATE INDEX IF NOT EXISTS emoji_totals_count_idx ON emoji_totals (guild, count)",
+    )
+    m.execute("DELETE FROM emoji_count_histogram")
+    m.execute("""
+        INSERT INTO emoji_count_histogram (guild, emoji, count, users)
+        SELECT guild, emoji, coalesce(count, 0), count(*)
+        FROM emoji_counts
+        GROUP BY 1, 2, 3""")
+    m.execute("DELETE FROM emoji_totals")
+    m.execute("""
+        INSERT INTO emoji_totals (guild, emoji, count)
+        SELECT guild, emoji, coalesce(sum(count), 0)
+        FROM emoji_counts
+        GROUP BY 1, 2""")
+    add = """
+        INSERT INTO emoji_count_histogram (guild, emoji, count, users)
+        VALUES (NEW.guild, NEW.emoji, coalesce(NEW.count, 0), 1)
+        ON CONFLICT (guild, emoji, count) DO UPDATE SET users = users + 1;
+        INSERT INTO emoji_totals (guild, emoji, count)
+        VALUES (NEW.guild, NEW.emoji, coalesce(NEW.count, 0))
+        ON CONFLICT (guild, emoji) DO UPDATE SET count = count + excluded.count;"""
+    remove = """
+        UPDATE emoji_count_histogram SET users = users - 1
+        WHERE guild = OLD.guild AND emoji = OLD.emoji AND count = coalesce(OLD.count, 0);
+        DELETE FROM emoji_count_histogram
+        WHERE guild = OLD.guild AND emoji = OLD.emoji AND count = coalesce(OLD.count, 0) AND users <= 0;
+        UPDATE emoji_totals SET count = count - coalesce(OLD.count, 0)
+        WHERE guild = OLD.guild AND emoji = OLD.emoji;"""
+    m.create(
+        "emoji_counts",
+        f"CREATE TRIGGER IF NOT EXISTS emoji_counts_insert AFTER INSERT ON emoji_counts BEGIN {add} END",
+    )
+    m.create(
+        "emoji_counts",
+        f"CREATE TRIGGER IF NOT EXISTS emoji_counts_update AFTER UPDATE ON emoji_counts BEGIN {remove} {add} END",
+    )
+    m.create(
+        "emoji_counts",
+        f"CREATE TRIGGER IF NOT EXISTS emoji_counts_delete AFTER DELETE ON emoji_counts BEGIN {remove} END",
+    )
+
+
+def _binary_message_hashes(m: Migrator):
+    # Hashes were hex TEXT computed by an md5() SQL function. The 16 raw bytes
+    # halve the unique index and are what the bot now computes itself.
+    def unhex(value: Any) -> Any:
+        return bytes.fromhex(value) if isinstance(value, str) else value
+
+    m.conn.create_function("kitty_unhex", 1, unhex, deterministic=True)
+    m.rebuild_table(
+        "message_hashes",
+        "(user INTEGER, message_id INTEGER, message_hash BLOB, time_sent INTEGER)",
+        ["user", "message_id", "message_hash", "time_sent"],
+        ["user", "message_id", "kitty_unhex(message_hash)", "time_sent"],
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS message_hashes_idx ON message_hashes (message_hash)",
+            "CREATE INDEX IF NOT EXISTS message_hashes_message_idx ON message_hashes (message_id)",
+        ],
+    )
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "hot lookup indexes", _hot_lookup_indexes),
+    Migration(3, "rollups", _rollups),
+    Migration(4, "integer snowflakes", _integer_snowflakes),
+    Migration(5, "guild partitions", _guild_partitions),
+    Migration(6, "backfill checkpoints", _backfill_checkpoints),
+    Migration(7, "emoji rankings", _emoji_rankings),
+    Migration(8, "binary message hashes", _binary_message_hashes),
+]
@@ -0,0 +1,86 @@
+"""
+Records the gateway events behaviours handle, to replay them offline with
+`benchmarks.replay`.
+
+Recordings are gzipped JSON lines, each an array of the time the event was
+received (seconds since the epoch), its gateway event name and its raw
+payload as Discord sent it. Replayed events are then deserialised by hikari
+exactly as live ones were. Recording again to the same file appends to it.
+
+Events are encoded, compressed and written on a thread of their own, so
+recording adds no more than queueing the payload to the event loop. Each
+write takes every event queued since the last one.
+"""
+
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Iterator
+
+# Gateway events that reach a behaviour chain.
+EVENTS = frozenset(
+    {
+        "MESSAGE_CREATE",
+        "MESSAGE_UPDATE",
+        "MESSAGE_DELETE",
+        "MESSAGE_REACTION_ADD",
+        "MESSAGE_REACTION_REMOVE",
+    }
+)
+
+
+_Event = tuple[float, str, Any]
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded = 0
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._queue: "queue.SimpleQueue[_Event | None]" = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="kitty-recorder", daemon=True
+        )
+        self._thread.start()
+
+    def record(self, name: str, payload: Any):
+        """Queue the event if a chain handles it; others, and DMs, are ignored."""
+        if name not in EVENTS or "guild_id" not in payload:
+            return
+        self._queue.put((round(time.time(), 6), name, payload))
+        self.recorded += 1
+
+    def close(self):
+        """Write whatever is still queued and close the file. Blocks until done."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            events = [self._queue.get()]
+            while not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            if None in events:
+                stopping = True
+            lines = [
+                json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n"
+                for event in events
+                if event is not None
+            ]
+            try:
+                self._file.write("".join(lines))
+            except Exception as e:
+                logging.exception(f"Failed to record {len(lines)} events", exc_info=e)
+        self._file.close()
+
+
+def read(path: str) -> Iterator[tuple[float, str, dict[str, Any]]]:
+    """The events in a recording, in the order they were received."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            received_at, name, payload = json.loads(line)
+            yield received_at, name, payload
@@ -0,0 +1,164 @@
+"""
+Time-bucketed rollups of messages, emoji and meme scores.
+
+Each rollup table holds one row per (guild, bucket, user, channel[, emoji]),
+where bucket is the Unix time the hour or UTC day starts. Every read is for
+one guild, which leads each key so it is also a range of the table. Message and emoji rollups
+are fed by `commons.counters` in the same flush as the all-time counts. Meme
+scores are recorded by the meme rater in the same transaction as meme_stats.
+Range queries then read a few hundred pre-aggregated rows instead of every
+message.
+
+Buckets are keyed on when the message was sent, taken from its snowflake, so
+a reaction removed a week later still cancels the one that was added.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+import commons.db as db
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+def bucket(at: datetime, seconds: int) -> int:
+    """Start of the `seconds` long bucket holding `at`, in Unix time."""
+    timestamp = int(at.timestamp())
+    return timestamp - timestamp % seconds
+
+
+@dataclass(frozen=True)
+class Rollup:
+    table: str
+    keys: tuple[str, ...]
+    seconds: int
+
+    def bucket(self, at: datetime) -> int:
+        return bucket(at, self.seconds)
+
+    @property
+    def upsert(self) -> str:
+        """Add a positive count, given the bucket, each key and the count."""
+        columns = ", ".join(("bucket",) + self.keys)
+        placeholders = ", ".join("?" * (len(self.keys) + 2))
+        return f"""
+            INSERT INTO {self.table} ({columns}, count)
+            VALUES ({placeholders})
+            ON CONFLICT ({columns}) DO UPDATE
+            SET count = {self.table}.count + excluded.count"""
+
+    @property
+    def subtract(self) -> str:
+        """
+        Add a negative delta to an existing row, given the delta, the bucket
+        and each key. A missing row is left missing.
+        """
+        matches = " AND ".join(f"{key} = ?" for key in ("bucket",) + self.keys)
+        return f"""
+            UPDATE {self.table} SET count = max(count + ?, 0)
+            WHERE {matches}"""
+
+
+_MESSAGE_KEYS = ("guild", "user", "channel")
+_EMOJI_KEYS = ("guild", "user", "channel", "emoji")
+MESSAGES_HOURLY = Rollup("message_rollup_hourly", _MESSAGE_KEYS, HOUR)
+MESSAGES_DAILY = Rollup("message_rollup_daily", _MESSAGE_KEYS, DAY)
+EMOJI_HOURLY = Rollup("emoji_rollup_hourly", _EMOJI_KEYS, HOUR)
+EMOJI_DAILY = Rollup("emoji_rollup_daily", _EMOJI_KEYS, DAY)
+
+for _rollup in (MESSAGES_HOURLY, MESSAGES_DAILY, EMOJI_HOURLY, EMOJI_DAILY):
+    db.statement(f"rollups.{_rollup.table}", _rollup.upsert)
+    db.statement(f"rollups.{_rollup.table}.subtract", _rollup.subtract)
+
+_ADD_MEME_SCORE = db.statement(
+    "rollups.add_meme_score",
+    """
+    INSERT INTO meme_score_rollup_hourly (guild, bucket, user, channel, score_sum, count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (guild, bucket, user, channel) DO UPDATE
+    SET score_sum = score_sum + excluded.score_sum,
+        count = count + excluded.count""",
+)
+_MESSAGE_LEADERBOARD = db.statement(
+    "rollups.message_leaderboard",
+    """
+    SELECT user, sum(count) AS total
+    FROM message_rollup_daily
+    WHERE guild = ? AND bucket >= ?
+    GROUP BY user
+    ORDER BY total DESC
+    LIMIT ?""",
+)
+_EMOJI_TREND = db.statement(
+    "rollups.emoji_trend",
+    """
+    SELECT bucket, sum(count)
+    FROM emoji_rollup_daily
+    WHERE guild = ? AND emoji = ? AND bucket >= ?
+    GROUP BY bucket""",
+)
+_SERVER_MEME_SCORES = db.statement(
+    "rollups.server_meme_scores",
+    """
+    SELECT strftime('%Y-%m-%d', bucket + ?, 'unixepoch') AS day,
+           sum(score_sum) * 1.0 / sum(count)
+    FROM meme_score_rollup_hourly
+    WHERE guild = ? AND bucket >= ?
+    GROUP BY day
+    HAVING sum(count) > 0""",
+)
+_USER_MEME_SCORES = db.statement(
+    "rollups.user_meme_scores",
+    """
+    SELECT strftime('%Y-%m-%d', bucket + ?, 'unixepoch') AS day,
+           sum(score_sum) * 1.0 / sum(count)
+    FROM meme_score_rollup_hourly
+    WHERE guild = ? AND user = ? AND bucket >= ?
+    GROUP BY day
+    HAVING sum(count) > 0""",
+)
+
+
+def add_meme_score(
+    cursor: db.Cursor,
+    guild: int,
+    user: int,
+    channel: int,
+    at: datetime,
+    score_delta: int,
+    count_delta: int,
+):
+    """Record a rated meme, or a change to its score, inside a writer job."""
+    cursor.execute(
+        _ADD_MEME_SCORE,
+        (guild, bucket(at, HOUR), user, channel, score_delta, count_delta),
+    )
+
+
+async def message_leaderboard(
+    guild: int, since: datetime, limit: int
+) -> list[tuple[int, int]]:
+    """Users of `guild` with the most messages since the start of `since`'s UTC day."""
+    return await db.query(
+        _MESSAGE_LEADERBOARD, (guild, MESSAGES_DAILY.bucket(since), limit)
+    )
+
+
+async def emoji_trend(guild: int, emoji: str, since: datetime) -> list[tuple[int, int]]:
+    """Uses of `emoji` in `guild` per UTC day since `since`, as (day start, count)."""
+    return await db.query(_EMOJI_TREND, (guild, emoji, EMOJI_DAILY.bucket(since)))
+
+
+async def meme_scores_by_day(
+    guild: int, since: datetime, utcoffset_seconds: int, user: int | None = None
+) -> list[tuple[str, float]]:
+    """
+    Average meme score per local day since `since`, as ("YYYY-MM-DD", score),
+    for one user or the whole of `guild`. Days follow the local time zone, so
+    this reads the hourly rollup; with an offset that is not a whole number
+    of hours, each hour counts towards the day it starts in.
+    """
+    start = bucket(since, HOUR)
+    if user is None:
+        return await db.query(_SERVER_MEME_SCORES, (utcoffset_seconds, guild, start))
+    return await db.query(_USER_MEME_SCORES, (utcoffset_seconds, guild, user, start))
@@ -0,0 +1,263 @@
+"""
+Declarative routing for behaviour handlers.
+
+Handlers declare which events they can act on with `@route(...)`: the
+channels they watch, whether bot or webhook authors reach them, what a
+message must carry (content, attachments, embeds, a reference) and which
+reaction emoji they care about. `Dispatcher` compiles a chain once, at
+registration, into the groups that apply to each watched channel and to
+every other channel, with each handler's message requirements as bit masks.
+An event then costs one dict lookup and a mask test per handler, and only
+handlers that can act on it are called at all. Handlers marked `sheddable`
+are left out when the event queue is overloaded.
+
+A chain may also hold `Background` stages, which `Pipeline` splits out so
+slow handlers run beside the rest of the chain instead of ahead of it.
+
+Routes are only a first cut, so a handler may still return early on
+anything they cannot express.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, Coroutine, Generic, Iterator, Sequence, TypeVar
+import hikari
+
+_Evt = TypeVar("_Evt", bound=hikari.Event)
+_Handler = Callable[[_Evt], Coroutine[None, None, None]]
+_Chain = Sequence[Sequence[_Handler[_Evt]]]
+_F = TypeVar("_F", bound=Callable[..., Coroutine[None, None, None]])
+
+CONTENT = 1 << 0
+ATTACHMENTS = 1 << 1
+EMBEDS = 1 << 2
+REFERENCE = 1 << 3
+BOT = 1 << 4
+WEBHOOK = 1 << 5
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    `channels` names the environment variable holding the comma separated
+    ids of the only channels the handler acts in, read when the chain is
+    compiled. `emoji` limits reaction handlers to those emoji names.
+    `sheddable` handlers only add flavour and are skipped under load.
+    """
+
+    channels: str | None = None
+    bots: bool = True
+    webhooks: bool = True
+    content: bool = False
+    attachments: bool = False
+    embeds: bool = False
+    reference: bool = False
+    emoji: frozenset[str] | None = None
+    sheddable: bool = False
+
+    def channel_ids(self) -> frozenset[int] | None:
+        if self.channels is None:
+            return None
+        value = os.environ.get(self.channels, "")
+        return frozenset(int(id) for id in value.split(",") if id.strip())
+
+    def required(self) -> int:
+        return (
+            (CONTENT if self.content else 0)
+            | (ATTACHMENTS if self.attachments else 0)
+            | (EMBEDS if self.embeds else 0)
+            | (REFERENCE if self.reference else 0)
+        )
+
+    def forbidden(self) -> int:
+        return (0 if self.bots else BOT) | (0 if self.webhooks else WEBHOOK)
+
+
+_routes: dict[Callable[..., object], Route] = {}
+
+
+def route(
+    channels: str | None = None,
+    bots: bool = True,
+    webhooks: bool = True,
+    content: bool = False,
+    attachments: bool = False,
+    embeds: bool = False,
+    reference: bool = False,
+    emoji: Sequence[str] | None = None,
+    sheddable: bool = False,
+) -> Callable[[_F], _F]:
+    """Declare the events a handler can act on. Undeclared handlers get every event."""
+
+    def register(fn: _F) -> _F:
+        _routes[fn] = Route(
+            channels,
+            bots,
+            webhooks,
+            content,
+            attachments,
+            embeds,
+            reference,
+            frozenset(emoji) if emoji is not None else None,
+            sheddable,
+        )
+        return fn
+
+    return register
+
+
+def route_of(fn: Callable[..., object]) -> Route:
+    return _routes.get(fn, Route())
+
+
+def flags(event: hikari.Event) -> int:
+    """What the event's message carries and who sent it, as route bits."""
+    if isinstance(event, hikari.GuildReactionAddEvent):
+        return BOT if event.member.is_bot else 0
+    if not isinstance(
+        event, (hikari.GuildMessageCreateEvent, hikari.GuildMessageUpdateEvent)
+    ):
+        return 0
+    message = event.message
+    # Fields an update left out are UNDEFINED, which is falsy.
+    bits = (
+        (CONTENT if message.content else 0)
+        | (ATTACHMENTS if message.attachments else 0)
+        | (EMBEDS if message.embeds else 0)
+        | (REFERENCE if message.message_reference else 0)
+    )
+    if isinstance(event, hikari.GuildMessageCreateEvent):
+        bits |= (BOT if event.is_bot else 0) | (WEBHOOK if event.is_webhook else 0)
+    return bits
+
+
+@dataclass(frozen=True)
+class _Compiled(Generic[_Evt]):
+    handler: _Handler[_Evt]
+    required: int
+    forbidden: int
+    emoji: frozenset[str] | None
+    sheddable: bool
+
+
+class Dispatcher(Generic[_Evt]):
+    """
+    A chain compiled against its handlers' routes. Each handler is called
+    through `wrap`, if given, such as to time it.
+    """
+
+    def __init__(
+        self,
+        chain: _Chain[_Evt],
+        wrap: Callable[[_Handler[_Evt]], _Handler[_Evt]] | None = None,
+    ):
+        self._wrap = wrap
+        routes = [[(fn, route_of(fn)) for fn in group] for group in chain]
+        channels = {
+            channel
+            for group in routes
+            for _, r in group
+            for channel in r.channel_ids() or ()
+        }
+        self._by_channel = {
+            channel: self._compile(routes, channel) for channel in channels
+        }
+        self._elsewhere = self._compile(routes, None)
+
+    def _compile(
+        self, routes: list[list[tuple[_Handler[_Evt], Route]]], channel: int | None
+    ) -> list[list[_Compiled[_Evt]]]:
+        groups: list[list[_Compiled[_Evt]]] = []
+        for group in routes:
+            compiled: list[_Compiled[_Evt]] = []
+            for fn, r in group:
+                ids = r.channel_ids()
+                if ids is not None and channel not in ids:
+                    continue
+                handler = self._wrap(fn) if self._wrap else fn
+                compiled.append(
+                    _Compiled(
+                        handler, r.required(), r.forbidden(), r.emoji, r.sheddable
+                    )
+                )
+            if compiled:
+                groups.append(compiled)
+        return groups
+
+    def groups(self, event: _Evt, shed: bool = False) -> Iterator[list[_Handler[_Evt]]]:
+        """
+        The handlers that can act on `event`, group by group, leaving out
+        sheddable ones if `shed`.
+        """
+        channel: int | None = getattr(event, "channel_id", None)
+        compiled = self._by_channel.get(channel or 0, self._elsewhere)
+        bits = flags(event)
+        emoji: str | None = getattr(event, "emoji_name", None)
+        for group in compiled:
+            handlers = [
+                c.handler
+                for c in group
+                if bits & c.required == c.required
+                and not bits & c.forbidden
+                and (c.emoji is None or emoji in c.emoji)
+                and not (shed and c.sheddable)
+            ]
+            if handlers:
+                yield handlers
+
+    def acts_on(self, event: _Evt, shed: bool = False) -> bool:
+        return next(self.groups(event, shed), None) is not None
+
+
+@dataclass(frozen=True)
+class Background(Generic[_Evt]):
+    """
+    Groups detached from the rest of their chain. They start once the groups
+    before them have finished and run on their own, while the groups after
+    them go ahead without waiting. EndProcessing raised in them ends only
+    them, and EndProcessing raised before them means they never start.
+    """
+
+    name: str
+    chain: _Chain[_Evt]
+
+
+_Stages = Sequence[Sequence[_Handler[_Evt]] | Background[_Evt]]
+
+
+@dataclass(frozen=True)
+class Segment(Generic[_Evt]):
+    """Groups run in turn, then the background stages that follow them."""
+
+    dispatcher: Dispatcher[_Evt]
+    background: list[tuple[str, Dispatcher[_Evt]]]
+
+
+class Pipeline(Generic[_Evt]):
+    """A chain compiled into the segments between its background stages."""
+
+    def __init__(
+        self,
+        chain: _Stages[_Evt],
+        wrap: Callable[[_Handler[_Evt]], _Handler[_Evt]] | None = None,
+    ):
+        self.segments: list[Segment[_Evt]] = []
+        groups: list[Sequence[_Handler[_Evt]]] = []
+        background: list[tuple[str, Dispatcher[_Evt]]] = []
+        for step in chain:
+            if isinstance(step, Background):
+                background.append((step.name, Dispatcher(step.chain, wrap)))
+                continue
+            if background:
+                self.segments.append(Segment(Dispatcher(groups, wrap), background))
+                groups, background = [], []
+            groups.append(step)
+        self.segments.append(Segment(Dispatcher(groups, wrap), background))
+
+    def acts_on(self, event: _Evt, shed: bool = False) -> bool:
+        """Whether any handler, in the chain or a background stage, can act on `event`."""
+        return any(
+            segment.dispatcher.acts_on(event, shed)
+            or any(d.acts_on(event, shed) for _, d in segment.background)
+            for segment in self.segments
+        )
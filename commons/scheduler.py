@@ -7,6 +7,7 @@ import typing
 import asyncio
 import hikari
 import commons.db as db
+from commons import metrics
 
 
 class _ActionName(StrEnum):
@@ -20,6 +21,8 @@ class _Arguments:
 
 
 _discord_bot: hikari.RESTAware | None = None
+_periodic: set[asyncio.Task[None]] = set()
+_delayed: set[asyncio.Task[None]] = set()
 
 
 async def start(bot: hikari.RESTAware):
@@ -51,29 +54,83 @@ async def start(bot: hikari.RESTAware):
             logging.exception("An exception occurred", exc_info=e)
 
 
+def every(seconds: float, job: typing.Callable[[], typing.Awaitable[None]], name: str):
+    """
+    Run `job` every `seconds` in the background, the first time `seconds`
+    from now. A run that fails is logged and the next one goes ahead.
+    """
+
+    async def loop():
+        while True:
+            await asyncio.sleep(seconds)
+            started_at = asyncio.get_running_loop().time()
+            try:
+                await job()
+            except Exception as e:
+                logging.exception(f"Periodic job {name} failed", exc_info=e)
+            metrics.histogram(f"scheduler.{name}").record(
+                asyncio.get_running_loop().time() - started_at
+            )
+
+    task = asyncio.get_running_loop().create_task(loop(), name=name)
+    _periodic.add(task)
+    task.add_done_callback(_periodic.discard)
+
+
+def stop():
+    """Cancel every periodic job."""
+    for task in list(_periodic):
+        task.cancel()
+
+
 async def delay_delete(
     channel: hikari.Snowflake, message: hikari.Snowflake, seconds: int
 ):
+    """
+    Delete the message `seconds` from now. Returns as soon as the deletion
+    is recorded, long before it happens.
+    """
     arguments = _Arguments(channel_id=str(channel), message_id=str(message))
     await _delay_action(_ActionName.DELETE_MESSAGE, arguments, seconds)
 
 
 async def _delay_action(action: _ActionName, arguments: _Arguments, seconds: int):
     at = int((datetime.now(timezone.utc) + timedelta(seconds=seconds)).timestamp())
-    c = db.cursor()
-    c.execute(
-        "insert into scheduled_actions values (?, ?, ?)",
-        (at, action, json.dumps(asdict(arguments))),
+    rowid = await db.submit(
+        lambda c: typing.cast(
+            int,
+            c.execute(
+                "insert into scheduled_actions values (?, ?, ?)",
+                (at, action, json.dumps(asdict(arguments))),
+            ).lastrowid,
+        ),
+        "scheduler.delay_action",
+    )
+    # The action is recorded, so the caller need not wait for it; events
+    # in its channel would queue behind it.
+    task = asyncio.get_running_loop().create_task(
+        _do_later(rowid, action, arguments, seconds)
     )
-    rowid = typing.cast(int, c.lastrowid)
-    db.commit()
+    _delayed.add(task)
+    task.add_done_callback(_delayed.discard)
+
+
+async def _do_later(
+    rowid: int, action: _ActionName, arguments: _Arguments, seconds: int
+):
     await asyncio.sleep(seconds)
-    await _do_action(rowid, action, arguments)
+    try:
+        await _do_action(rowid, action, arguments)
+    except Exception as e:
+        logging.exception("An exception occurred", exc_info=e)
 
 
 async def _do_action(rowid: int, action: _ActionName | str, arguments: _Arguments):
-    db.cursor().execute("delete from scheduled_actions where rowid = ?", (rowid,))
-    db.commit()
+    await db.execute(
+        "delete from scheduled_actions where rowid = ?",
+        (rowid,),
+        label="scheduler.do_action",
+    )
     if _discord_bot is None:
         raise ValueError("Bot instance not set")
     if action == _ActionName.DELETE_MESSAGE:
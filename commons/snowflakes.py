@@ -0,0 +1,35 @@
+"""
+Conversions between Discord snowflakes, datetimes and the INTEGER columns
+they are stored in.
+
+Ids (users, messages, channels, guilds) are stored as INTEGER snowflakes and
+times as INTEGER milliseconds since the Unix epoch. Bind `hikari.Snowflake`s
+or ints and `epoch_ms(...)` in queries, never `str(...)` or a datetime, which
+sqlite3 would store as text.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+DISCORD_EPOCH_MS = 1420070400000
+
+_UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def epoch_ms(at: datetime) -> int:
+    """`at` in whole milliseconds since the Unix epoch. Naive times are local."""
+    return (at.astimezone(timezone.utc) - _UNIX_EPOCH) // _MILLISECOND
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    return _UNIX_EPOCH + ms * _MILLISECOND
+
+
+def created_at(snowflake: int) -> datetime:
+    """When the snowflake was created."""
+    return from_epoch_ms((snowflake >> 22) + DISCORD_EPOCH_MS)
+
+
+def first_at(at: datetime) -> int:
+    """The smallest snowflake that can be created at `at`, for ranges of ids."""
+    return (epoch_ms(at) - DISCORD_EPOCH_MS) << 22
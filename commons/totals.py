@@ -0,0 +1,40 @@
+"""
+Running per-server totals.
+
+Seeded once from the database at startup and incremented as events are
+counted, so reading a total is O(1) instead of a sum over every row.
+"""
+
+import commons.db as db
+
+
+class RunningTotal:
+    def __init__(self, value: int = 0):
+        self.value = value
+
+    def add(self, delta: int = 1) -> int:
+        self.value += delta
+        return self.value
+
+
+_messages = {
+    guild: RunningTotal(total)
+    for guild, total in db.cursor().execute(
+        "SELECT guild, sum(count) FROM message_counts GROUP BY guild"
+    )
+}
+
+
+def _messages_in(guild: int) -> RunningTotal:
+    if guild not in _messages:
+        _messages[guild] = RunningTotal()
+    return _messages[guild]
+
+
+def add_message(guild: int, delta: int = 1) -> int:
+    """Count `delta` messages and return the new server total."""
+    return _messages_in(guild).add(delta)
+
+
+def messages(guild: int) -> int:
+    return _messages_in(guild).value
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# commons.db opens KITTY_DB as soon as it is imported, so point it somewhere
+# disposable before any test module gets the chance.
+os.environ["KITTY_DB"] = os.path.join(tempfile.mkdtemp(), "persist.sqlite")
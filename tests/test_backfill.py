@@ -0,0 +1,106 @@
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, AsyncIterator
+import commons.db as db
+from commons import backfill, counters, snowflakes
+
+GUILD = 9
+
+
+def message(channel: int, user: int, at: datetime) -> Any:
+    return SimpleNamespace(
+        id=snowflakes.first_at(at) + user,
+        channel_id=channel,
+        author=SimpleNamespace(id=user),
+        timestamp=at,
+    )
+
+
+def count(deltas: counters.Deltas, guild: int, message: Any) -> bool:
+    deltas.add_message(guild, message.author.id, message.channel_id, message.timestamp)
+    return True
+
+
+class FakeRest:
+    """Serves history newest first, like the REST API, optionally failing part way."""
+
+    def __init__(self, history: dict[int, list[Any]], fail_after: int | None = None):
+        self.history = history
+        self.fail_after = fail_after
+
+    async def fetch_messages(self, channel: int, before: int) -> AsyncIterator[Any]:
+        older = [m for m in self.history[channel] if m.id < before]
+        for served, m in enumerate(sorted(older, key=lambda m: -m.id)):
+            if served == self.fail_after:
+                raise RuntimeError("connection lost")
+            yield m
+
+
+class TestBackfill(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.batch = backfill._BACKFILL_BATCH  # type: ignore
+        backfill._BACKFILL_BATCH = 2  # type: ignore
+
+    async def asyncTearDown(self):
+        backfill._BACKFILL_BATCH = self.batch  # type: ignore
+        await db.execute("delete from backfill_channels where guild = ?", (GUILD,))
+        await db.execute("delete from message_counts where guild = ?", (GUILD,))
+
+    async def test_resumes_without_counting_twice(self):
+        """Test that a backfill interrupted part way carries on from its checkpoint"""
+        history = {
+            channel: [
+                message(channel, user, datetime(2024, 1, day, tzinfo=timezone.utc))
+                for day in range(1, 6)
+                for user in (1, 2)
+            ]
+            for channel in (100, 101)
+        }
+        # Sent after live counting began, so already counted.
+        history[100].append(message(100, 1, datetime(2024, 3, 1, tzinfo=timezone.utc)))
+        until = datetime(2024, 2, 1, tzinfo=timezone.utc)
+        rest: Any = FakeRest(history, fail_after=5)
+        result = await backfill.backfill(rest, GUILD, count, until, [100, 101])
+        self.assertEqual((result.channels, result.done), (2, 0))
+        self.assertEqual(result.messages, 8)
+
+        rest.fail_after = None
+        result = await backfill.backfill(rest, GUILD, count, until, [])
+        self.assertTrue(result.finished)
+        self.assertEqual(result.messages, 20)
+        rows = await db.query(
+            "select user, count from message_counts where guild = ? order by user",
+            (GUILD,),
+        )
+        self.assertEqual(rows, [(1, 10), (2, 10)])
+
+        # Finished channels are not backfilled again.
+        result = await backfill.backfill(rest, GUILD, count, until, [100, 101])
+        self.assertEqual(result.messages, 20)
+
+    async def test_keeps_the_guilds_boundary(self):
+        """Test that channels added later are backfilled up to the first until"""
+        history = {
+            channel: [
+                message(channel, 1, datetime(2024, month, 1, tzinfo=timezone.utc))
+                for month in (1, 3)
+            ]
+            for channel in (100, 101)
+        }
+        rest: Any = FakeRest(history)
+        with self.assertRaises(ValueError):
+            await backfill.backfill(rest, GUILD, count, None, [100])
+        until = datetime(2024, 2, 1, tzinfo=timezone.utc)
+        await backfill.backfill(rest, GUILD, count, until, [100])
+        self.assertEqual(await backfill.boundary(GUILD), until)
+
+        with self.assertRaises(ValueError):
+            later = datetime(2024, 4, 1, tzinfo=timezone.utc)
+            await backfill.backfill(rest, GUILD, count, later, [101])
+        result = await backfill.backfill(rest, GUILD, count, None, [101])
+        self.assertEqual((result.channels, result.messages), (2, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
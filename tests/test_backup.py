@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import commons.db as db
+from commons import backup
+
+
+class TestBackup(unittest.IsolatedAsyncioTestCase):
+    async def test_snapshot(self):
+        """Test that a snapshot is a complete standalone copy and old ones are pruned"""
+        await db.execute("insert into options values ('backup_test', 'before')")
+        directory = tempfile.mkdtemp()
+        first = await backup.snapshot(directory, keep=1)
+        self.assertGreater(first.pages, 0)
+        self.assertEqual(first.bytes, os.path.getsize(first.path))
+
+        copy = sqlite3.connect(first.path)
+        rows = copy.execute(
+            "select value from options where name = 'backup_test'"
+        ).fetchall()
+        self.assertEqual(rows, [("before",)])
+        self.assertEqual(copy.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        copy.close()
+
+        second = await backup.snapshot(directory, keep=1)
+        self.assertEqual(os.listdir(directory), [os.path.basename(second.path)])
+        self.assertIs(backup.last(), second)
+        await db.execute("delete from options where name = 'backup_test'")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from benchmarks import generate, run
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate_and_run(self):
+        """Test that a small generated dataset has the requested shape and every registered path gets timed"""
+        path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+        scale = generate.Scale(guilds=2, users=50, emoji=40, emoji_rows=500, memes=100)
+        written = generate.generate(path, scale)
+        self.assertEqual(written["message_counts"], 50)
+        self.assertEqual(written["meme_stats"], 100)
+        self.assertGreater(written["emoji_counts"], 200)
+        conn = sqlite3.connect(path)
+        guilds = conn.execute(
+            "select count(distinct guild) from message_counts"
+        ).fetchone()[0]
+        conn.close()
+        self.assertEqual(guilds, 2)
+        with self.assertRaises(FileExistsError):
+            generate.generate(path, scale)
+
+        report = run.run(path, repeat=5)
+        self.assertEqual(report["database"]["rows"]["message_counts"], 50)
+        for case in run.CASES:
+            self.assertTrue(
+                case.name in report["results"] or case.name in report["not_run"],
+                case.name,
+            )
+        for result in report["results"].values():
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertLessEqual(result["p99_ms"], result["max_ms"])
+        self.assertEqual(len(run.compare(report, report)), len(report["results"]) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
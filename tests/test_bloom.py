@@ -0,0 +1,28 @@
+import hashlib
+import unittest
+from commons.bloom import BloomFilter
+
+
+def digest(i: int) -> bytes:
+    return hashlib.md5(str(i).encode()).digest()
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        """Test that every added digest is found"""
+        bloom = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(digest(i))
+        self.assertTrue(all(digest(i) in bloom for i in range(1000)))
+
+    def test_false_positive_rate(self):
+        """Test that a filter at capacity is wrong about as often as it was sized for"""
+        bloom = BloomFilter(10_000, error_rate=0.01)
+        for i in range(10_000):
+            bloom.add(digest(i))
+        false_positives = sum(digest(i) in bloom for i in range(10_000, 30_000))
+        self.assertLess(false_positives / 20_000, 0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from datetime import datetime, timezone
+import commons.db as db
+from commons.counters import CounterAggregator
+
+
+class TestCounterAggregator(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.execute("delete from message_counts")
+        await db.execute("delete from emoji_counts")
+        await db.execute("delete from emoji_rollup_daily")
+        await db.execute("delete from emoji_rollup_hourly")
+        await db.execute("delete from message_deletes")
+
+    async def test_deltas_are_merged(self):
+        """Test that repeated events become one row update"""
+        aggregator = CounterAggregator(60, 1000)
+        for _ in range(5):
+            aggregator.add_user_count("message_counts", 1, 1)
+        aggregator.add_emoji_count(1, 1, "🐱", 2)
+        aggregator.add_emoji_count(1, 1, "🐱", -1)
+        self.assertEqual(aggregator.pending(), 7)
+        await aggregator.flush()
+        self.assertEqual(aggregator.pending(), 0)
+        rows = await db.query("select user, count from message_counts")
+        self.assertEqual(rows, [(1, 5)])
+        rows = await db.query("select emoji, count from emoji_counts")
+        self.assertEqual(rows, [("🐱", 1)])
+
+    async def test_flushes_after_event_limit(self):
+        """Test that reaching the event limit triggers a flush"""
+        aggregator = CounterAggregator(60, 3)
+        for _ in range(3):
+            aggregator.add_user_count("message_counts", 1, 2)
+        await aggregator.flushed()
+        rows = await db.query("select count from message_counts where user = 2")
+        self.assertEqual(rows, [(3,)])
+
+    async def test_flushes_after_interval(self):
+        """Test that pending deltas are written once the interval passes"""
+        aggregator = CounterAggregator(0.01, 1000)
+        aggregator.add_user_count("message_counts", 1, 3)
+        await aggregator.flushed()
+        rows = await db.query("select count from message_counts where user = 3")
+        self.assertEqual(rows, [(1,)])
+
+    async def test_counts_do_not_go_negative(self):
+        """Test that removing more than was counted stops at zero, and never adds a row"""
+        aggregator = CounterAggregator(60, 1000)
+        at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        aggregator.add_emoji(1, 4, "🐱", 7, at, -2)
+        aggregator.add_user_count("message_deletes", 1, 4, -1)
+        await aggregator.flush()
+        rows = await db.query("select count from emoji_counts where user = 4")
+        self.assertEqual(rows, [])
+        rows = await db.query("select count from emoji_rollup_daily where user = 4")
+        self.assertEqual(rows, [])
+        rows = await db.query("select count from message_deletes where user = 4")
+        self.assertEqual(rows, [])
+
+        aggregator.add_emoji(1, 4, "🐱", 7, at)
+        await aggregator.flush()
+        aggregator.add_emoji(1, 4, "🐱", 7, at, -2)
+        await aggregator.flush()
+        rows = await db.query("select count from emoji_counts where user = 4")
+        self.assertEqual(rows, [(0,)])
+        rows = await db.query("select count from emoji_rollup_daily where user = 4")
+        self.assertEqual(rows, [(0,)])
+
+    async def test_guilds_are_kept_apart(self):
+        """Test that the same user is counted separately in each guild"""
+        aggregator = CounterAggregator(60, 1000)
+        aggregator.add_user_count("message_counts", 1, 5)
+        aggregator.add_user_count("message_counts", 2, 5)
+        aggregator.add_user_count("message_counts", 2, 5)
+        aggregator.add_emoji_count(2, 5, "🐱")
+        await aggregator.flush()
+        rows = await db.query(
+            "select guild, count from message_counts where user = 5 order by guild"
+        )
+        self.assertEqual(rows, [(1, 1), (2, 2)])
+        rows = await db.query("select guild from emoji_counts where user = 5")
+        self.assertEqual(rows, [(2,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
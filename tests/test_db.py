@@ -0,0 +1,193 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from typing import Any, Callable
+import commons.db as db
+from commons import migrations
+
+
+class TestWriter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.execute("delete from message_counts")
+
+    async def test_execute_commits(self):
+        """Test that writes are visible to the main connection once awaited"""
+        await db.execute(
+            "insert into message_counts values (?, ?, ?)", (1, 1, 5), label="test"
+        )
+        row = db.cursor().execute("select count from message_counts").fetchone()
+        self.assertEqual(row[0], 5)
+
+    async def test_submit_returns_result(self):
+        """Test that the value returned on the writer thread is passed back"""
+
+        def insert(c: db.Cursor) -> int | None:
+            return c.execute("insert into message_counts values (1, 2, 1)").lastrowid
+
+        rowid = await db.submit(insert, "test")
+        self.assertIsInstance(rowid, int)
+
+    async def test_failed_job_rolls_back(self):
+        """Test that an exception rolls back the whole job and is re-raised"""
+
+        def insert_then_fail(c: db.Cursor):
+            c.execute("insert into message_counts values (1, 3, 1)")
+            c.execute("insert into message_counts values (1, 3, 1)")
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            await db.submit(insert_then_fail, "test")
+        row = db.cursor().execute("select count(*) from message_counts").fetchone()
+        self.assertEqual(row[0], 0)
+
+    async def test_stats(self):
+        """Test that the writer records latency per label"""
+        await db.execute("select 1", label="test.stats")
+        await db.execute("select 1", label="test.stats")
+        stats = db.writer_stats()
+        self.assertEqual(stats.jobs["test.stats"].count, 2)
+        self.assertEqual(stats.queue_depth, 0)
+
+    async def test_statement_timing(self):
+        """Test that registered statements are timed under their label"""
+        sql = db.statement("test.timed", "select count(*) from message_counts")
+        before = db.statement_stats().get("test.timed")
+        await db.query(sql)
+        db.cursor().execute(sql)
+        after = db.statement_stats()["test.timed"]
+        self.assertEqual(after.count - (before.count if before else 0), 2)
+
+
+class TestUnitOfWork(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.execute("delete from message_counts")
+
+    def insert(self, user: int) -> Callable[[db.Cursor], Any]:
+        def insert(c: db.Cursor):
+            c.execute("insert into message_counts values (1, ?, 1)", (user,))
+
+        return insert
+
+    async def test_commits_once_at_the_end(self):
+        """Test that writes deferred by concurrent tasks are committed together as the unit exits"""
+        before = db.writer_stats().jobs.get("test.unit")
+        async with db.unit_of_work("test.unit"):
+            await asyncio.gather(
+                db.defer(self.insert(1), "test"), db.defer(self.insert(2), "test")
+            )
+            row = db.cursor().execute("select count(*) from message_counts").fetchone()
+            self.assertEqual(row[0], 0)
+        row = db.cursor().execute("select count(*) from message_counts").fetchone()
+        self.assertEqual(row[0], 2)
+        after = db.writer_stats().jobs["test.unit"]
+        self.assertEqual(after.count - (before.count if before else 0), 1)
+
+    async def test_failed_write_rolls_back_alone(self):
+        """Test that a failing deferred write does not lose the others"""
+        async with db.unit_of_work("test.unit"):
+            await db.defer(self.insert(1), "test")
+            await db.defer(self.insert(1), "test")
+            await db.defer(self.insert(2), "test")
+        rows = db.cursor().execute("select user from message_counts order by user")
+        self.assertEqual(rows.fetchall(), [(1,), (2,)])
+
+    async def test_defer_without_unit_writes_now(self):
+        """Test that deferring outside a unit of work commits straight away"""
+        await db.defer(self.insert(1), "test")
+        row = db.cursor().execute("select count(*) from message_counts").fetchone()
+        self.assertEqual(row[0], 1)
+
+
+class TestSubsystems(unittest.TestCase):
+    def test_relocate(self):
+        """Test that a subsystem's tables move to its file with their rows, indexes and triggers"""
+        directory = tempfile.mkdtemp()
+        conn = sqlite3.connect(os.path.join(directory, "main.sqlite"))
+        migrations.migrate(conn, migrations.MIGRATIONS)
+        conn.execute("insert into emoji_counts values (1, 2, 'a', 3)")
+        conn.execute("insert into options values ('stays', 'here')")
+        conn.commit()
+        counters = os.path.join(directory, "counters.sqlite")
+        conn.execute("attach database ? as counters", (counters,))
+        db._relocate(conn, {"counters": counters})  # type: ignore
+
+        rows = conn.execute(
+            "select name from main.sqlite_master where name like 'emoji%'"
+        )
+        self.assertEqual(rows.fetchall(), [])
+        conn.execute("update emoji_counts set count = 5")
+        conn.commit()
+        rows = conn.execute("select emoji, count from counters.emoji_totals")
+        self.assertEqual(rows.fetchall(), [("a", 5)])
+        rows = conn.execute("select value from main.options where name = 'stays'")
+        self.assertEqual(rows.fetchall(), [("here",)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute("insert into emoji_counts values (1, 2, 'a', 1)")
+        conn.close()
+
+    def test_migrate_relocated(self):
+        """Test that migrations change relocated tables in their file, not main"""
+        directory = tempfile.mkdtemp()
+        conn = sqlite3.connect(os.path.join(directory, "main.sqlite"))
+        migrations.migrate(conn, migrations.MIGRATIONS[:4])
+        conn.execute("insert into emoji_counts values (2, 'a', 3)")
+        conn.commit()
+        counters = os.path.join(directory, "counters.sqlite")
+        conn.execute("attach database ? as counters", (counters,))
+        db._relocate(conn, {"counters": counters})  # type: ignore
+
+        def resolve(table: str) -> str:
+            return "counters" if table in db.SUBSYSTEMS["counters"] else "main"
+
+        migrations.migrate(conn, migrations.MIGRATIONS, resolve)
+        rows = conn.execute(
+            "select name from main.sqlite_master where tbl_name in (%s)"
+            % ", ".join("?" * len(db.SUBSYSTEMS["counters"])),
+            db.SUBSYSTEMS["counters"],
+        )
+        self.assertEqual(rows.fetchall(), [])
+        rows = conn.execute(
+            "select name from counters.sqlite_master where type = 'trigger' order by name"
+        )
+        self.assertEqual(
+            rows.fetchall(),
+            [
+                ("emoji_counts_delete",),
+                ("emoji_counts_insert",),
+                ("emoji_counts_update",),
+            ],
+        )
+        conn.execute("update emoji_counts set count = 5")
+        conn.commit()
+        rows = conn.execute("select emoji, count from counters.emoji_totals")
+        self.assertEqual(rows.fetchall(), [("a", 5)])
+        conn.close()
+
+
+class TestReadPool(unittest.IsolatedAsyncioTestCase):
+    async def test_query_sees_committed_writes(self):
+        """Test that pooled readers see what the writer committed"""
+        await db.execute("delete from message_deletes")
+        await db.execute("insert into message_deletes values (1, 1, 3)")
+        rows = await db.query("select user, count from message_deletes")
+        self.assertEqual(rows, [(1, 3)])
+
+    async def test_readers_are_read_only(self):
+        """Test that pooled connections refuse writes"""
+        with self.assertRaises(sqlite3.OperationalError):
+            await db.query("insert into message_deletes values (1, 2, 1)")
+
+    async def test_functions_are_available(self):
+        """Test that functions registered after startup reach the pool"""
+
+        def double(v: int) -> int:
+            return v * 2
+
+        db.create_function("test_double", 1, double)
+        rows = await db.query("select test_double(21)")
+        self.assertEqual(rows, [(42,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
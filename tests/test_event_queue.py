@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import unittest
+from commons.event_queue import EventQueue
+
+
+class TestEventQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await self.queue.close()
+
+    async def test_channel_order(self):
+        """Test that a channel's events run one at a time, in order, beside other channels"""
+        self.queue = EventQueue("test_events", workers=4, capacity=100, shed_at=100)
+        ran: list[tuple[int, int]] = []
+        running: set[int] = set()
+
+        def runner(channel: int, n: int):
+            async def run(shed: bool):
+                self.assertNotIn(channel, running)
+                running.add(channel)
+                await asyncio.sleep(0.001 * (3 - n))
+                ran.append((channel, n))
+                running.discard(channel)
+
+            return run
+
+        for n in range(3):
+            for channel in (1, 2):
+                await self.queue.submit(channel, runner(channel, n))
+        while self.queue.stats().processed < 6:
+            await asyncio.sleep(0.001)
+        for channel in (1, 2):
+            self.assertEqual([n for c, n in ran if c == channel], [0, 1, 2])
+
+    async def test_shed_and_drop(self):
+        """Test that a backlog sheds, then drops droppable events while full"""
+        self.queue = EventQueue("test_events", workers=1, capacity=3, shed_at=1)
+        release = asyncio.Event()
+        sheds: list[bool] = []
+
+        async def run(shed: bool):
+            sheds.append(shed)
+            await release.wait()
+
+        for channel in range(3):
+            self.assertTrue(await self.queue.submit(channel, run))
+        await asyncio.sleep(0)
+        self.assertFalse(await self.queue.submit(3, run, droppable=True))
+        self.assertEqual(self.queue.stats().dropped, 1)
+
+        # An event that is not droppable waits for room instead, and a
+        # critical one does even if it was marked droppable.
+        waiting = asyncio.create_task(self.queue.submit(4, run))
+        critical = asyncio.create_task(
+            self.queue.submit(5, run, droppable=True, critical=True)
+        )
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done() or critical.done())
+        release.set()
+        self.assertTrue(await waiting)
+        self.assertTrue(await critical)
+        while self.queue.stats().processed < 5:
+            await asyncio.sleep(0.001)
+        self.assertEqual(self.queue.stats().dropped, 1)
+        # Two were waiting behind the first, one behind the second and the
+        # fourth, but the critical one behind it was not shed.
+        self.assertEqual(sheds, [True, True, False, True, False])
+        self.assertEqual(self.queue.stats().shed, 3)
+
+    async def test_critical_never_shed(self):
+        """Test that critical events run in full however deep the backlog"""
+        self.queue = EventQueue("test_events", workers=1, capacity=10, shed_at=1)
+        release = asyncio.Event()
+        sheds: list[bool] = []
+
+        async def run(shed: bool):
+            sheds.append(shed)
+            await release.wait()
+
+        for channel in range(3):
+            await self.queue.submit(channel, run, critical=channel > 0)
+        await self.queue.submit(3, run)
+        await self.queue.submit(4, run)
+        release.set()
+        while self.queue.stats().processed < 5:
+            await asyncio.sleep(0.001)
+        # The backlog was deep enough to shed each but the last.
+        self.assertEqual(sheds, [True, False, False, True, False])
+        self.assertEqual(self.queue.stats().shed, 2)
+
+    async def test_runs_outside_submitters_context(self):
+        """Test that events do not see the context of whoever started the workers"""
+        self.queue = EventQueue("test_events", workers=1, capacity=10, shed_at=10)
+        scope = contextvars.ContextVar[str | None]("scope", default=None)
+        seen: list[str | None] = []
+
+        async def run(shed: bool):
+            seen.append(scope.get())
+
+        token = scope.set("first event")
+        await self.queue.submit(1, run)
+        scope.reset(token)
+        await self.queue.submit(1, run)
+        while self.queue.stats().processed < 2:
+            await asyncio.sleep(0.001)
+        self.assertEqual(seen, [None, None])
+
+    async def test_close_drains(self):
+        """Test that closing finishes queued events, then takes no more"""
+        self.queue = EventQueue("test_events", workers=1, capacity=2, shed_at=10)
+        release = asyncio.Event()
+        ran: list[int] = []
+
+        def runner(n: int):
+            async def run(shed: bool):
+                await release.wait()
+                ran.append(n)
+
+            return run
+
+        for n in range(2):
+            await self.queue.submit(n, runner(n))
+        # Already waiting for a slot when the queue starts closing.
+        waiting = asyncio.create_task(self.queue.submit(2, runner(2)))
+        await asyncio.sleep(0)
+        closing = asyncio.create_task(self.queue.close(timeout=5))
+        await asyncio.sleep(0)
+        self.assertFalse(await self.queue.submit(3, runner(3)))
+        critical = asyncio.create_task(self.queue.submit(4, runner(4), critical=True))
+        release.set()
+        await closing
+        self.assertTrue(await waiting)
+        self.assertTrue(await critical)
+        self.assertEqual(sorted(ran), [0, 1, 2, 4])
+        # Closed for good, without starting the workers again.
+        self.assertFalse(await self.queue.submit(5, runner(5), critical=True))
+        self.assertEqual(self.queue.stats().dropped, 2)
+
+    async def test_close_wakes_waiting_listeners(self):
+        """Test that listeners still waiting for a slot give up once closed"""
+        self.queue = EventQueue("test_events", workers=1, capacity=1, shed_at=10)
+        stuck = asyncio.Event()
+
+        async def run(shed: bool):
+            await stuck.wait()
+
+        await self.queue.submit(1, run)
+        waiting = asyncio.create_task(self.queue.submit(2, run))
+        await asyncio.sleep(0)
+        await self.queue.close(timeout=0.01)
+        self.assertFalse(await waiting)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import commons.db as db
+from commons import export
+
+
+class TestExport(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.submit(
+            lambda c: c.executemany(
+                "insert into message_deletes values (?, ?, ?)",
+                [(7, user, user * 2) for user in range(1, 6)],
+            ),
+            "test.seed_deletes",
+        )
+
+    async def asyncTearDown(self):
+        await db.execute("delete from message_deletes where guild = 7")
+
+    def read_rows(self, directory: str, table: str) -> list[dict[str, str]]:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        rows: list[dict[str, str]] = []
+        for name in manifest["tables"][table]["files"]:
+            with gzip.open(os.path.join(directory, name), "rt", newline="") as f:
+                if manifest["format"] == "csv":
+                    rows += csv.DictReader(f)
+                else:
+                    rows += [json.loads(line) for line in f]
+        return rows
+
+    async def test_export_chunks(self):
+        """Test that both formats hold every row, split into chunks, with a manifest"""
+        expected = sorted(
+            (str(guild), str(user), str(count))
+            for guild, user, count in await db.query(
+                "select guild, user, count from message_deletes"
+            )
+        )
+        for format in export.FORMATS:
+            with self.subTest(format=format):
+                result = export.export_tables(
+                    db.path(),
+                    tempfile.mkdtemp(),
+                    format,
+                    ["message_deletes"],
+                    chunk_rows=2,
+                    attached=db.attached(),
+                )
+                self.assertEqual(result.rows, {"message_deletes": len(expected)})
+                self.assertEqual(len(result.files), (len(expected) + 1) // 2)
+                rows = self.read_rows(result.directory, "message_deletes")
+                self.assertEqual(
+                    sorted(
+                        (str(r["guild"]), str(r["user"]), str(r["count"])) for r in rows
+                    ),
+                    expected,
+                )
+                self.assertFalse(os.path.exists(result.directory + ".partial"))
+
+    async def test_export_all_tables(self):
+        """Test that the async export covers every statistics table"""
+        directory = tempfile.mkdtemp()
+        result = await export.export(
+            db.path(), directory=directory, attached=db.attached()
+        )
+        self.assertEqual(set(result.rows), set(export.TABLES))
+        self.assertEqual(os.listdir(directory), [os.path.basename(result.directory)])
+
+    def test_unknown_format(self):
+        """Test that an unknown format is refused before anything is written"""
+        directory = tempfile.mkdtemp()
+        with self.assertRaises(ValueError):
+            export.export_tables(
+                db.path(), directory, "parquet", attached=db.attached()
+            )
+        self.assertEqual(os.listdir(directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
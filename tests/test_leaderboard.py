@@ -0,0 +1,59 @@
+import random
+import unittest
+from commons.leaderboard import Leaderboard
+
+
+class TestLeaderboard(unittest.TestCase):
+    def test_rank_and_page(self):
+        """Test ranks and pages against the board's definition"""
+        board = Leaderboard([(1, 5), (2, 3), (3, 5), (4, 0)])
+        self.assertEqual(board.rank(1), 1)
+        self.assertEqual(board.rank(3), 1)
+        self.assertEqual(board.rank(2), 3)
+        self.assertEqual(board.rank(4), 4)
+        self.assertIsNone(board.rank(5))
+        self.assertEqual(board.page(0, 3), [(1, 5), (3, 5), (2, 3)])
+        self.assertEqual(board.page(1, 3), [(4, 0)])
+        self.assertEqual(board.page(2, 3), [])
+
+    def test_passing(self):
+        """Test that add reports who was passed"""
+        board = Leaderboard([(1, 2), (2, 1)])
+        self.assertEqual(board.add(2), None)
+        self.assertEqual(board.add(2), 1)
+        self.assertEqual(board.add(2), None)
+        self.assertEqual(board.add(3), None)
+        self.assertEqual(board.add(3, 3), 1)
+
+    def test_matches_sorting(self):
+        """Test that random updates agree with sorting every count"""
+        rng = random.Random(7)
+        board = Leaderboard()
+        counts: dict[int, int] = {}
+        for _ in range(3000):
+            user = rng.randrange(60)
+            delta = rng.choice([1, 1, 1, 5, 40])
+            before = counts.get(user, 0)
+            passed = board.add(user, delta)
+            counts[user] = before + delta
+            if passed is None:
+                self.assertFalse(
+                    any(
+                        before <= c < counts[user]
+                        for u, c in counts.items()
+                        if u != user
+                    )
+                )
+            else:
+                self.assertTrue(before <= counts[passed] < counts[user])
+        expected = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        pages = [row for n in range(7) for row in board.page(n)]
+        self.assertEqual(pages, expected)
+        for user, count in counts.items():
+            self.assertEqual(
+                board.rank(user), 1 + sum(c > count for c in counts.values())
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
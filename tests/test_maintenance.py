@@ -0,0 +1,76 @@
+import sqlite3
+import time
+import unittest
+import commons.db as db
+from commons import maintenance
+
+_DAY = 24 * 60 * 60
+
+
+class TestMaintenance(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.execute("delete from image_hashes")
+        await db.execute("delete from meme_stats")
+        now = time.time()
+        self.old = maintenance.cutoff_snowflake(400, now)
+        self.new = maintenance.cutoff_snowflake(1, now)
+        for message_id in (self.old, self.new):
+            await db.execute(
+                "insert into image_hashes values ('h', ?, 1, 1, 'c')",
+                (message_id,),
+            )
+            await db.execute(
+                "insert into meme_stats values (1, ?, 5, 0, 0, 0, 'because')",
+                (message_id,),
+            )
+
+    async def test_retention_archives_and_prunes(self):
+        """Test that old rows move to the archive and recent ones stay"""
+        pruned = await maintenance.apply_retention()
+        self.assertEqual(pruned["image_hashes"], 1)
+        self.assertEqual(pruned["meme_stats.meme_reasoning"], 1)
+        rows = await db.query("select message_id from image_hashes")
+        self.assertEqual(rows, [(self.new,)])
+        rows = await db.query(
+            "select message_id, meme_reasoning from meme_stats order by rowid"
+        )
+        self.assertEqual(rows, [(self.old, None), (self.new, "because")])
+
+        archive = sqlite3.connect(maintenance._ARCHIVE)  # type: ignore
+        rows = archive.execute("select message_id from image_hashes").fetchall()
+        self.assertEqual(rows, [(self.old,)])
+        rows = archive.execute(
+            "select meme_reasoning from meme_stats_meme_reasoning"
+        ).fetchall()
+        self.assertEqual(rows, [("because",)])
+        archive.close()
+
+        # A second pass has nothing left to do.
+        pruned = await maintenance.apply_retention()
+        self.assertEqual(pruned["image_hashes"], 0)
+
+    async def test_housekeeping(self):
+        """Test that vacuum, optimize and checkpoint run on the writer"""
+
+        async def auto_vacuum() -> int:
+            return await db.submit(
+                lambda c: c.execute("PRAGMA auto_vacuum").fetchone()[0], "test"
+            )
+
+        # Without the operator's say so the file is not rewritten.
+        self.assertEqual(await maintenance.vacuum(), 0)
+        self.assertEqual(await auto_vacuum(), 0)
+        maintenance._VACUUM_CONVERT = True  # type: ignore
+        try:
+            await maintenance.vacuum()
+        finally:
+            maintenance._VACUUM_CONVERT = False  # type: ignore
+        self.assertEqual(await auto_vacuum(), 2)
+        await maintenance.vacuum()
+        await maintenance.optimize()
+        busy, _, _ = await maintenance.checkpoint()
+        self.assertEqual(busy, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import asyncio
+import re
+import unittest
+from commons import message_context
+
+
+class TestMessageContext(unittest.IsolatedAsyncioTestCase):
+    def test_views(self):
+        """Test each view of a message's content"""
+        context = message_context.MessageContext(
+            "<@123> Thanks, I PAYED the deck 😺 <:catswag:989147563854823444>😺"
+        )
+        self.assertEqual(context.stripped, " Thanks, I PAYED the deck 😺 😺")
+        self.assertTrue(context.has_letters)
+        self.assertFalse(message_context.MessageContext("<@1> 123 !").has_letters)
+        self.assertEqual(context.emoji, ["<:catswag:989147563854823444>", "😺", "😺"])
+        self.assertEqual(message_context.MessageContext("Ｌo L").normalised, "lol")
+
+    def test_words_match_whole_word_search(self):
+        """Test that a word is in `words` exactly when a \\b search finds it"""
+        for text in ["hi", "this", "hi!", "Hi-there", "high", "say_hi", "(HELLO)"]:
+            for word in ["hi", "hello", "there"]:
+                found = re.search(rf"\b{word}\b", text, flags=re.IGNORECASE)
+                context = message_context.MessageContext(text)
+                self.assertEqual(word in context.words, bool(found), (text, word))
+
+    async def test_scope(self):
+        """Test that contexts are shared within a scope, including its tasks, and not outside"""
+        outside = message_context.of("hi")
+        self.assertIsNot(outside, message_context.of("hi"))
+        with message_context.scope() as contexts:
+            context = message_context.of("hi")
+            self.assertIs(context, message_context.of("hi"))
+            self.assertIsNot(context, message_context.of("hello"))
+
+            async def lookup():
+                return message_context.of("hi")
+
+            self.assertEqual(await asyncio.gather(lookup(), lookup()), [context] * 2)
+        with message_context.scope(contexts):
+            self.assertIs(message_context.of("hi"), context)
+        self.assertIsNot(message_context.of("hi"), context)
+
+
+if __name__ == "__main__":
+    unittest.main()
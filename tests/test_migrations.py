@@ -0,0 +1,215 @@
+import os
+import random
+import sqlite3
+import unittest
+from unittest import mock
+from commons.migrations import (
+    MIGRATIONS,
+    Migration,
+    Migrator,
+    migrate,
+    current_version,
+)
+
+
+def _create(m: Migrator):
+    m.execute("CREATE TABLE counts (user TEXT, count TEXT)")
+    m.execute("INSERT INTO counts VALUES ('1', '10'), ('2', '20'), ('3', '30')")
+
+
+def _add_column(m: Migrator):
+    m.add_column("counts", "extra", "INTEGER")
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def test_applies_in_order_once(self):
+        """Test that migrations run in version order and are recorded"""
+        migrations = [
+            Migration(2, "add column", _add_column),
+            Migration(1, "create", _create),
+        ]
+        migrate(self.conn, migrations)
+        migrate(self.conn, migrations)
+        self.assertEqual(current_version(self.conn), 2)
+        row = self.conn.execute("SELECT count(*) FROM counts").fetchone()
+        self.assertEqual(row[0], 3)
+
+    def test_failure_rolls_back(self):
+        """Test that a failing migration leaves no trace"""
+
+        def broken(m: Migrator):
+            m.execute("CREATE TABLE half_done (x)")
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            migrate(self.conn, [Migration(1, "broken", broken)])
+        self.assertEqual(current_version(self.conn), 0)
+        row = self.conn.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = 'half_done'"
+        ).fetchone()
+        self.assertEqual(row[0], 0)
+
+    def test_rebuild_table(self):
+        """Test that a rebuilt table keeps its rows with the new types"""
+
+        def retype(m: Migrator):
+            m.rebuild_table(
+                "counts",
+                "(user INTEGER, count INTEGER)",
+                ["user", "count"],
+                ["CAST(user AS INTEGER)", "CAST(count AS INTEGER)"],
+                ["CREATE UNIQUE INDEX counts_idx ON counts (user)"],
+                batch_size=2,
+            )
+
+        migrate(
+            self.conn, [Migration(1, "create", _create), Migration(2, "retype", retype)]
+        )
+        rows = self.conn.execute(
+            "SELECT typeof(user), count FROM counts ORDER BY rowid"
+        ).fetchall()
+        self.assertEqual(rows, [("integer", 10), ("integer", 20), ("integer", 30)])
+
+    def test_rebuild_is_not_repeated(self):
+        """Test that a rerun migration does not rebuild a table it already rebuilt"""
+        attempts: list[int] = []
+
+        def retype(m: Migrator):
+            m.rebuild_table(
+                "counts",
+                "(user INTEGER, count INTEGER)",
+                ["user", "count"],
+                ["CAST(user AS INTEGER) * 10", "count"],
+                batch_size=2,
+            )
+            m.rebuild_table("other", "(x INTEGER)", ["x"], batch_size=1)
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("interrupted")
+
+        def create_other(m: Migrator):
+            m.execute("CREATE TABLE other (x TEXT)")
+            m.execute("INSERT INTO other VALUES ('1'), ('2')")
+
+        setup = [Migration(1, "create", _create), Migration(2, "other", create_other)]
+        migrate(self.conn, setup)
+        with self.assertRaises(RuntimeError):
+            migrate(self.conn, [Migration(3, "retype", retype)])
+        migrate(self.conn, [Migration(3, "retype", retype)])
+        rows = self.conn.execute("SELECT user FROM counts ORDER BY rowid").fetchall()
+        self.assertEqual(rows, [(10,), (20,), (30,)])
+
+    def test_integer_snowflakes(self):
+        """Test that text ids and ISO times become integers and epoch milliseconds"""
+        migrate(self.conn, MIGRATIONS[:3])
+        self.conn.execute(
+            "INSERT INTO meme_stats VALUES ('12', '34', 7, '2024-01-01 12:00:00.123456+00:00', 7, 1, 'ok')"
+        )
+        self.conn.execute(
+            "INSERT INTO meme_score_rollup_hourly VALUES (1704067200, '12', '', 7, 1)"
+        )
+        self.conn.commit()
+        migrate(self.conn, MIGRATIONS)
+        row = self.conn.execute(
+            "SELECT user, message_id, time_sent FROM meme_stats"
+        ).fetchone()
+        self.assertEqual(row, (12, 34, 1704110400123))
+        row = self.conn.execute(
+            "SELECT user, channel FROM meme_score_rollup_hourly"
+        ).fetchone()
+        self.assertEqual(row, (12, 0))
+
+    def test_rollups_take_their_channels_guild(self):
+        """Test that rollup rows get the guild their channel's images were posted in, or the legacy one"""
+        migrate(self.conn, MIGRATIONS[:4])
+        self.conn.execute("INSERT INTO image_hashes VALUES ('h', 1, 5, 77, '')")
+        self.conn.execute(
+            "INSERT INTO message_rollup_daily VALUES (86400, 1, 5, 3), (86400, 1, 6, 4)"
+        )
+        self.conn.execute(
+            "INSERT INTO meme_score_rollup_hourly VALUES (3600, 1, 0, 7, 1)"
+        )
+        self.conn.commit()
+        with mock.patch.dict(os.environ, {"DEFAULT_GUILDS": "42,43"}):
+            migrate(self.conn, MIGRATIONS)
+        rows = self.conn.execute(
+            "SELECT guild, channel, count FROM message_rollup_daily ORDER BY channel"
+        ).fetchall()
+        self.assertEqual(rows, [(77, 5, 3), (42, 6, 4)])
+        row = self.conn.execute(
+            "SELECT guild, score_sum FROM meme_score_rollup_hourly"
+        ).fetchone()
+        self.assertEqual(row, (42, 7))
+
+    def test_emoji_rankings_follow_counts(self):
+        """Test that the emoji histogram and totals match emoji_counts through every kind of write"""
+        migrate(self.conn, MIGRATIONS[:6])
+        self.conn.execute("INSERT INTO emoji_counts VALUES (1, 1, 'a', 3)")
+        self.conn.commit()
+        migrate(self.conn, MIGRATIONS)
+        rng = random.Random(3)
+        for _ in range(2000):
+            guild, user, emoji = rng.randrange(2), rng.randrange(20), rng.choice("ab")
+            delta = rng.choice([1, 1, 2, -1])
+            self.conn.execute(
+                """
+                INSERT INTO emoji_counts VALUES (?, ?, ?, max(?, 0))
+                ON CONFLICT (guild, user, emoji) DO UPDATE
+                SET count = max(emoji_counts.count + ?, 0)""",
+                (guild, user, emoji, delta, delta),
+            )
+            if rng.random() < 0.01:
+                self.conn.execute("DELETE FROM emoji_counts WHERE user = ?", (user,))
+        histogram = self.conn.execute(
+            "SELECT guild, emoji, count, users FROM emoji_count_histogram ORDER BY 1, 2, 3"
+        ).fetchall()
+        expected = self.conn.execute(
+            "SELECT guild, emoji, count, count(*) FROM emoji_counts GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"
+        ).fetchall()
+        self.assertEqual(histogram, expected)
+        totals = self.conn.execute(
+            "SELECT guild, emoji, count FROM emoji_totals WHERE count > 0 ORDER BY 1, 2"
+        ).fetchall()
+        expected = self.conn.execute(
+            "SELECT guild, emoji, sum(count) FROM emoji_counts GROUP BY 1, 2 HAVING sum(count) > 0 ORDER BY 1, 2"
+        ).fetchall()
+        self.assertEqual(totals, expected)
+
+    def test_binary_message_hashes(self):
+        """Test that hex message hashes become their raw digest bytes"""
+        migrate(self.conn, MIGRATIONS[:7])
+        self.conn.execute("INSERT INTO message_hashes VALUES (1, 2, '00ff', 3)")
+        self.conn.commit()
+        migrate(self.conn, MIGRATIONS)
+        row = self.conn.execute("SELECT message_hash FROM message_hashes").fetchone()
+        self.assertEqual(row, (b"\x00\xff",))
+
+    def test_batched_resumes(self):
+        """Test that an interrupted batched step carries on where it stopped"""
+        seen: list[int] = []
+
+        def backfill(fail: bool):
+            def apply(m: Migrator):
+                def process(cursor: sqlite3.Cursor, rows: list[tuple[int, str]]):
+                    if fail and seen:
+                        raise RuntimeError("interrupted")
+                    seen.extend(row[0] for row in rows)
+
+                m.batched("backfill", "counts", process, "user", batch_size=1)
+
+            return apply
+
+        migrate(self.conn, [Migration(1, "create", _create)])
+        with self.assertRaises(RuntimeError):
+            migrate(self.conn, [Migration(2, "backfill", backfill(True))])
+        self.assertEqual(seen, [1])
+        migrate(self.conn, [Migration(2, "backfill", backfill(False))])
+        self.assertEqual(seen, [1, 2, 3])
+        self.assertEqual(current_version(self.conn), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Checks the query plan of every statement registered with `db.statement`
+against a seeded copy of the schema, so that a schema or query change that
+turns an index lookup into a table scan fails here instead of in production.
+"""
+
+import importlib
+import os
+import pkgutil
+import re
+import sqlite3
+import tempfile
+import unittest
+import commons.db as db
+from commons import migrations
+
+_GUILDS = 3
+_USERS = 500
+_EMOJI = 200
+_ROWS = 5000
+
+
+def _import_registering_modules() -> list[str]:
+    """Import every module that may register statements, returning those that could not be."""
+    skipped: list[str] = []
+    for package in ("commons", "behaviours", "commands"):
+        for info in pkgutil.iter_modules([package]):
+            try:
+                importlib.import_module(f"{package}.{info.name}")
+            except ImportError as e:
+                skipped.append(f"{package}.{info.name} (missing {e.name})")
+    try:
+        import behaviours
+
+        behaviours.duplicate_message_policing.load()
+        behaviours.meme_repost_blocker.load()
+    except ImportError:
+        pass
+    return skipped
+
+
+def _seed(conn: sqlite3.Connection):
+    conn.executemany(
+        "INSERT INTO message_counts VALUES (?, ?, ?)",
+        [(user % _GUILDS, user, user * 7 % 1000) for user in range(_USERS)],
+    )
+    conn.executemany(
+        "INSERT INTO message_deletes VALUES (?, ?, ?)",
+        [(user % _GUILDS, user, user % 20) for user in range(_USERS)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO emoji_counts VALUES (?, ?, ?, ?)",
+        [(i % _GUILDS, i % _USERS, f"e{i % _EMOJI}", i % 50) for i in range(_ROWS)],
+    )
+    conn.executemany(
+        "INSERT INTO meme_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i % _USERS, 10**17 + i, i % 11, 1704067200000, 0, 0, None)
+            for i in range(_ROWS)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO message_hashes VALUES (?, ?, ?, ?)",
+        [(i % _USERS, 10**17 + i, i.to_bytes(16), 0) for i in range(_ROWS)],
+    )
+    conn.executemany(
+        "INSERT INTO image_hashes VALUES (?, ?, ?, ?, ?)",
+        [(f"{i:064x}", 10**17 + i, 1, 1, f"{i:064x}") for i in range(_ROWS)],
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+def _scanned_tables(conn: sqlite3.Connection, sql: str) -> list[str]:
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?"))
+    scanned: list[str] = []
+    for row in plan:
+        detail: str = row[3]
+        match = re.match(r"SCAN (\w+)", detail)
+        if match and match[1] in tables and "USING" not in detail:
+            scanned.append(match[1])
+    return scanned
+
+
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.skipped = _import_registering_modules()
+        cls.conn = sqlite3.connect(os.path.join(tempfile.mkdtemp(), "plans.sqlite"))
+        for name, (nargs, fn) in db._functions.items():  # type: ignore
+            cls.conn.create_function(name, nargs, fn)
+        migrations.migrate(cls.conn, migrations.MIGRATIONS)
+        _seed(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        if not db.statements():
+            self.skipTest(f"no statements registered, skipped {self.skipped}")
+
+    def test_statements_use_indexes(self):
+        """Test that statements not marked scan_ok never scan a whole table"""
+        for statement in db.statements():
+            if statement.scan_ok:
+                continue
+            with self.subTest(statement.label):
+                self.assertEqual(_scanned_tables(self.conn, statement.sql), [])
+
+    def test_scan_ok_is_still_needed(self):
+        """Test that statements marked scan_ok really do scan, so the flag is dropped once they stop"""
+        for statement in db.statements():
+            if not statement.scan_ok:
+                continue
+            with self.subTest(statement.label):
+                self.assertNotEqual(_scanned_tables(self.conn, statement.sql), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
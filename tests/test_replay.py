@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any
+import hikari
+from benchmarks.replay import BOT_ID, FakeApp
+from commons import recorder
+
+
+def user(id: int) -> dict[str, Any]:
+    return {"id": str(id), "username": "a", "discriminator": "0", "avatar": None}
+
+
+def message(id: int, author: int, content: str) -> dict[str, Any]:
+    return {
+        "id": str(id),
+        "channel_id": "2",
+        "guild_id": "3",
+        "author": user(author),
+        "member": {"roles": ["7"], "joined_at": "2024-01-01T00:00:00+00:00"},
+        "content": content,
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+
+
+def reaction(message: int, by: int, emoji: str) -> dict[str, Any]:
+    return {
+        "user_id": str(by),
+        "channel_id": "2",
+        "message_id": str(message),
+        "guild_id": "3",
+        "emoji": {"id": None, "name": emoji},
+    }
+
+
+class TestRecorder(unittest.TestCase):
+    def test_round_trip(self):
+        """Test that handled guild events are recorded in order and others are not"""
+        path = os.path.join(tempfile.mkdtemp(), "events.jsonl.gz")
+        r = recorder.Recorder(path)
+        r.record("MESSAGE_CREATE", message(10, 4, "hi 😺"))
+        r.record("TYPING_START", {"guild_id": "3"})
+        r.record("MESSAGE_DELETE", {"id": "10", "channel_id": "2"})
+        r.record("MESSAGE_DELETE", {"id": "10", "channel_id": "2", "guild_id": "3"})
+        r.close()
+        events = list(recorder.read(path))
+        self.assertEqual(
+            [name for _, name, _ in events], ["MESSAGE_CREATE", "MESSAGE_DELETE"]
+        )
+        self.assertEqual(events[0][2]["content"], "hi 😺")
+        self.assertLessEqual(events[0][0], events[1][0])
+
+    def test_close_writes_everything_queued(self):
+        """Test that events still queued for the writer thread are written on closing"""
+        path = os.path.join(tempfile.mkdtemp(), "events.jsonl.gz")
+        r = recorder.Recorder(path)
+        for i in range(1000):
+            r.record("MESSAGE_CREATE", message(i, 4, "hi"))
+        r.close()
+        events = list(recorder.read(path))
+        self.assertEqual([int(e[2]["id"]) for e in events], list(range(1000)))
+
+
+class TestFakeRest(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_what_was_seen(self):
+        """Test that messages, reactions and members replayed so far are served"""
+        app = FakeApp()
+        rest = app.rest
+        rest.observe("MESSAGE_CREATE", message(10, 4, "meme"))
+        rest.observe("MESSAGE_REACTION_ADD", reaction(10, 5, "💩"))
+        rest.observe("MESSAGE_REACTION_ADD", reaction(10, 6, "💩"))
+        rest.observe("MESSAGE_REACTION_REMOVE", reaction(10, 6, "💩"))
+
+        fetched = await rest.fetch_message(2, 10)
+        self.assertEqual(fetched.content, "meme")
+        self.assertEqual([(r.emoji, r.count) for r in fetched.reactions], [("💩", 1)])
+        await fetched.add_reaction("💩")
+        reactors = await rest.fetch_reactions_for_emoji(2, 10, "💩")
+        self.assertEqual(sorted(u.id for u in reactors), [BOT_ID, 5])
+
+        member = app.cache.get_guild(3).get_member(4)
+        roles = await member.fetch_roles()
+        self.assertEqual([r.id for r in roles], [3, 7])
+        self.assertEqual(app.cache.get_guild(3).get_member(99).id, 99)
+
+        response = await fetched.respond("nice")
+        self.assertEqual((await rest.fetch_message(2, response.id)).content, "nice")
+        await fetched.delete()
+        with self.assertRaises(hikari.NotFoundError):
+            await rest.fetch_message(2, 10)
+        self.assertEqual(rest.calls["fetch_message"], 3)
+
+    async def test_latency(self):
+        """Test that calls are answered after the configured latency"""
+        rest = FakeApp(latency=0.02).rest
+        started_at = asyncio.get_running_loop().time()
+        await rest.fetch_roles(3)
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - started_at, 0.015)
+
+
+if __name__ == "__main__":
+    unittest.main()
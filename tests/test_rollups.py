@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timezone
+import commons.db as db
+from commons import rollups
+from commons.counters import CounterAggregator
+
+
+class TestRollups(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db.execute("delete from message_rollup_hourly")
+        await db.execute("delete from message_rollup_daily")
+        await db.execute("delete from meme_score_rollup_hourly")
+
+    async def test_counts_are_bucketed(self):
+        """Test that counter rollups land in the hour and day they happened"""
+        aggregator = CounterAggregator(60, 1000)
+        for at in (
+            datetime(2024, 1, 1, 10, 5, tzinfo=timezone.utc),
+            datetime(2024, 1, 1, 10, 55, tzinfo=timezone.utc),
+            datetime(2024, 1, 1, 11, 0, tzinfo=timezone.utc),
+        ):
+            for rollup in (rollups.MESSAGES_HOURLY, rollups.MESSAGES_DAILY):
+                aggregator.add_rollup(rollup, at, (9, 1, 2))
+        # Another guild's messages stay out of this one's leaderboard.
+        aggregator.add_rollup(rollups.MESSAGES_DAILY, at, (8, 3, 4), 5)
+        await aggregator.flush()
+        hourly = await db.query(
+            "select bucket, count from message_rollup_hourly order by bucket"
+        )
+        self.assertEqual(hourly, [(1704103200, 2), (1704106800, 1)])
+        daily = await db.query(
+            "select bucket, count from message_rollup_daily where guild = 9"
+        )
+        self.assertEqual(daily, [(1704067200, 3)])
+        leaders = await rollups.message_leaderboard(9, datetime(2024, 1, 1, 12), 10)
+        self.assertEqual(leaders, [(1, 3)])
+
+    async def test_meme_scores_by_local_day(self):
+        """Test that meme scores are averaged per day in the given time zone"""
+
+        def rate(c: db.Cursor):
+            # 13:00 UTC is the next day at UTC+11.
+            for hour, score in ((1, 4), (2, 8), (13, 10)):
+                at = datetime(2024, 1, 1, hour, tzinfo=timezone.utc)
+                rollups.add_meme_score(c, 9, 1, 2, at, score, 1)
+            rollups.add_meme_score(c, 8, 1, 3, at, 0, 1)
+
+        await db.submit(rate, "test")
+        since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(
+            await rollups.meme_scores_by_day(9, since, 0),
+            [("2024-01-01", 22 / 3)],
+        )
+        self.assertEqual(
+            await rollups.meme_scores_by_day(9, since, 11 * 3600, 1),
+            [("2024-01-01", 6.0), ("2024-01-02", 10.0)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import unittest
+from types import SimpleNamespace
+from typing import Any
+import hikari
+from hikari.impl import entity_factory
+from commons.routing import Background, Dispatcher, Pipeline, route
+
+_factory = entity_factory.EntityFactoryImpl(SimpleNamespace())  # type: ignore
+
+
+def message_event(
+    channel: int, content: str = "", bot: bool = False, webhook: bool = False
+) -> hikari.GuildMessageCreateEvent:
+    payload: dict[str, Any] = {
+        "id": "1",
+        "channel_id": str(channel),
+        "guild_id": "3",
+        "author": {"id": "4", "username": "a", "discriminator": "0", "avatar": None},
+        "content": content,
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+    payload["author"]["bot"] = bot
+    if webhook:
+        payload["webhook_id"] = "5"
+    message = _factory.deserialize_message(payload)
+    return hikari.GuildMessageCreateEvent(shard=SimpleNamespace(), message=message)  # type: ignore
+
+
+@route(channels="TEST_ROUTING_CHANNELS")
+async def in_channel(event: hikari.GuildMessageCreateEvent) -> None:
+    pass
+
+
+@route(bots=False, webhooks=False, content=True)
+async def humans_with_content(event: hikari.GuildMessageCreateEvent) -> None:
+    pass
+
+
+@route(bots=False)
+async def no_bots(event: hikari.GuildMessageCreateEvent) -> None:
+    pass
+
+
+async def everything(event: hikari.GuildMessageCreateEvent) -> None:
+    pass
+
+
+class TestRouting(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_ROUTING_CHANNELS"] = "10,11"
+        self.dispatcher = Dispatcher(
+            [[in_channel], [humans_with_content, no_bots], [everything]]
+        )
+
+    def tearDown(self):
+        del os.environ["TEST_ROUTING_CHANNELS"]
+
+    def test_channels(self):
+        """Test that channel handlers only see their channels and emptied groups are dropped"""
+        groups = list(self.dispatcher.groups(message_event(11, "hi")))
+        self.assertEqual(
+            groups, [[in_channel], [humans_with_content, no_bots], [everything]]
+        )
+        groups = list(self.dispatcher.groups(message_event(12, "hi")))
+        self.assertEqual(groups, [[humans_with_content, no_bots], [everything]])
+
+    def test_message_filters(self):
+        """Test that authors and required content are filtered on"""
+        groups = list(self.dispatcher.groups(message_event(12)))
+        self.assertEqual(groups, [[no_bots], [everything]])
+        groups = list(self.dispatcher.groups(message_event(12, "hi", bot=True)))
+        self.assertEqual(groups, [[everything]])
+        groups = list(self.dispatcher.groups(message_event(12, "hi", webhook=True)))
+        self.assertEqual(groups, [[no_bots], [everything]])
+
+    def test_emoji(self):
+        """Test that reaction handlers only see their emoji"""
+
+        @route(emoji=["💩"])
+        async def poo(event: Any) -> None:
+            pass
+
+        dispatcher = Dispatcher([[poo, everything]])
+        event: Any = SimpleNamespace(channel_id=1, emoji_name="💩")
+        self.assertEqual(list(dispatcher.groups(event)), [[poo, everything]])
+        event = SimpleNamespace(channel_id=1, emoji_name="❓")
+        self.assertEqual(list(dispatcher.groups(event)), [[everything]])
+
+    def test_shed(self):
+        """Test that sheddable handlers are left out when shedding"""
+
+        @route(sheddable=True)
+        async def chatter(event: Any) -> None:
+            pass
+
+        dispatcher = Dispatcher([[no_bots], [chatter, everything]])
+        event = message_event(12, "hi")
+        self.assertEqual(
+            list(dispatcher.groups(event)), [[no_bots], [chatter, everything]]
+        )
+        self.assertEqual(
+            list(dispatcher.groups(event, shed=True)), [[no_bots], [everything]]
+        )
+
+    def test_pipeline(self):
+        """Test that background stages split a chain into the segments around them"""
+        pipeline = Pipeline(
+            [[no_bots], Background("slow", [[in_channel]]), [everything]]
+        )
+        first, second = pipeline.segments
+        event = message_event(11, "hi")
+        self.assertEqual(list(first.dispatcher.groups(event)), [[no_bots]])
+        [(name, stage)] = first.background
+        self.assertEqual((name, list(stage.groups(event))), ("slow", [[in_channel]]))
+        self.assertEqual(list(second.dispatcher.groups(event)), [[everything]])
+        self.assertEqual(second.background, [])
+
+        pipeline = Pipeline([[no_bots], Background("slow", [[in_channel]])])
+        self.assertTrue(pipeline.acts_on(message_event(11, bot=True)))
+        self.assertFalse(pipeline.acts_on(message_event(12, bot=True)))
+
+
+if __name__ == "__main__":
+    unittest.main()